@@ -62,6 +62,7 @@ func main() {
 				"TOP-ARGENTINIAN-MOVIES-BY-RATING": v.GetString("rabbitmq.join_queues.top-argentinian-movies-by-rating"),
 				"TOP-ARGENTINIAN-ACTORS":           v.GetString("rabbitmq.join_queues.top-argentinian-actors"),
 			},
+			SharedFilterQueue: v.GetString("rabbitmq.shared_filter_queue"),
 		},
 		EOFsCount: map[string]int{
 			"CONSULTA_1_FILTER": castToInt(os.Getenv("CONSULTA_1_FILTER")),
@@ -119,6 +120,7 @@ func InitConfig() (*viper.Viper, error) {
 	v.BindEnv("rabbitmq.filter_queues.sentiment-analysis")
 	v.BindEnv("rabbitmq.join_queues.top-argentinian-movies-by-rating")
 	v.BindEnv("rabbitmq.join_queues.top-argentinian-actors")
+	v.BindEnv("rabbitmq.shared_filter_queue")
 	// Try to read configuration from config file. If config file
 	// does not exists then ReadInConfig will fail but configuration
 	// can be loaded from the environment variables so we shouldn't
@@ -19,4 +19,6 @@ type RabbitMQConfig struct {
 	FilterQueues    map[string]string
 	JoinQueues      map[string]string
 	OutputQueueName string
+	// SharedFilterQueue, if set, receives each movies batch once for all its queries
+	SharedFilterQueue string
 }
@@ -221,6 +221,50 @@ func (g *Gateway) handleCommonMessage(
 	file, batchID, clientID string,
 	lines []string,
 	messageBuilderFunc func([]string, string) ([]byte, error),
+) {
+	if file == "MOVIES" && g.config.RabbitMQ.SharedFilterQueue != "" {
+		g.publishSharedMoviesMessage(queries, batchID, clientID, lines)
+	} else {
+		g.publishMessagePerQuery(queries, file, batchID, clientID, lines, messageBuilderFunc)
+	}
+
+	err := io.WriteMessage(conn, []byte(fmt.Sprintf("%s_ACK:%s", file, batchID)))
+	if err != nil {
+		g.logger.Errorf("failed trying to send movies ack: %v", err)
+		return
+	}
+}
+
+// publishSharedMoviesMessage publishes the batch once with the columns of every query.
+// Filters run all the queries listed in the Queries header over a single parse
+func (g *Gateway) publishSharedMoviesMessage(queries []string, batchID, clientID string, lines []string) {
+	body, err := g.buildSharedMoviesMessage(lines[1:])
+	if err != nil {
+		g.logger.Errorf("error trying to build message: %v", err)
+		return
+	}
+
+	err = g.broker.PublishMessage(
+		g.config.RabbitMQ.SharedFilterQueue,
+		map[string]interface{}{
+			"Queries":   strings.Join(queries, "|"),
+			"ClientID":  clientID,
+			"MessageID": batchID,
+			"BatchID":   batchID,
+			"type":      "MOVIES",
+		},
+		body,
+	)
+	if err != nil {
+		g.logger.Errorf("failed trying to publish message: %v", err)
+	}
+}
+
+func (g *Gateway) publishMessagePerQuery(
+	queries []string,
+	file, batchID, clientID string,
+	lines []string,
+	messageBuilderFunc func([]string, string) ([]byte, error),
 ) {
 	for _, query := range queries {
 		queueName, exists := g.getQueueNameByQuery(query, file)
@@ -251,12 +295,6 @@ func (g *Gateway) handleCommonMessage(
 			continue
 		}
 	}
-
-	err := io.WriteMessage(conn, []byte(fmt.Sprintf("%s_ACK:%s", file, batchID)))
-	if err != nil {
-		g.logger.Errorf("failed trying to send movies ack: %v", err)
-		return
-	}
 }
 
 func (g *Gateway) handleEOFMessage(conn net.Conn, queries []string, file, clientID string) {
@@ -312,6 +350,9 @@ func (g *Gateway) getQueueNameByQuery(query string, file string) (string, bool)
 		case QueryArgentinaEsp, QueryTopInvestors,
 			QueryTopArgentinianMoviesByRating,
 			QueryTopArgentinianActors, QuerySentimentAnalysis:
+			if g.config.RabbitMQ.SharedFilterQueue != "" {
+				return g.config.RabbitMQ.SharedFilterQueue, true
+			}
 			queueName, found := g.config.RabbitMQ.FilterQueues[query]
 			return queueName, found
 		default:
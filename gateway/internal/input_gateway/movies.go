@@ -45,6 +45,52 @@ func (g *Gateway) buildMoviesMessage(lines []string, query string) ([]byte, erro
 	return buf.Bytes(), nil
 }
 
+// buildSharedMoviesMessage keeps the union of the columns used by every query.
+// The per-query checks for empty fields are applied by the filter
+func (g *Gateway) buildSharedMoviesMessage(lines []string) ([]byte, error) {
+	var buf bytes.Buffer
+
+	csvWriter := csv.NewWriter(&buf)
+	csvWriter.Comma = ','
+
+	if err := csvWriter.Write(sharedMovieColumns); err != nil {
+		return nil, err
+	}
+
+	for _, line := range lines {
+		if strings.TrimSpace(line) == "" {
+			continue
+		}
+
+		elements := strings.Split(line, "|")
+		if len(elements) < 8 {
+			continue
+		}
+
+		if err := csvWriter.Write(elements[:8]); err != nil {
+			continue
+		}
+	}
+
+	csvWriter.Flush()
+	if err := csvWriter.Error(); err != nil {
+		return nil, err
+	}
+
+	return buf.Bytes(), nil
+}
+
+var sharedMovieColumns = []string{
+	"id",
+	"title",
+	"overview",
+	"budget",
+	"revenue",
+	"genres",
+	"production_countries",
+	"release_date",
+}
+
 func (g *Gateway) getMessageElementsByQuery(elements []string, query string) ([]string, error) {
 	switch query {
 	case QueryArgentinaEsp, QueryTopArgentinianMoviesByRating, QueryTopArgentinianActors:
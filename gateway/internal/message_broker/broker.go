@@ -104,6 +104,10 @@ func getQueueNamesFromConfig(config config.RabbitMQConfig) []string {
 		queueNames = append(queueNames, queue)
 	}
 
+	if config.SharedFilterQueue != "" {
+		queueNames = append(queueNames, config.SharedFilterQueue)
+	}
+
 	queueNames = append(queueNames, config.OutputQueueName)
 
 	return queueNames
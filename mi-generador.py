@@ -1,6 +1,15 @@
+import os
 import sys
 import yaml
 
+# Procesos del pool de cada filter (1 = sin pool)
+FILTER_PROCESOS = int(os.getenv("FILTER_PROCESOS", "1"))
+# Reparto de movies/ratings/credits entre joiners: round_robin o hash
+PARTICION_JOINERS = os.getenv("PARTICION_JOINERS", "round_robin")
+# Scan compartido: cada filter atiende todas las consultas sobre una sola cola de movies
+SCAN_COMPARTIDO = os.getenv("SCAN_COMPARTIDO", "0") == "1"
+COLA_SCAN_COMPARTIDO = "filter_request_movies"
+
 def get_joiners_consultas_from_compose(compose):
     joiners = {}
     for service_name, service in compose.get('services', {}).items():
@@ -66,6 +75,10 @@ def distribuir_consultas_por_nodo(cant_filter=1, cant_joiner=1, cant_aggregator=
         # Guardar la asignación de consultas por tipo
         distribucion[tipo] = asignacion
 
+    if SCAN_COMPARTIDO:
+        # Cualquier filter puede recibir cualquier batch de la cola compartida
+        distribucion["filter"] = {i: list(consultas_por_tipo["filter"]) for i in range(1, int(cant_filter) + 1)}
+
     return distribucion
 
 
@@ -93,9 +106,27 @@ def calcular_eof_enviar_filters(consultas_por_nodo):
     return resultado
 
 
+def calcular_shards_aggregator(distribucion):
+    """
+    Los aggregators que atienden una misma consulta se reparten los clientes
+    por hash del ClientID. Devuelve la cantidad de shards por consulta y el
+    shard de cada aggregator en cada una de sus consultas.
+    """
+    shards = {}
+    shard_por_nodo = {nodo: {} for nodo in distribucion["aggregator"]}
+    for nodo, consultas in sorted(distribucion["aggregator"].items()):
+        for consulta in consultas:
+            shard_por_nodo[nodo][consulta] = shards.get(consulta, 0)
+            shards[consulta] = shards.get(consulta, 0) + 1
+    return shards, shard_por_nodo
+
+
 def calcular_eofs(tipo, distribucion):
     """
     Devuelve el número de EOF_ESPERADOS para el tipo de worker dado según la distribución de consultas.
+    Con aggregators particionados la cuenta no cambia: cada productor manda
+    el EOF de un cliente solo al shard de ese cliente, asi que cada shard
+    espera, por cliente, un EOF de cada productor de la consulta.
     """
     eof_dict = {}
 
@@ -151,6 +182,7 @@ def agregar_broker(compose, anillo, puertos, cant_filter=1, cant_joiner=1, cant_
             f"EOF_ESPERADOS={eof_str_joiner}",
             f"EOF_ENVIAR={eof_str_agg}",
             f"JOINERS={str_joiners}",
+            f"PARTICION_JOINERS={PARTICION_JOINERS}",
             f"NODO_SIGUIENTE={anillo['broker']['siguiente']}",
             f"NODO_ANTERIOR={anillo['broker']['anterior']}",
             f"PUERTO={puertos['broker']}",
@@ -175,6 +207,8 @@ def agregar_workers(compose, anillo, puertos, cant_filter=1, cant_joiner=1, cant
     eof_pnl = calcular_eofs("pnl", consultas_por_nodo)
     eof_aggregator = calcular_eofs("aggregator", consultas_por_nodo)
     eof_enviar_por_filter = calcular_eof_enviar_filters(consultas_por_nodo)
+    shards_aggregator, shard_por_aggregator = calcular_shards_aggregator(consultas_por_nodo)
+    shards_str = ",".join(f"{k}:{v}" for k, v in shards_aggregator.items())
 
     tipos = {
         "filter": cant_filter,
@@ -190,11 +224,15 @@ def agregar_workers(compose, anillo, puertos, cant_filter=1, cant_joiner=1, cant
             env = [
                 f"WORKER_ID={i}",
                 f"WORKER_TYPE={tipo.upper()}",
-                f"CONSULTAS={','.join(map(str, consultas))}"
+                f"CONSULTAS={','.join(map(str, consultas))}",
+                f"AGGREGATOR_SHARDS={shards_str}"
             ]
 
             # EOF_ESPERADOS solo para ciertos tipos
-            if tipo == "joiner":
+            if tipo == "filter":
+                env.append(f"FILTER_PROCESOS={FILTER_PROCESOS}")
+                env.append(f"SCAN_COMPARTIDO={int(SCAN_COMPARTIDO)}")
+            elif tipo == "joiner":
                 eof_str = ",".join(f"{k}:{v}" for k, v in eof_joiner.items())
                 env.append(f"EOF_ESPERADOS={eof_str}")
             elif tipo == "pnl":
@@ -203,6 +241,8 @@ def agregar_workers(compose, anillo, puertos, cant_filter=1, cant_joiner=1, cant
             elif tipo == "aggregator":
                 eof_str = ",".join(f"{k}:{v}" for k, v in eof_aggregator.items())
                 env.append(f"EOF_ESPERADOS={eof_str}")
+                shard_str = ",".join(f"{k}:{v}" for k, v in shard_por_aggregator[i].items())
+                env.append(f"AGGREGATOR_SHARD={shard_str}")
 
             env.append(f"NODO_SIGUIENTE={anillo[nombre]['siguiente']}")
             env.append(f"NODO_ANTERIOR={anillo[nombre]['anterior']}")
@@ -423,6 +463,9 @@ def construir_env_input_gateway(consultas_por_nodo):
         nombre_env = "CONSULTA_" + str(numero_consulta) + "_JOIN"
         envs.append(f"{nombre_env}={cantidad_nodos}")
 
+    if SCAN_COMPARTIDO:
+        envs.append(f"CLI_RABBITMQ_SHARED_FILTER_QUEUE={COLA_SCAN_COMPARTIDO}")
+
     return envs
 
 
@@ -451,8 +494,6 @@ if __name__ == "__main__":
         clients = filters = joiners = aggregators = pnls = 1
     elif len(sys.argv) == 6:
         _, clients, filters, joiners, pnls, aggregators = sys.argv
-        if int(aggregators) > 4:
-            aggregators = '4'
     else:
         print("Uso: python3 mi-generador.py [clients filters joiners pnls aggregators]")
         sys.exit(1)
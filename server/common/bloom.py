@@ -0,0 +1,54 @@
+import hashlib
+import math
+import struct
+from common.utils import clave_particion
+
+# -------------------
+# FILTRO DE BLOOM
+# -------------------
+# Layout (little endian): bits(u32) | hashes(u8) | arreglo de bits
+# Las claves se normalizan igual que para particionar ("862.0" == 862),
+# asi el joiner y el broker coinciden sin importar como vino el id.
+
+CABECERA = struct.Struct("<IB")
+BITS_MINIMOS = 64
+
+
+class FiltroBloom:
+    def __init__(self, bits, hashes, arreglo=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.arreglo = arreglo if arreglo is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def para(cls, cantidad, falsos_positivos):
+        cantidad = max(cantidad, 1)
+        bits = max(BITS_MINIMOS, math.ceil(-cantidad * math.log(falsos_positivos) / math.log(2) ** 2))
+        hashes = max(1, round(bits / cantidad * math.log(2)))
+        return cls(bits, hashes)
+
+    def _posiciones(self, clave):
+        # Doble hashing: dos mitades de un unico digest generan las k posiciones
+        digest = hashlib.blake2b(clave_particion(clave).encode("utf-8"), digest_size=8).digest()
+        h1, h2 = struct.unpack("<II", digest)
+        # Con h2 par (o cero) las k posiciones pueden caer en muy pocos bits
+        h2 |= 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def agregar(self, clave):
+        for pos in self._posiciones(clave):
+            self.arreglo[pos >> 3] |= 1 << (pos & 7)
+
+    def contiene(self, clave):
+        return all(self.arreglo[pos >> 3] & (1 << (pos & 7)) for pos in self._posiciones(clave))
+
+    def serializar(self):
+        return CABECERA.pack(self.bits, self.hashes) + bytes(self.arreglo)
+
+    @classmethod
+    def deserializar(cls, datos):
+        bits, hashes = CABECERA.unpack_from(datos, 0)
+        arreglo = bytearray(datos[CABECERA.size:])
+        if len(arreglo) != (bits + 7) // 8:
+            raise ValueError("Filtro de Bloom truncado")
+        return cls(bits, hashes, arreglo)
@@ -0,0 +1,186 @@
+import struct
+import sys
+from array import array
+
+# -------------------
+# FORMATO COLUMNAR
+# -------------------
+# Layout (little endian):
+#   MAGIA(4) | version(u8) | reservado(u8) | filas(u32) | columnas(u16)
+#   por columna: largo_nombre(u16) | nombre(utf-8) | tipo(1 byte)
+#   por columna, en el mismo orden, los datos:
+#     INT / FLOAT: filas * 8 bytes empaquetados
+#     STR: (filas + 1) offsets u32 | blob utf-8
+
+MAGIA = b"TPCB"
+VERSION = 1
+VERSIONES_SOPORTADAS = {1}
+
+INT = b"q"
+FLOAT = b"d"
+STR = b"s"
+
+CABECERA = struct.Struct("<4sBBIH")
+LARGO = struct.Struct("<H")
+
+# Columnas numericas conocidas: si todos sus valores convierten limpio viajan empaquetadas
+COLUMNAS_NUMERICAS = {
+    "id": int,
+    "budget": float,
+    "revenue": float,
+    "rating": float,
+}
+
+_ES_BIG_ENDIAN = sys.byteorder == "big"
+
+# Rango de INT (q): lo que no entra viaja como STR
+INT_MINIMO = -2 ** 63
+INT_MAXIMO = 2 ** 63 - 1
+
+
+class FormatoInvalido(ValueError):
+    pass
+
+
+def _empaquetar(tipo, valores):
+    arr = array(tipo.decode(), valores)
+    if _ES_BIG_ENDIAN:
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _desempaquetar(tipo, datos):
+    arr = array(tipo.decode())
+    arr.frombytes(datos)
+    if _ES_BIG_ENDIAN:
+        arr.byteswap()
+    return arr
+
+
+def _a_str(valor):
+    # Mismo criterio que csv.DictWriter
+    return "" if valor is None else str(valor)
+
+
+def _entero_exacto(valor):
+    # Solo los textos que vuelven identicos: " 7 " o "08" quedan como STR
+    if type(valor) is int:
+        entero = valor
+    elif isinstance(valor, str):
+        entero = int(valor)
+        if str(entero) != valor:
+            raise ValueError(f"Entero no canonico: {valor!r}")
+    else:
+        raise TypeError(f"No es un entero: {valor!r}")
+    if not INT_MINIMO <= entero <= INT_MAXIMO:
+        raise OverflowError(f"Entero fuera de rango: {valor!r}")
+    return entero
+
+
+def _inferir_columna(nombre, valores):
+    try:
+        if valores and all(type(v) is int for v in valores):
+            return INT, [_entero_exacto(v) for v in valores]
+        if valores and all(type(v) in (int, float) for v in valores):
+            return FLOAT, [float(v) for v in valores]
+    except OverflowError:
+        return STR, [_a_str(v) for v in valores]
+
+    conversor = COLUMNAS_NUMERICAS.get(nombre)
+    if conversor is not None and valores:
+        try:
+            if conversor is int:
+                return INT, [_entero_exacto(v) for v in valores]
+            return FLOAT, [conversor(v) for v in valores]
+        except (ValueError, TypeError, OverflowError):
+            pass
+
+    return STR, [_a_str(v) for v in valores]
+
+
+def codificar_columnar(filas):
+    if not filas:
+        return b""
+    nombres = list(filas[0].keys())
+    cantidad = len(filas)
+
+    partes = [CABECERA.pack(MAGIA, VERSION, 0, cantidad, len(nombres))]
+    cuerpos = []
+    for nombre in nombres:
+        valores = [fila.get(nombre) for fila in filas]
+        tipo, valores = _inferir_columna(nombre, valores)
+
+        nombre_bytes = nombre.encode("utf-8")
+        partes.append(LARGO.pack(len(nombre_bytes)))
+        partes.append(nombre_bytes)
+        partes.append(tipo)
+
+        if tipo == STR:
+            codificados = [v.encode("utf-8") for v in valores]
+            offsets = [0] * (cantidad + 1)
+            acumulado = 0
+            for i, v in enumerate(codificados):
+                acumulado += len(v)
+                offsets[i + 1] = acumulado
+            cuerpos.append(_empaquetar(b"I", offsets))
+            cuerpos.append(b"".join(codificados))
+        else:
+            cuerpos.append(_empaquetar(tipo, valores))
+
+    return b"".join(partes + cuerpos)
+
+
+def es_columnar(datos):
+    return datos[:len(MAGIA)] == MAGIA
+
+
+def decodificar_columnas(datos):
+    """
+    Devuelve las columnas de un batch columnar como {nombre: valores}.
+    Las numericas quedan como array('q')/array('d'), sin parseo por fila.
+    """
+    datos = memoryview(datos)
+    if len(datos) < CABECERA.size:
+        raise FormatoInvalido("Batch columnar truncado")
+    magia, version, _, cantidad, n_columnas = CABECERA.unpack_from(datos, 0)
+    if magia != MAGIA:
+        raise FormatoInvalido("El mensaje no es un batch columnar")
+    if version not in VERSIONES_SOPORTADAS:
+        raise FormatoInvalido(f"Version de formato columnar no soportada: {version}")
+
+    pos = CABECERA.size
+    esquema = []
+    for _ in range(n_columnas):
+        (largo,) = LARGO.unpack_from(datos, pos)
+        pos += LARGO.size
+        nombre = bytes(datos[pos:pos + largo]).decode("utf-8")
+        pos += largo
+        tipo = bytes(datos[pos:pos + 1])
+        pos += 1
+        esquema.append((nombre, tipo))
+
+    columnas = {}
+    for nombre, tipo in esquema:
+        if tipo == STR:
+            fin_offsets = pos + (cantidad + 1) * 4
+            offsets = _desempaquetar(b"I", datos[pos:fin_offsets])
+            blob = bytes(datos[fin_offsets:fin_offsets + offsets[-1]])
+            pos = fin_offsets + offsets[-1]
+            columnas[nombre] = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(cantidad)]
+        elif tipo in (INT, FLOAT):
+            fin = pos + cantidad * 8
+            columnas[nombre] = _desempaquetar(tipo, datos[pos:fin])
+            pos = fin
+        else:
+            raise FormatoInvalido(f"Tipo de columna desconocido: {tipo!r}")
+
+    return columnas
+
+
+def decodificar_columnar(datos):
+    columnas = decodificar_columnas(datos)
+    if not columnas:
+        return []
+    nombres = list(columnas.keys())
+    valores = [columnas[n].tolist() if isinstance(columnas[n], array) else columnas[n] for n in nombres]
+    return [dict(zip(nombres, fila)) for fila in zip(*valores)]
@@ -0,0 +1,103 @@
+import os
+
+# -------------------
+# COMBINERS
+# -------------------
+# Reducen cada batch de salida a agregados parciales antes de mandarlo al
+# aggregator. El parcial sale con el mismo MessageID que hubieran tenido las
+# filas crudas, asi que la deduplicacion no cambia: un reenvio repite el
+# mismo parcial. Los parciales de las consultas 3, 4 y 5 llevan la columna
+# CANTIDAD, que es como el aggregator los distingue de las filas crudas.
+# Cada combiner acepta tanto filas crudas como parciales.
+
+COMBINER = os.getenv("COMBINER", "1") == "1"
+
+CANTIDAD = "count"
+
+
+def a_float(valor, defecto=None):
+    try:
+        return float(valor)
+    except (ValueError, TypeError):
+        return defecto
+
+
+def cantidad_parcial(fila):
+    # Una fila cruda cuenta como una observacion
+    valor = fila.get(CANTIDAD)
+    return 1 if valor is None else int(float(valor))
+
+
+def combinar_presupuestos(filas):
+    # Consulta 2: suma de budget por pais, mismo esquema que las filas crudas
+    sumas = {}
+    for fila in filas:
+        pais = fila.get("country")
+        sumas[pais] = sumas.get(pais, 0) + a_float(fila.get("budget", 0), 0)
+    return [{"country": pais, "budget": suma} for pais, suma in sumas.items()]
+
+
+def combinar_ratings(filas):
+    # Consulta 3: suma y cantidad de ratings por pelicula
+    parciales = {}
+    for fila in filas:
+        rating = a_float(fila.get("rating"))
+        if rating is None:
+            continue
+        clave = (str(fila["id"]), fila["title"])
+        suma, cantidad = parciales.get(clave, (0.0, 0))
+        parciales[clave] = (suma + rating, cantidad + cantidad_parcial(fila))
+    return [
+        {"id": movie_id, "title": title, "rating": suma, CANTIDAD: cantidad}
+        for (movie_id, title), (suma, cantidad) in parciales.items()
+    ]
+
+
+def combinar_actores(filas):
+    # Consulta 4: apariciones por actor
+    cantidades = {}
+    for fila in filas:
+        nombre = fila.get("name")
+        if nombre:
+            cantidades[nombre] = cantidades.get(nombre, 0) + cantidad_parcial(fila)
+    return [{"name": nombre, CANTIDAD: cantidad} for nombre, cantidad in cantidades.items()]
+
+
+def ratio_revenue_budget(fila):
+    budget = a_float(fila.get("budget"))
+    revenue = a_float(fila.get("revenue"))
+    if budget is None or revenue is None or budget == 0:
+        return 0.0
+    return revenue / budget
+
+
+def combinar_sentimientos(filas):
+    # Consulta 5: suma y cantidad de revenue/budget por sentimiento
+    parciales = {}
+    for fila in filas:
+        sentimiento = fila.get("sentiment", "UNKNOWN")
+        if CANTIDAD in fila:
+            ratio = a_float(fila.get("rate_revenue_budget"), 0.0)
+        else:
+            ratio = ratio_revenue_budget(fila)
+        suma, cantidad = parciales.get(sentimiento, (0.0, 0))
+        parciales[sentimiento] = (suma + ratio, cantidad + cantidad_parcial(fila))
+    return [
+        {"sentiment": sentimiento, "rate_revenue_budget": suma, CANTIDAD: cantidad}
+        for sentimiento, (suma, cantidad) in parciales.items()
+    ]
+
+
+COMBINADORES = {
+    2: combinar_presupuestos,
+    3: combinar_ratings,
+    4: combinar_actores,
+    5: combinar_sentimientos,
+}
+
+
+def combinar(request_id, filas):
+    # Lo que no es una lista de filas (False, EOF) pasa sin cambios
+    if not COMBINER or not isinstance(filas, list) or not filas or request_id not in COMBINADORES:
+        return filas
+    return COMBINADORES[request_id](filas)
@@ -3,10 +3,13 @@ import io
 from multiprocessing import Process
 import os
 import signal
+import time
+import zlib
 import pika # type: ignore
 import logging
-from common.utils import cargar_broker, cargar_eof_a_enviar, graceful_quit, initialize_log, lista_dicts_a_csv
+from common.utils import cargar_broker, cargar_eof_a_enviar, cargar_shard_aggregator, cargar_shards_aggregator, indice_shard, create_dataframe, get_coalescer_limits, get_compresion_limits, get_confirms_ventana, get_consumo_limits, graceful_quit, initialize_log, lista_dicts_a_csv
 from common.health import HealthMonitor
+from common.columnar import VERSION, VERSIONES_SOPORTADAS, codificar_columnar, decodificar_columnar
 
 # ----------------------
 # ENRUTAMIENTO DE MENSAJE
@@ -26,6 +29,55 @@ COLAS = {
     "joiner_request_4": "aggregator_request_4",
 }
 
+# Aggregators particionados por ClientID. Con un solo shard la cola no cambia
+COLAS_AGGREGATOR = {f"aggregator_request_{consulta_id}": consulta_id for consulta_id in (2, 3, 4, 5)}
+AGGREGATOR_SHARDS = cargar_shards_aggregator()
+
+def cantidad_shards(routing_key):
+    consulta_id = COLAS_AGGREGATOR.get(routing_key)
+    return AGGREGATOR_SHARDS.get(consulta_id, 1) if consulta_id is not None else 1
+
+def cola_shard(routing_key, shard):
+    return f"{routing_key}_{shard}"
+
+def destino_shard(routing_key, mensaje_original):
+    shards = cantidad_shards(routing_key)
+    if shards <= 1:
+        return routing_key
+    return cola_shard(routing_key, indice_shard(obtener_client_id(mensaje_original), shards))
+
+def colas_shards(routing_key):
+    shards = cantidad_shards(routing_key)
+    if shards <= 1:
+        return [routing_key]
+    return [cola_shard(routing_key, shard) for shard in range(shards)]
+
+# Scan compartido: el gateway publica cada batch de movies una sola vez,
+# con las columnas de todas las consultas y la lista en el header Queries
+COLA_SCAN_COMPARTIDO = "filter_request_movies"
+SCAN_COMPARTIDO = os.getenv("SCAN_COMPARTIDO", "0") == "1"
+
+# Colas que consume el gateway (Go): siempre viajan en CSV
+COLAS_EXTERNAS = {"gateway_output"}
+
+FORMATO_CSV = "csv"
+FORMATO_COLUMNAR = "columnar"
+FORMATO_MENSAJES = os.getenv("FORMATO_MENSAJES", FORMATO_COLUMNAR)
+
+COMPRESION_ZLIB = "zlib"
+COMPRESION_UMBRAL, COMPRESION_NIVEL, COMPRESION_REPORTE = get_compresion_limits()
+
+# Difusiones del broker: una sola publicacion por exchange fanout
+EXCHANGE_PNL = "pnl_5_fanout"
+
+def exchange_joiners(consulta_id):
+    return f"joiner_{consulta_id}_fanout"
+
+# Semi-join: con las movies completas cada joiner le manda al broker un
+# filtro de Bloom con los ids que pueden matchear
+COLA_BROKER = "broker"
+BLOOM = "BLOOM"
+
 QUERY = {
     "ARGENTINIAN-SPANISH-PRODUCTIONS": 1,
     "TOP-INVESTING-COUNTRIES" : 2,
@@ -35,10 +87,29 @@ QUERY = {
 }
 
 
+NOMBRE_QUERY = {numero: nombre for nombre, numero in QUERY.items()}
+
+
 def obtener_query(mensaje):
     tipo = mensaje['headers'].get("Query")
     return QUERY[tipo]
 
+def obtener_consultas(mensaje):
+    # Solo los batches del scan compartido traen el header Queries
+    consultas = mensaje['headers'].get("Queries")
+    if not consultas:
+        return None
+    return sorted(QUERY[q] for q in consultas.split("|"))
+
+def mensaje_de_consulta(mensaje, request_id):
+    # Misma entrega (ack, retencion, body) vista como el mensaje de una sola consulta
+    headers = {k: v for k, v in mensaje['headers'].items() if k != "Queries"}
+    headers["Query"] = NOMBRE_QUERY[request_id]
+    return {**mensaje, 'headers': headers}
+
+def destino_filtro(request_id):
+    return COLAS[f"filter_request_{request_id}"]
+
 def config_header(mensaje_original, tipo=None):
     headers = {
         "Query": mensaje_original['headers'].get("Query"),
@@ -49,6 +120,10 @@ def config_header(mensaje_original, tipo=None):
     if message_id is not None:
         headers["MessageID"] = message_id
 
+    message_ids = mensaje_original['headers'].get("MessageIDs")
+    if message_ids is not None:
+        headers["MessageIDs"] = message_ids
+
     batch_id = mensaje_original['headers'].get("BatchID")
     if batch_id is not None:
         headers["BatchID"] = batch_id
@@ -64,12 +139,51 @@ def obtener_client_id(mensaje):
 def obtener_tipo_mensaje(mensaje):
     return mensaje['headers'].get("type")
 
+def obtener_joiner_id(mensaje):
+    return int(mensaje['headers'].get("JoinerID"))
+
+def obtener_datos(mensaje):
+    if mensaje['headers'].get("Compresion") == COMPRESION_ZLIB:
+        if 'datos' not in mensaje:
+            mensaje['datos'] = zlib.decompress(mensaje['body'])
+        return mensaje['datos']
+    return mensaje['body']
+
 def obtener_body(mensaje):
-    return mensaje['body'].decode('utf-8')
+    return obtener_datos(mensaje).decode('utf-8')
+
+def obtener_formato(mensaje):
+    formato = mensaje['headers'].get("Formato")
+    if formato is None:
+        return FORMATO_CSV
+    nombre, _, version = str(formato).partition("/")
+    if nombre == FORMATO_COLUMNAR and version.isdigit() and int(version) in VERSIONES_SOPORTADAS:
+        return FORMATO_COLUMNAR
+    logging.warning(f"Formato de mensaje no soportado: {formato}, se interpreta como CSV")
+    return FORMATO_CSV
+
+def obtener_filas(mensaje):
+    if obtener_formato(mensaje) == FORMATO_COLUMNAR:
+        return decodificar_columnar(obtener_datos(mensaje))
+    return create_dataframe(obtener_body(mensaje))
+
+def formato_salida(routing_key):
+    if routing_key in COLAS_EXTERNAS:
+        return FORMATO_CSV
+    return FORMATO_MENSAJES
 
 # ---------------------
 # GENERALES
 # ---------------------
+RUNTIME_BLOCKING = "blocking"
+RUNTIME_ASYNCIO = "asyncio"
+
+# Nodos donde un commit a disco o la inferencia no deben frenar el consumo
+RUNTIME_POR_TIPO = {
+    "joiner": RUNTIME_ASYNCIO,
+    "pnl": RUNTIME_ASYNCIO,
+}
+
 def run(tipo_nodo, nodo):
     proceso_nodo = Process(target=iniciar_nodo, args=(tipo_nodo, nodo))
     monitor = HealthMonitor(tipo_nodo)
@@ -92,13 +206,39 @@ def run(tipo_nodo, nodo):
 
 
 def iniciar_nodo(tipo_nodo, nodo):
+    global buffer_salida, control_consumo, confirmaciones
     initialize_log("INFO")
     nodo = nodo()
     consultas = os.getenv("CONSULTAS", "")
     worker_id = int(os.environ.get("WORKER_ID", 0))
     logging.info(f"Se inicializó el {tipo_nodo}")
     consultas = list(map(int, consultas.split(","))) if consultas else []
-    conexion, canal = inicializar_comunicacion()
+    transaction = getattr(nodo, "transaction", None)
+    limites = get_coalescer_limits() if tipo_nodo in TIPOS_COALESCER else None
+    prefetch, adaptativo, prefetch_maximo, ack_lote, ack_intervalo_ms = get_consumo_limits()
+    # Los mensajes retenidos por el coalescer ocupan ventana: nunca menos que eso
+    prefetch = max(prefetch, limites[2] if limites else 1, getattr(nodo, "prefetch_minimo", 1))
+    adaptativo = adaptativo and not getattr(nodo, "prefetch_fijo", False)
+    runtime = os.getenv("RUNTIME", RUNTIME_POR_TIPO.get(tipo_nodo, RUNTIME_BLOCKING))
+    logging.info(f"Runtime del {tipo_nodo}: {runtime}")
+    ventana_confirms = get_confirms_ventana()
+    if runtime == RUNTIME_ASYNCIO:
+        # Solo los nodos asyncio cargan el runtime (y asyncio)
+        from common.runtime_asyncio import ConfirmacionesPublicacion, inicializar_comunicacion_asyncio
+        conexion, canal = inicializar_comunicacion_asyncio(prefetch)
+        if ventana_confirms > 0:
+            confirmaciones = ConfirmacionesPublicacion(conexion, ventana_confirms, transaction)
+            canal.confirm_delivery(confirmaciones.on_confirm)
+    else:
+        conexion, canal = inicializar_comunicacion(prefetch)
+        if ventana_confirms > 0:
+            # Sin ventana: cada basic_publish espera su confirm antes de volver
+            canal.confirm_delivery()
+    control_consumo = ControlConsumo(conexion, canal, prefetch, adaptativo, max(prefetch, prefetch_maximo), ack_lote, ack_intervalo_ms, transaction, getattr(nodo, "deduplica", False))
+    if transaction is not None:
+        transaction.usar_temporizador(conexion.call_later)
+    if limites:
+        buffer_salida = BufferSalida(conexion, limites, transaction)
     graceful_quit(conexion, canal, nodo)
     if tipo_nodo == "broker":
         escuchar_colas_broker(nodo, canal)
@@ -110,43 +250,405 @@ def iniciar_nodo(tipo_nodo, nodo):
         escuchar_colas(tipo_nodo, nodo, consultas, canal)
 
 
-def inicializar_comunicacion():
+def inicializar_comunicacion(prefetch=1):
     parametros = pika.ConnectionParameters(host="rabbitmq")
     conexion = pika.BlockingConnection(parametros)
     canal = conexion.channel()
-    canal.basic_qos(prefetch_count=1)
+    canal.basic_qos(prefetch_count=prefetch)
     return conexion, canal
 
 
+def serializar_body(routing_key, body):
+    if isinstance(body, list) and body and formato_salida(routing_key) == FORMATO_COLUMNAR:
+        return codificar_columnar(body), f"{FORMATO_COLUMNAR}/{VERSION}"
+    return lista_dicts_a_csv(body).encode('utf-8'), None
+
+
 def enviar_mensaje(canal, routing_key, body, mensaje_original, type=None):
+    routing_key = destino_shard(routing_key, mensaje_original)
+    if buffer_salida is not None:
+        if isinstance(body, list) and body:
+            buffer_salida.agregar(canal, routing_key, body, mensaje_original, type)
+            return
+        # Lo acumulado sale siempre antes que un EOF (o cualquier cuerpo crudo)
+        buffer_salida.vaciar_destino(routing_key, mensaje_original)
+    publicar(canal, routing_key, body, mensaje_original, type)
+
+
+def asegurar_publicado():
+    # Todo lo publicado hasta aca queda en RabbitMQ: se vacia el coalescer y se esperan los confirms
+    if buffer_salida is not None:
+        buffer_salida.vaciar_pendientes()
+    if confirmaciones is not None:
+        confirmaciones.esperar_confirmaciones()
+
+
+def publicar(canal, routing_key, body, mensaje_original, type=None, retenciones=None, exchange=''):
     propiedades = config_header(mensaje_original, type)
-    csv_str = lista_dicts_a_csv(body)
-    if csv_str == "":
+    datos, formato = serializar_body(routing_key, body)
+    if datos == b"":
         return
-    canal.basic_publish(
-        exchange='',
-        routing_key=routing_key,
-        body=csv_str.encode('utf-8'),
-        properties=propiedades
-    )
+    if formato is not None:
+        propiedades.headers["Formato"] = formato
+    datos = comprimir(routing_key, datos, propiedades)
+    if retenciones is None:
+        retencion = mensaje_original.get('retencion')
+        retenciones = [retencion] if retencion is not None else []
+    basic_publish(canal, routing_key, datos, propiedades, retenciones, exchange)
+
+
+def reenviar_mensaje(canal, routing_key, mensaje_original, type=None, exchange=''):
+    # Reusa los bytes recibidos tal cual: solo se rearman los headers
+    if not mensaje_original['body']:
+        return
+    if buffer_salida is not None:
+        buffer_salida.vaciar_destino(routing_key, mensaje_original)
+    propiedades = config_header(mensaje_original, type)
+    for header in ("Formato", "Compresion"):
+        valor = mensaje_original['headers'].get(header)
+        if valor is not None:
+            propiedades.headers[header] = valor
+    retencion = mensaje_original.get('retencion')
+    basic_publish(canal, routing_key, mensaje_original['body'], propiedades, [retencion] if retencion is not None else [], exchange)
+
+
+def publicar_filtro(canal, mensaje_original, datos, joiner_id):
+    # El filtro viaja tal cual: son bits al azar, comprimirlo no reduce nada
+    propiedades = config_header(mensaje_original, BLOOM)
+    propiedades.headers["JoinerID"] = joiner_id
+    basic_publish(canal, COLA_BROKER, datos, propiedades, [])
+
+
+def basic_publish(canal, routing_key, datos, propiedades, retenciones, exchange=''):
+    if confirmaciones is not None:
+        # Si se nackea se vuelve a publicar, reteniendo otra vez lo mismo
+        reintento = lambda: basic_publish(canal, routing_key, datos, propiedades, retenciones, exchange)
+        confirmaciones.registrar(retenciones, reintento)
+    while True:
+        try:
+            canal.basic_publish(
+                exchange=exchange,
+                routing_key=routing_key,
+                body=datos,
+                properties=propiedades
+            )
+            return
+        except pika.exceptions.NackError:
+            # Canal bloqueante con confirms: el broker no tomo el mensaje
+            logging.warning(f"Publicacion a {routing_key} nackeada, reintentando")
+
+
+
+# ---------------------
+# COMPRESION
+# ---------------------
+estadisticas_compresion = {}
+
 
+def comprimir(routing_key, datos, propiedades):
+    if COMPRESION_UMBRAL <= 0 or len(datos) < COMPRESION_UMBRAL or routing_key in COLAS_EXTERNAS:
+        return datos
+    comprimidos = zlib.compress(datos, COMPRESION_NIVEL)
+    registrar_compresion(routing_key, len(datos), len(comprimidos))
+    if len(comprimidos) >= len(datos):
+        return datos
+    propiedades.headers["Compresion"] = COMPRESION_ZLIB
+    return comprimidos
 
 
+def registrar_compresion(routing_key, original, comprimido):
+    stats = estadisticas_compresion.setdefault(routing_key, [0, 0, 0])
+    stats[0] += original
+    stats[1] += min(original, comprimido)
+    stats[2] += 1
+    if stats[2] % COMPRESION_REPORTE == 0:
+        ratio = stats[0] / stats[1] if stats[1] else 0
+        logging.info(f"Compresion en {routing_key}: {stats[2]} mensajes, {stats[0]} -> {stats[1]} bytes (ratio {ratio:.2f})")
+
+
+# ---------------------
+# PREFETCH Y ACKS
+# ---------------------
+confirmaciones = None
+
+MUESTRAS_AJUSTE = 20
+
+control_consumo = None
+
+
+class ControlConsumo:
+    """
+    Acumula los acks del canal y los manda acumulados (multiple=True) hasta
+    el mayor delivery tag contiguo ya procesado. Solo se acumula lo que el
+    nodo puede reconocer si se lo vuelven a entregar: los mensajes sin
+    MessageID (los EOF) y los de nodos sin deduplicacion se ackean apenas
+    terminan. Con prefetch adaptativo agranda la ventana mientras el nodo
+    quede esperando entregas entre mensajes y la achica cuando siempre
+    tiene trabajo encolado.
+    """
+    def __init__(self, conexion, canal, prefetch, adaptativo, prefetch_maximo, ack_lote, ack_intervalo_ms, transaction=None, deduplica=True):
+        self.conexion = conexion
+        self.canal = canal
+        self.prefetch_minimo = prefetch
+        self.prefetch = prefetch
+        self.adaptativo = adaptativo
+        self.prefetch_maximo = prefetch_maximo
+        self.ack_lote = ack_lote
+        self.ack_intervalo = ack_intervalo_ms / 1000
+        self.transaction = transaction
+        # Sin deduplicacion en el nodo, un reinicio volveria a procesar todo lo
+        # ya procesado sin ack: ahi se ackea cada mensaje apenas termina
+        self.deduplica = deduplica
+        self.completados = {}
+        self.sueltos = set()
+        self.ultimo_ackeado = 0
+        self.timer = None
+        self.inicio = None
+        self.fin_ultimo = None
+        self.espera = 0.0
+        self.proceso = 0.0
+        self.muestras = 0
+
+    def inicio_mensaje(self):
+        ahora = time.monotonic()
+        if self.fin_ultimo is not None:
+            self.espera += ahora - self.fin_ultimo
+        self.inicio = ahora
+
+    def fin_mensaje(self):
+        ahora = time.monotonic()
+        self.proceso += ahora - self.inicio
+        self.fin_ultimo = ahora
+        self.muestras += 1
+        if self.adaptativo and self.muestras >= MUESTRAS_AJUSTE:
+            self.ajustar_prefetch()
+
+    def ajustar_prefetch(self):
+        nuevo = self.prefetch
+        if self.espera > 0.1 * self.proceso:
+            nuevo = min(self.prefetch * 2, self.prefetch_maximo)
+        elif self.espera < 0.01 * self.proceso:
+            nuevo = max(self.prefetch - self.prefetch // 4, self.prefetch_minimo)
+        self.espera = self.proceso = 0.0
+        self.muestras = 0
+        if nuevo != self.prefetch:
+            logging.info(f"Prefetch ajustado de {self.prefetch} a {nuevo}")
+            self.prefetch = nuevo
+            self.canal.basic_qos(prefetch_count=nuevo)
+
+    def umbral_ack(self):
+        # Con la ventana llena a medias ya conviene liberar, aunque no se llegue al lote
+        return max(1, min(self.ack_lote, self.prefetch // 2))
+
+    def confirmar(self, delivery_tag, headers):
+        claves = None
+        if self.deduplica and self.transaction is not None:
+            claves = self.transaction.registrar_procesado(headers)
+        if not claves:
+            self.punto_durable()
+            self.canal.basic_ack(delivery_tag=delivery_tag)
+            if self.deduplica:
+                self.sueltos.add(delivery_tag)
+            return
+        self.completados[delivery_tag] = claves
+
+        contiguo = self.ultimo_contiguo()
+        if contiguo - self.ultimo_ackeado >= self.umbral_ack():
+            self.ack_hasta(contiguo)
+        elif self.timer is None:
+            self.timer = self.conexion.call_later(self.ack_intervalo, self.vencido)
+
+    def ultimo_contiguo(self):
+        # Los tags ya ackeados sueltos no cortan la racha, pero el ack acumulado
+        # tiene que apuntar a un tag que todavia no se haya ackeado
+        tag = objetivo = self.ultimo_ackeado
+        while tag + 1 in self.completados or tag + 1 in self.sueltos:
+            tag += 1
+            if tag in self.completados:
+                objetivo = tag
+        return objetivo
+
+    def punto_durable(self):
+        # Ningun ack sale antes de que los commits de su mensaje esten en disco
+        if self.transaction is not None:
+            self.transaction.sincronizar()
+
+    def ack_hasta(self, tag):
+        self.punto_durable()
+        self.canal.basic_ack(delivery_tag=tag, multiple=True)
+        claves = [self.completados.pop(t) for t in range(self.ultimo_ackeado + 1, tag + 1) if t in self.completados]
+        self.sueltos = {t for t in self.sueltos if t > tag}
+        self.ultimo_ackeado = tag
+        if self.transaction is not None:
+            self.transaction.olvidar_procesados(claves)
+        if not self.completados and self.timer is not None:
+            self.conexion.remove_timeout(self.timer)
+            self.timer = None
+
+    def vencido(self):
+        self.timer = None
+        contiguo = self.ultimo_contiguo()
+        if contiguo > self.ultimo_ackeado:
+            self.ack_hasta(contiguo)
+        # Un mensaje sin ack (retenido o con error) no puede frenar al resto de la ventana
+        sueltos = sorted(self.completados)
+        if sueltos:
+            self.punto_durable()
+        for tag in sueltos:
+            self.canal.basic_ack(delivery_tag=tag)
+        self.sueltos.update(sueltos)
+        if sueltos and self.transaction is not None:
+            self.transaction.olvidar_procesados([self.completados[t] for t in sueltos])
+        self.completados.clear()
+
+
+# ---------------------
+# COALESCER DE SALIDA
+# ---------------------
+# El aggregator queda afuera: publica un unico RESULT seguido del EOF por consulta
+TIPOS_COALESCER = {"filter", "joiner", "pnl"}
+
+buffer_salida = None
+
+
+class Retencion:
+    """
+    Estado compartido de un mensaje recibido: cuantas salidas suyas siguen
+    retenidas y si el nodo ya pidio el ack. El ack real sale cuando ambas
+    condiciones se cumplen.
+    """
+    def __init__(self, ack_real):
+        self.ack_real = ack_real
+        self.pendientes = 0
+        self.ack_pedido = False
+
+    def ack(self):
+        if self.pendientes > 0:
+            self.ack_pedido = True
+        else:
+            self.ack_real()
+
+    def retener(self):
+        self.pendientes += 1
+
+    def liberar(self):
+        self.pendientes -= 1
+        if self.pendientes == 0 and self.ack_pedido:
+            self.ack_pedido = False
+            self.ack_real()
+
+
+def estimar_bytes(filas):
+    return sum(len(v) if isinstance(v, str) else 8 for fila in filas for v in fila.values())
+
+
+class BufferSalida:
+    """
+    Junta los resultados chicos que van a un mismo (destino, ClientID, Query)
+    y los publica como un unico mensaje al llegar al limite de filas, bytes o
+    mensajes, o al vencer el linger. Los acks de los mensajes de entrada y su
+    NO_ENVIAR en el Transaction se demoran hasta que el lote se publica.
+    """
+    def __init__(self, conexion, limites, transaction=None):
+        self.conexion = conexion
+        self.max_filas, self.max_bytes, self.max_mensajes, linger_ms = limites
+        self.linger = linger_ms / 1000
+        self.transaction = transaction
+        self.entradas = {}
+        self.timer = None
+
+    def agregar(self, canal, routing_key, filas, mensaje_original, tipo):
+        headers = mensaje_original['headers']
+        clave = (routing_key, headers.get("ClientID"), headers.get("Query"), tipo, tuple(filas[0].keys()))
+        entrada = self.entradas.get(clave)
+        if entrada is None:
+            if not self.entradas:
+                if self.transaction is not None:
+                    self.transaction.retener_confirmaciones()
+                self.timer = self.conexion.call_later(self.linger, self.vaciar_todo)
+            entrada = {"canal": canal, "filas": [], "bytes": 0, "message_ids": [], "batch_id": None, "retenciones": []}
+            self.entradas[clave] = entrada
+
+        entrada["filas"].extend(filas)
+        entrada["bytes"] += estimar_bytes(filas)
+        message_id = headers.get("MessageID")
+        if message_id is not None and str(message_id) not in entrada["message_ids"]:
+            entrada["message_ids"].append(str(message_id))
+        if headers.get("BatchID") is not None:
+            entrada["batch_id"] = headers.get("BatchID")
+        retencion = mensaje_original.get('retencion')
+        if retencion is not None:
+            retencion.retener()
+            entrada["retenciones"].append(retencion)
+
+        if (len(entrada["filas"]) >= self.max_filas
+                or entrada["bytes"] >= self.max_bytes
+                or len(entrada["retenciones"]) >= self.max_mensajes):
+            self.vaciar(clave)
+
+    def vaciar(self, clave):
+        entrada = self.entradas.pop(clave)
+        routing_key, client_id, query, tipo, _ = clave
+        headers = {"Query": query, "ClientID": client_id}
+        message_ids = entrada["message_ids"]
+        if len(message_ids) == 1:
+            headers["MessageID"] = message_ids[0]
+        elif message_ids:
+            # Id acotado a primero-ultimo; los de origen viajan para deduplicar por cada uno
+            headers["MessageID"] = f"{message_ids[0]}-{message_ids[-1]}"
+            headers["MessageIDs"] = ",".join(message_ids)
+        if entrada["batch_id"] is not None:
+            headers["BatchID"] = entrada["batch_id"]
+        publicar(entrada["canal"], routing_key, entrada["filas"], {"headers": headers}, tipo, entrada["retenciones"])
+
+        if not self.entradas:
+            if self.timer is not None:
+                self.conexion.remove_timeout(self.timer)
+                self.timer = None
+            if self.transaction is not None:
+                self.transaction.liberar_confirmaciones()
+        for retencion in entrada["retenciones"]:
+            retencion.liberar()
+
+    def vaciar_destino(self, routing_key, mensaje_original):
+        headers = mensaje_original['headers']
+        for clave in list(self.entradas.keys()):
+            if clave[0] == routing_key and clave[1] == headers.get("ClientID") and clave[2] == headers.get("Query"):
+                self.vaciar(clave)
+
+    def vaciar_todo(self):
+        self.timer = None
+        self.vaciar_pendientes()
+
+    def vaciar_pendientes(self):
+        for clave in list(self.entradas.keys()):
+            self.vaciar(clave)
+
 
 # ---------------------
 # ATENDER CONSULTA
 # ---------------------
 
 def escuchar_colas(entrada, nodo, consultas, canal):        
+    shard_propio = cargar_shard_aggregator()
     for consulta_id in consultas:
         nombre_entrada = f"{entrada}_request_{consulta_id}"
         nombre_salida = COLAS[nombre_entrada]
+        if cantidad_shards(nombre_entrada) > 1:
+            nombre_entrada = cola_shard(nombre_entrada, shard_propio.get(consulta_id, 0))
 
         canal.queue_declare(queue=nombre_entrada, durable=True)
-        canal.queue_declare(queue=nombre_salida, durable=True)
+        declarar_salida(canal, nombre_salida)
 
         generalizo_callback(nombre_entrada, nombre_salida, canal, nodo)
 
+    if entrada == "filter" and SCAN_COMPARTIDO:
+        # Sin destino fijo: cada consulta publica en su cola de COLAS
+        canal.queue_declare(queue=COLA_SCAN_COMPARTIDO, durable=True)
+        for consulta_id in consultas:
+            declarar_salida(canal, destino_filtro(consulta_id))
+        generalizo_callback(COLA_SCAN_COMPARTIDO, None, canal, nodo)
+
     canal.start_consuming()
 
 
@@ -154,7 +656,7 @@ def escuchar_colas(entrada, nodo, consultas, canal):
 def escuchar_colas_broker(nodo, canal): 
     joiners = cargar_broker()
     pnl = cargar_eof_a_enviar()
-    nombre_entrada = "broker"
+    nombre_entrada = COLA_BROKER
     canal.queue_declare(queue=nombre_entrada, durable=True)
     colas_salida = []
     for joiner_id, consultas in joiners.items():
@@ -167,6 +669,12 @@ def escuchar_colas_broker(nodo, canal):
         canal.queue_declare(queue=nombre_salida, durable=True)
         generalizo_callback(nombre_entrada, nombre_salida, canal, nodo)
 
+    for joiner_id, consultas in joiners.items():
+        for consulta_id in consultas:
+            declarar_difusion(canal, exchange_joiners(consulta_id), f"joiner_request_{consulta_id}_{joiner_id}")
+    for i in range(1, pnl[5] + 1):
+        declarar_difusion(canal, EXCHANGE_PNL, f"pnl_request_5_{i}")
+
     canal.start_consuming()
 
 
@@ -180,30 +688,69 @@ def escuchar_colas_joiner(nodo, consultas, canal, joiner_id):
     for nombre_entrada in colas_entrada:
         canal.queue_declare(queue=nombre_entrada, durable=True)
         nombre_salida = "aggregator_request_3" if "3" in nombre_entrada else "aggregator_request_4"        
-        canal.queue_declare(queue=nombre_salida, durable=True)
+        declarar_salida(canal, nombre_salida)
         generalizo_callback(nombre_entrada, nombre_salida, canal, nodo)
 
+    for consulta_id in consultas:
+        declarar_difusion(canal, exchange_joiners(consulta_id), f"joiner_request_{consulta_id}_{joiner_id}")
+
     canal.start_consuming()
 
 def escuchar_colas_pnl(nodo, consultas, canal, pnl_id):   
 
     nombre_entrada = f"pnl_request_5_{pnl_id}"
     canal.queue_declare(queue=nombre_entrada, durable=True)
+    declarar_difusion(canal, EXCHANGE_PNL, nombre_entrada)
     nombre_salida = "aggregator_request_5"
-    canal.queue_declare(queue=nombre_salida, durable=True)
+    declarar_salida(canal, nombre_salida)
     generalizo_callback(nombre_entrada, nombre_salida, canal, nodo)
     canal.start_consuming()
 
 
+def declarar_salida(canal, nombre_salida):
+    # Se declaran todos los shards: el destino real se elige por ClientID al publicar
+    for cola in colas_shards(nombre_salida):
+        canal.queue_declare(queue=cola, durable=True)
+
+
+def declarar_difusion(canal, exchange, cola):
+    # Idempotente: tanto el broker como cada nodo destino declaran y bindean
+    canal.exchange_declare(exchange=exchange, exchange_type="fanout", durable=True)
+    canal.queue_declare(queue=cola, durable=True)
+    canal.queue_bind(queue=cola, exchange=exchange)
+
+
 def generalizo_callback(nombre_entrada, nombre_salida, canal, nodo):
+    transaction = getattr(nodo, "transaction", None)
+    def ack_durable(ch, tag):
+        if transaction is not None:
+            transaction.sincronizar()
+        ch.basic_ack(delivery_tag=tag)
+    def confirmar(ch, tag, headers):
+        # Las salidas del mensaje ya se publicaron: se compacta su ENVIAR
+        if transaction is not None:
+            transaction.liberar_envio(headers.get("MessageID"))
+        if control_consumo is not None:
+            control_consumo.confirmar(tag, headers)
+        else:
+            ack_durable(ch, tag)
     def make_callback(nombre_salida):
         def callback(ch, method, properties, body):
+            headers = properties.headers if properties.headers else {}
+            retencion = Retencion(lambda: confirmar(ch, method.delivery_tag, headers))
+            if control_consumo is not None:
+                control_consumo.inicio_mensaje()
             mensaje = {
                 'body': body,
-                'headers': properties.headers if properties.headers else {},
-                'ack': lambda: ch.basic_ack(delivery_tag=method.delivery_tag)
+                'headers': headers,
+                'ack': retencion.ack,
+                'retencion': retencion
             }
             nodo.procesar_mensajes(canal, nombre_salida, mensaje, enviar_mensaje)
+            if transaction is not None:
+                transaction.compactar_si_corresponde()
+            if control_consumo is not None:
+                control_consumo.fin_mensaje()
         return callback
 
     canal.basic_consume(
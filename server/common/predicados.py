@@ -0,0 +1,51 @@
+import numpy as np # type: ignore
+
+# -------------------
+# PREDICADOS POR LOTE
+# -------------------
+# Cada predicado recibe columnas del batch y devuelve una mascara booleana.
+# Las mascaras se combinan con & y el resultado se aplica una sola vez con
+# seleccionar(), asi no hay un if por fila en el filtro.
+
+SIN_ANIO = -1
+
+
+def columna_anios(filas, campo="release_date"):
+    # Las fechas que no parsearon quedan en SIN_ANIO y no entran en ningun rango
+    return np.fromiter(
+        (fecha.year if fecha else SIN_ANIO for fecha in (fila.get(campo) for fila in filas)),
+        dtype=np.int32,
+        count=len(filas)
+    )
+
+
+def columna_nombres(filas, campo):
+    # Lista de nombres ya decodificada -> "a, b" en minuscula, para buscar substrings
+    return np.array([", ".join(fila.get(campo, [])).lower() for fila in filas], dtype=np.str_)
+
+
+def columna_cantidad(filas, campo):
+    return np.fromiter((len(fila.get(campo, [])) for fila in filas), dtype=np.int32, count=len(filas))
+
+
+def rango_anios(anios, desde, hasta=None):
+    mascara = anios >= desde
+    if hasta is not None:
+        mascara &= anios < hasta
+    return mascara
+
+
+def contiene_todos(textos, valores):
+    # Mismo criterio que `valor in texto` sobre el string de paises en minuscula
+    mascara = np.ones(len(textos), dtype=bool)
+    for valor in valores:
+        mascara &= np.char.find(textos, valor) >= 0
+    return mascara
+
+
+def cantidad_igual(cantidades, valor):
+    return cantidades == valor
+
+
+def seleccionar(filas, mascara):
+    return [filas[i] for i in np.flatnonzero(mascara)]
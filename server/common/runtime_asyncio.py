@@ -0,0 +1,204 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pika # type: ignore
+from pika.adapters.asyncio_connection import AsyncioConnection # type: ignore
+
+# ---------------------
+# RUNTIME ASYNCIO
+# ---------------------
+# El event loop (hilo principal) es dueño de la conexion: recibe entregas,
+# publica y manda acks. Todo el codigo del nodo (procesar_mensajes, commits
+# al Transaction, timers del coalescer y de los acks) corre en un unico hilo
+# del executor, asi que sigue siendo secuencial y no necesita locks.
+
+
+def _ejecutar(funcion, *args):
+    try:
+        funcion(*args)
+    except Exception as e:
+        logging.exception(f"Error en el executor del nodo: {e}")
+
+
+class Temporizador:
+    def __init__(self):
+        self.cancelado = False
+
+
+class ConexionAsyncio:
+    def __init__(self, conexion, loop, executor):
+        self.conexion = conexion
+        self.loop = loop
+        self.executor = executor
+
+    @property
+    def is_open(self):
+        return self.conexion.is_open
+
+    def close(self):
+        self.conexion.close()
+        self.loop.stop()
+
+    def en_executor(self, funcion, *args):
+        self.executor.submit(_ejecutar, funcion, *args)
+
+    def call_later(self, delay, callback):
+        temporizador = Temporizador()
+
+        def disparar():
+            if not temporizador.cancelado:
+                callback()
+
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, self.en_executor, disparar)
+        return temporizador
+
+    def remove_timeout(self, temporizador):
+        temporizador.cancelado = True
+
+    def add_callback_threadsafe(self, callback):
+        self.en_executor(callback)
+
+
+class CanalAsyncio:
+    """
+    Expone la misma interfaz que el BlockingChannel que usan los nodos,
+    pero deriva cada operacion al event loop sin esperar la respuesta.
+    """
+    def __init__(self, canal, conexion):
+        self.canal = canal
+        self.conexion = conexion
+        self.loop = conexion.loop
+
+    @property
+    def is_open(self):
+        return self.canal.is_open
+
+    @property
+    def connection(self):
+        return self.conexion
+
+    def close(self):
+        self.canal.close()
+
+    def _en_loop(self, metodo, *args, **kwargs):
+        self.loop.call_soon_threadsafe(functools.partial(metodo, *args, **kwargs))
+
+    def basic_publish(self, **kwargs):
+        self._en_loop(self.canal.basic_publish, **kwargs)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._en_loop(self.canal.basic_ack, delivery_tag=delivery_tag, multiple=multiple)
+
+    def confirm_delivery(self, ack_nack_callback):
+        self._en_loop(self.canal.confirm_delivery, ack_nack_callback=ack_nack_callback)
+
+    def basic_qos(self, prefetch_count=0):
+        self._en_loop(self.canal.basic_qos, prefetch_count=prefetch_count)
+
+    def queue_declare(self, queue, durable=False):
+        self._en_loop(self.canal.queue_declare, queue=queue, durable=durable)
+
+    def exchange_declare(self, exchange, exchange_type="direct", durable=False):
+        self._en_loop(self.canal.exchange_declare, exchange=exchange, exchange_type=exchange_type, durable=durable)
+
+    def queue_bind(self, queue, exchange, routing_key=None):
+        self._en_loop(self.canal.queue_bind, queue=queue, exchange=exchange, routing_key=routing_key)
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        def recibir(_, method, properties, body):
+            self.conexion.en_executor(on_message_callback, self, method, properties, body)
+
+        self._en_loop(self.canal.basic_consume, queue=queue, on_message_callback=recibir, auto_ack=auto_ack)
+
+    def start_consuming(self):
+        self.loop.run_forever()
+
+
+class ConfirmacionesPublicacion:
+    """
+    Publisher confirms sin bloquear por mensaje: cada publicacion retiene el
+    ack de los mensajes de entrada que la originaron y el NO_ENVIAR del
+    Transaction hasta que llega su confirm. Si hay mas de `ventana`
+    publicaciones sin confirmar, el hilo del nodo espera.
+    """
+    def __init__(self, conexion, ventana, transaction=None):
+        self.conexion = conexion
+        self.ventana = ventana
+        self.transaction = transaction
+        self.condicion = threading.Condition()
+        self.secuencia = 0
+        self.en_vuelo = {}
+
+    def registrar(self, retenciones, reintento):
+        # Hilo del nodo. El orden de registro coincide con el de basic_publish en el canal
+        with self.condicion:
+            while len(self.en_vuelo) >= self.ventana:
+                self.condicion.wait()
+            self.secuencia += 1
+            self.en_vuelo[self.secuencia] = (retenciones, reintento)
+        for retencion in retenciones:
+            retencion.retener()
+        if self.transaction is not None:
+            self.transaction.retener_confirmaciones()
+
+    def esperar_confirmaciones(self):
+        # Hilo del nodo: vuelve cuando RabbitMQ confirmo todo lo publicado
+        with self.condicion:
+            while self.en_vuelo:
+                self.condicion.wait()
+
+    def on_confirm(self, frame):
+        # Hilo del event loop: solo libera la ventana, el resto va al hilo del nodo
+        metodo = frame.method
+        with self.condicion:
+            if metodo.multiple:
+                tags = sorted(t for t in self.en_vuelo if t <= metodo.delivery_tag)
+            else:
+                tags = [metodo.delivery_tag] if metodo.delivery_tag in self.en_vuelo else []
+            confirmados = [self.en_vuelo.pop(t) for t in tags]
+            self.condicion.notify_all()
+        if confirmados:
+            self.conexion.en_executor(self.retirar, confirmados, isinstance(metodo, pika.spec.Basic.Ack))
+
+    def retirar(self, confirmados, es_ack):
+        for retenciones, reintento in confirmados:
+            if not es_ack:
+                logging.error("RabbitMQ rechazo una publicacion, se reintenta")
+                reintento()
+            for retencion in retenciones:
+                retencion.liberar()
+            if self.transaction is not None:
+                self.transaction.liberar_confirmaciones()
+
+
+def inicializar_comunicacion_asyncio(prefetch=1):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    canal_abierto = loop.create_future()
+
+    def on_open(conexion):
+        conexion.channel(on_open_callback=lambda canal: canal_abierto.set_result(canal))
+
+    def on_open_error(_, error):
+        canal_abierto.set_exception(error)
+
+    def on_close(_, motivo):
+        logging.warning(f"Conexion con RabbitMQ cerrada: {motivo}")
+        loop.stop()
+
+    parametros = pika.ConnectionParameters(host="rabbitmq")
+    conexion = AsyncioConnection(
+        parametros,
+        on_open_callback=on_open,
+        on_open_error_callback=on_open_error,
+        on_close_callback=on_close,
+        custom_ioloop=loop
+    )
+    canal = loop.run_until_complete(canal_abierto)
+
+    conexion = ConexionAsyncio(conexion, loop, ThreadPoolExecutor(max_workers=1))
+    canal = CanalAsyncio(canal, conexion)
+    canal.basic_qos(prefetch_count=prefetch)
+    return conexion, canal
@@ -0,0 +1,127 @@
+import mmap
+import os
+import struct
+from common.columnar import codificar_columnar, decodificar_columnar
+
+# -------------------
+# SEGMENTOS DE SPILL
+# -------------------
+# Segmento (little endian), un registro por batch:
+#   largo_batch_id(u16) | largo_payload(u32) | batch_id(utf-8) | payload
+# El payload es el batch en formato columnar.
+#
+# Indice (<segmento>.idx), una entrada por registro:
+#   offset(u64) | largo_batch_id(u16) | batch_id(utf-8)
+#
+# El indice se escribe despues del registro: si el nodo se cae en el medio,
+# lo que falta se recupera recorriendo las cabeceras del segmento y un
+# registro truncado al final se descarta.
+
+REGISTRO = struct.Struct("<HI")
+ENTRADA = struct.Struct("<QH")
+SUFIJO_INDICE = ".idx"
+
+
+def ruta_indice(path):
+    return f"{path}{SUFIJO_INDICE}"
+
+
+def agregar_batches(path, batches):
+    """
+    Agrega al final del segmento una lista de (batch_id, filas) y sus
+    entradas en el indice.
+    """
+    registros = []
+    entradas = []
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    for batch_id, filas in batches:
+        if not filas:
+            continue
+        batch_id = str(batch_id).encode("utf-8")
+        payload = codificar_columnar(filas)
+        registros.append(REGISTRO.pack(len(batch_id), len(payload)) + batch_id + payload)
+        entradas.append(ENTRADA.pack(offset, len(batch_id)) + batch_id)
+        offset += REGISTRO.size + len(batch_id) + len(payload)
+    if not registros:
+        return
+    with open(path, "ab") as f:
+        f.write(b"".join(registros))
+        f.flush()
+    with open(ruta_indice(path), "ab") as f:
+        f.write(b"".join(entradas))
+        f.flush()
+
+
+def _leer_indice(path):
+    indice = []
+    try:
+        with open(ruta_indice(path), "rb") as f:
+            datos = f.read()
+    except FileNotFoundError:
+        return indice
+    pos = 0
+    while pos + ENTRADA.size <= len(datos):
+        offset, largo = ENTRADA.unpack_from(datos, pos)
+        pos += ENTRADA.size
+        if pos + largo > len(datos):
+            break
+        indice.append((datos[pos:pos + largo].decode("utf-8"), offset))
+        pos += largo
+    return indice
+
+
+def _recorrer_registros(datos, desde):
+    # (batch_id, offset) de cada registro completo a partir de `desde`
+    pos = desde
+    while pos + REGISTRO.size <= len(datos):
+        largo_id, largo_payload = REGISTRO.unpack_from(datos, pos)
+        fin = pos + REGISTRO.size + largo_id + largo_payload
+        if fin > len(datos):
+            break
+        yield bytes(datos[pos + REGISTRO.size:pos + REGISTRO.size + largo_id]).decode("utf-8"), pos
+        pos = fin
+
+
+def cargar_indice(path, datos):
+    """
+    Indice batch_id -> offset del segmento. Se completa con los registros
+    que quedaron escritos sin su entrada.
+    """
+    indice = [(batch_id, offset) for batch_id, offset in _leer_indice(path) if offset < len(datos)]
+    desde = 0
+    if indice:
+        ultimo_offset = indice[-1][1]
+        largo_id, largo_payload = REGISTRO.unpack_from(datos, ultimo_offset)
+        desde = ultimo_offset + REGISTRO.size + largo_id + largo_payload
+    indice.extend(_recorrer_registros(datos, desde))
+    return indice
+
+
+def leer_batches(path, batch_size, despues_de=None):
+    """
+    Devuelve (filas, batch_id) de a lo sumo `batch_size` filas. Con
+    `despues_de` arranca en el registro siguiente a ese batch_id, sin
+    decodificar lo que ya se habia enviado.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+        indice = cargar_indice(path, datos)
+        inicio = 0
+        if despues_de is not None:
+            for i, (batch_id, _) in enumerate(indice):
+                if batch_id == str(despues_de):
+                    inicio = i + 1
+                    break
+        for batch_id, offset in indice[inicio:]:
+            largo_id, largo_payload = REGISTRO.unpack_from(datos, offset)
+            pos = offset + REGISTRO.size + largo_id
+            filas = decodificar_columnar(datos[pos:pos + largo_payload])
+            for i in range(0, len(filas), batch_size):
+                yield filas[i:i + batch_size], batch_id
+
+
+def borrar_segmento(path):
+    for ruta in (path, ruta_indice(path)):
+        if ruta and os.path.exists(ruta):
+            os.remove(ruta)
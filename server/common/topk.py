@@ -0,0 +1,120 @@
+import heapq
+
+# -------------------
+# TOP-K MERGEABLE
+# -------------------
+# Dos estructuras con la misma interfaz (agregar, combinar, mayores):
+#   TopKExacto: suma exacta por clave. Combinar dos estados parciales da el
+#     mismo resultado que haber visto todo en un solo nodo.
+#   SpaceSaving: a lo sumo `capacidad` contadores. Cada cuenta sobreestima
+#     la real en a lo sumo su error, y una clave no seguida tiene cuenta
+#     real <= minimo(). Combinar sigue valiendo con esas cotas.
+# Los empates se resuelven por orden de aparicion, igual que Counter.most_common.
+
+
+class TopKExacto:
+    def __init__(self):
+        self.valores = {}
+
+    def __len__(self):
+        return len(self.valores)
+
+    def agregar(self, clave, valor=1):
+        self.valores[clave] = self.valores.get(clave, 0) + valor
+
+    def combinar(self, otro):
+        for clave, valor, _ in otro.entradas():
+            self.agregar(clave, valor)
+
+    def entradas(self):
+        return [(clave, valor, 0) for clave, valor in self.valores.items()]
+
+    def mayores(self, k):
+        return sorted(self.valores.items(), key=lambda x: x[1], reverse=True)[:k]
+
+
+class SpaceSaving:
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        # clave -> [cuenta, error]
+        self.contadores = {}
+        # (cuenta, orden, clave) con entradas viejas que se descartan al sacar
+        self.heap = []
+        self.orden = 0
+
+    def __len__(self):
+        return len(self.contadores)
+
+    def _encolar(self, clave):
+        self.orden += 1
+        heapq.heappush(self.heap, (self.contadores[clave][0], self.orden, clave))
+        if len(self.heap) > 4 * self.capacidad:
+            self.heap = [(c[0], i, k) for i, (k, c) in enumerate(self.contadores.items())]
+            heapq.heapify(self.heap)
+
+    def _sacar_minimo(self):
+        while True:
+            cuenta, _, clave = heapq.heappop(self.heap)
+            contador = self.contadores.get(clave)
+            if contador is not None and contador[0] == cuenta:
+                del self.contadores[clave]
+                return cuenta
+
+    def minimo(self):
+        # Cota para cualquier clave que no esta en el resumen
+        if len(self.contadores) < self.capacidad:
+            return 0
+        return min(c[0] for c in self.contadores.values())
+
+    def agregar(self, clave, valor=1):
+        contador = self.contadores.get(clave)
+        if contador is not None:
+            contador[0] += valor
+        else:
+            base = 0
+            if len(self.contadores) >= self.capacidad:
+                base = self._sacar_minimo()
+            self.contadores[clave] = [base + valor, base]
+        self._encolar(clave)
+
+    def restaurar(self, clave, cuenta, error):
+        # Vuelve a cargar un contador tal cual se guardo, con su error
+        self.contadores[clave] = [cuenta, error]
+        self._encolar(clave)
+
+    def combinar(self, otro):
+        # Lo que falta de un lado pudo haber tenido hasta su minimo: se suma
+        # a la cuenta y al error para no perder la sobreestimacion
+        propio, ajeno = self.minimo(), otro.minimo()
+        combinados = {}
+        for clave, (cuenta, error) in self.contadores.items():
+            combinados[clave] = [cuenta + ajeno, error + ajeno]
+        for clave, cuenta, error in otro.entradas():
+            if clave in self.contadores:
+                combinados[clave][0] += cuenta - ajeno
+                combinados[clave][1] += error - ajeno
+            else:
+                combinados[clave] = [cuenta + propio, error + propio]
+        mayores = sorted(combinados.items(), key=lambda x: x[1][0], reverse=True)[:self.capacidad]
+        self.contadores = dict(mayores)
+        self.heap = [(c[0], i, k) for i, (k, c) in enumerate(self.contadores.items())]
+        heapq.heapify(self.heap)
+
+    def entradas(self):
+        return [(clave, cuenta, error) for clave, (cuenta, error) in self.contadores.items()]
+
+    def mayores(self, k):
+        ordenados = sorted(self.contadores.items(), key=lambda x: x[1][0], reverse=True)
+        return [(clave, cuenta) for clave, (cuenta, _) in ordenados[:k]]
+
+    def cotas(self, k):
+        """
+        Error maximo de las k cuentas devueltas y cuantas de ellas estan
+        garantizadas en el top-k real (cuenta - error >= la cuenta k+1).
+        """
+        ordenados = sorted(self.contadores.values(), key=lambda c: c[0], reverse=True)
+        siguiente = ordenados[k][0] if len(ordenados) > k else self.minimo()
+        top = ordenados[:k]
+        error_maximo = max((error for _, error in top), default=0)
+        garantizados = sum(1 for cuenta, error in top if cuenta - error >= siguiente)
+        return error_maximo, garantizados
@@ -1,4 +1,7 @@
+from ast import literal_eval
 import os
+import time
+from common.utils import get_durabilidad_limits, get_snapshot_limits, parse_datos
 
 NO_ENVIAR = "no_enviar"
 ENVIAR = "enviar"
@@ -17,11 +20,29 @@ TERM = "termino_movies"
 DATA_TERM = "termino_datos"
 DISK = "archivos_en_disco"
 PATH = "archivos_path"
+SPILL_ENVIADO = "spill_enviado"
+CLIENTE_TERMINADO = "cliente_terminado"
 
 PNL = "pnl"
 
 ACCION = "accion"
 LAST_BATCH_ID = "ultimo_batch_id"    
+PROCESADO = "procesado"
+
+EPOCA = "epoca"
+
+MAX_IDS_RETENIDOS = 1024
+SNAPSHOT_ENTRADAS, SNAPSHOT_BYTES = get_snapshot_limits()
+
+# Durabilidad de los commits. Cada commit siempre sale con write + flush:
+#   ninguna: sin fsync
+#   grupo: un fsync por archivo para varios commits, antes de cada ack, al
+#     juntar GRUPO_MAX_COMMITS o a lo sumo GRUPO_INTERVALO_MS despues
+#   commit: fsync por commit
+DURABILIDAD_NINGUNA = "ninguna"
+DURABILIDAD_GRUPO = "grupo"
+DURABILIDAD_COMMIT = "commit"
+DURABILIDAD, GRUPO_INTERVALO_MS, GRUPO_MAX_COMMITS = get_durabilidad_limits()
 
 COMMITS = {
     RESULT: "/M",
@@ -35,9 +56,13 @@ COMMITS = {
     DATA_TERM: "/Y",
     DISK: "/K",
     PATH: "/P",
+    SPILL_ENVIADO: "/G",
+    CLIENTE_TERMINADO: "/F",
 
     ACCION: "/C",
-    LAST_BATCH_ID: "/B"
+    LAST_BATCH_ID: "/B",
+    PROCESADO: "/R",
+    EPOCA: "/Z"
 }
 
 SUFIJOS_A_CLAVE = {v: k for k, v in COMMITS.items()}
@@ -49,6 +74,84 @@ def parse_linea(linea):
     contenido = linea[:-2]
     return clave, contenido
 
+def leer_resultado(guardado):
+    # El resultado se guardo con repr: se vuelve a armar antes de reenviarlo
+    if guardado == "EOF":
+        return guardado
+    try:
+        return literal_eval(guardado)
+    except (ValueError, SyntaxError):
+        pass
+    try:
+        return parse_datos(guardado)
+    except ValueError:
+        return guardado
+
+def clave_mensaje(headers):
+    message_id = headers.get("MessageID")
+    if message_id is None:
+        return None
+    return f"{headers.get('ClientID')};{headers.get('Query')};{headers.get('type')};{message_id}"
+
+def claves_mensaje(headers):
+    # Un lote del coalescer trae los MessageID de origen: se deduplica por cada
+    # uno, asi un reenvio agrupado de otra forma se sigue reconociendo
+    origen = headers.get("MessageIDs")
+    if not origen:
+        clave = clave_mensaje(headers)
+        return [clave] if clave is not None else []
+    return [clave_mensaje({**headers, "MessageID": message_id}) for message_id in str(origen).split(",")]
+
+
+class ArchivoLog:
+    """
+    Archivo del Transaction abierto mientras viva el nodo. Las lineas de un
+    commit salen juntas en un unico write; sincronizar() ademas hace fsync.
+    Los archivos de un solo valor (acciones, ultimo batch, procesados al
+    compactarse) se reemplazan enteros.
+    """
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.archivo = None
+        self.pendiente = []
+        self.reemplazar = False
+        self.sucio = False
+
+    def agregar(self, linea):
+        self.pendiente.append(linea)
+
+    def reemplazar_con(self, lineas):
+        self.pendiente = list(lineas)
+        self.reemplazar = True
+
+    def escribir(self):
+        if not self.pendiente and not self.reemplazar:
+            return
+        if self.archivo is None:
+            self.archivo = open(self.ruta, "a")
+        if self.reemplazar:
+            self.archivo.seek(0)
+            self.archivo.truncate()
+            self.reemplazar = False
+        self.archivo.write("".join(self.pendiente))
+        self.archivo.flush()
+        self.pendiente = []
+        self.sucio = True
+
+    def sincronizar(self):
+        self.escribir()
+        if self.sucio:
+            os.fsync(self.archivo.fileno())
+            self.sucio = False
+
+    def cerrar(self):
+        if self.archivo is not None:
+            self.archivo.close()
+            self.archivo = None
+        self.pendiente = []
+        self.reemplazar = False
+        self.sucio = False
+
 
 class Transaction:
     def __init__(self, base_dir):
@@ -57,34 +160,209 @@ class Transaction:
         self.archivo = os.path.join(self.directorio, ".data")
         self.archivo_acciones = os.path.join(self.directorio, "-acciones.data")
         self.archivo_last_batch = os.path.join(self.directorio, "-last_batch.data")
-        self.ultima_accion = []
+        self.archivo_procesados = os.path.join(self.directorio, "-procesados.data")
+        self.archivo_snapshot = os.path.join(self.directorio, "-snapshot.data")
+        # Acciones del archivo de acciones al arrancar, por MessageID: la
+        # ultima, o varios ENVIAR si se cayo con publicaciones retenidas
+        self.acciones = {}
+        # ENVIAR que estan en el archivo y todavia no tienen su NO_ENVIAR
+        self.envios_abiertos = {}
+        # Snapshot + cola del log: la cola solo vale si es de la misma epoca que el snapshot
+        self.nodo = None
+        self.epoca = 0
+        self.entradas_log = 0
+        self.bytes_log = 0
+        self.entradas_snapshot = 0
+        self.bytes_snapshot = 0
+        # Mensajes ya procesados cuyo ack (acumulado) todavia puede no haber llegado al broker
+        self.procesados = {}
+        self.confirmaciones_retenidas = 0
+        self.ids_retenidos = []
+        self.logs = {}
+        self.commits_pendientes = 0
+        self.ultimo_sync = time.monotonic()
+        # call_later de la conexion: sincroniza aunque no lleguen mas commits
+        self.programar = None
+        self.timer_sync = None
+
+    def usar_temporizador(self, call_later):
+        self.programar = call_later
+
+    def log(self, ruta):
+        archivo = self.logs.get(ruta)
+        if archivo is None:
+            archivo = self.logs[ruta] = ArchivoLog(ruta)
+        return archivo
+
+    def despachar(self, archivo):
+        # El commit llega al sistema operativo siempre; lo que se agrupa es el fsync
+        archivo.escribir()
+        if DURABILIDAD == DURABILIDAD_COMMIT:
+            archivo.sincronizar()
+        elif DURABILIDAD == DURABILIDAD_GRUPO:
+            self.commits_pendientes += 1
+            if (self.commits_pendientes >= GRUPO_MAX_COMMITS
+                    or time.monotonic() - self.ultimo_sync >= GRUPO_INTERVALO_MS / 1000):
+                self.sincronizar()
+            elif self.programar is not None and self.timer_sync is None:
+                self.timer_sync = self.programar(GRUPO_INTERVALO_MS / 1000, self.sincronizar_vencido)
+
+    def sincronizar_vencido(self):
+        self.timer_sync = None
+        if self.commits_pendientes:
+            self.sincronizar()
+
+    def sincronizar(self):
+        """
+        Punto durable: todo lo commiteado hasta aca queda en disco. Los acks
+        de los mensajes salen recien despues de llamarlo.
+        """
+        for archivo in self.logs.values():
+            if DURABILIDAD == DURABILIDAD_NINGUNA:
+                archivo.escribir()
+            else:
+                archivo.sincronizar()
+        self.commits_pendientes = 0
+        self.ultimo_sync = time.monotonic()
+
+    def cerrar_logs(self):
+        for archivo in self.logs.values():
+            archivo.cerrar()
+        self.logs.clear()
+        self.commits_pendientes = 0
 
     def borrar_carpeta(self):
+        self.cerrar_logs()
         if os.path.exists(self.archivo):
             os.remove(self.archivo)
         if os.path.exists(self.archivo_acciones):
             os.remove(self.archivo_acciones)
         if os.path.exists(self.archivo_last_batch):
             os.remove(self.archivo_last_batch)
+        if os.path.exists(self.archivo_procesados):
+            os.remove(self.archivo_procesados)
+        if os.path.exists(self.archivo_snapshot):
+            os.remove(self.archivo_snapshot)
 
 
-    def cargar_ultima_accion(self, contenido):
-        message_id, resultado, accion = contenido.split("|", 2)
-        self.ultima_accion = [message_id, accion, resultado]
+    def cargar_accion(self, contenido):
+        # El resultado puede tener "|": el id va primero y la accion al final
+        message_id, resto = contenido.split("|", 1)
+        resultado, accion = resto.rsplit("|", 1)
+        # Un NO_ENVIAR de un envio combinado cubre varios MessageID separados por coma
+        for id_accion in message_id.split(","):
+            self.acciones.setdefault(id_accion, []).append((accion, resultado))
+            if accion == NO_ENVIAR:
+                self.envios_abiertos.pop(id_accion, None)
+        if accion == ENVIAR:
+            # Sigue abierto hasta que el mensaje redelivereado se libere
+            self.envios_abiertos.setdefault(message_id, []).append(f"{contenido}{COMMITS[ACCION]}\n")
 
     def mensaje_duplicado(self, client_id, message_id, enviar_func, mensaje, canal, destino):
-        if len(self.ultima_accion) == 0:
-            return False
-        if self.ultima_accion[0] == message_id:
-            if self.ultima_accion[1] == ENVIAR:
-                resultado = self.ultima_accion[2]
-                self.commit(ACCION, [destino, mensaje, client_id, message_id, resultado, ENVIAR])
-                tipo = "EOF" if resultado == "EOF" else "RESULT"
-                enviar_func(canal, destino, resultado, mensaje, tipo)
-                self.commit(ACCION, ["", "", client_id, message_id, "", NO_ENVIAR])
+        claves = claves_mensaje(mensaje['headers'])
+        if claves and all(clave in self.procesados for clave in claves):
             mensaje['ack']()
             return True
-        return False
+        if message_id is None:
+            return False
+        acciones = self.acciones.get(str(message_id))
+        if not acciones:
+            return False
+        for accion, guardado in acciones:
+            if accion != ENVIAR:
+                continue
+            resultado = leer_resultado(guardado)
+            self.commit(ACCION, [message_id, resultado, ENVIAR])
+            tipo = "EOF" if resultado == "EOF" else "RESULT"
+            enviar_func(canal, destino, resultado, mensaje, tipo)
+            self.commit(ACCION, [message_id, "", NO_ENVIAR])
+        mensaje['ack']()
+        return True
+
+    def registrar_procesado(self, headers):
+        claves = claves_mensaje(headers)
+        nuevas = [clave for clave in claves if clave not in self.procesados]
+        if not nuevas:
+            return claves
+        archivo = self.log(self.archivo_procesados)
+        for clave in nuevas:
+            self.procesados[clave] = True
+            archivo.agregar(f"{clave}{COMMITS[PROCESADO]}\n")
+        self.despachar(archivo)
+        return claves
+
+    def olvidar_procesados(self, claves):
+        cambios = False
+        for grupo in claves:
+            for clave in grupo or []:
+                if self.procesados.pop(clave, None) is not None:
+                    cambios = True
+        if not cambios:
+            return
+        archivo = self.log(self.archivo_procesados)
+        archivo.reemplazar_con(f"{clave}{COMMITS[PROCESADO]}\n" for clave in self.procesados)
+        self.despachar(archivo)
+
+    def retener_confirmaciones(self):
+        # Mientras haya salidas sin publicar, los NO_ENVIAR se acumulan en memoria
+        self.confirmaciones_retenidas += 1
+
+    def liberar_confirmaciones(self):
+        self.confirmaciones_retenidas -= 1
+        if self.confirmaciones_retenidas == 0 and self.ids_retenidos:
+            ids = self.ids_retenidos
+            self.ids_retenidos = []
+            self.cerrar_envios(ids)
+
+    def liberar_envio(self, message_id):
+        # Ya salieron todas las publicaciones del mensaje (su ack esta por irse)
+        if message_id is None:
+            return
+        message_id = str(message_id)
+        if message_id not in self.envios_abiertos and message_id not in self.ids_retenidos:
+            return
+        if message_id in self.ids_retenidos:
+            self.ids_retenidos.remove(message_id)
+        self.cerrar_envios([message_id])
+
+    def cerrar_envios(self, ids):
+        # Compacta el archivo de acciones: el NO_ENVIAR de `ids` y los ENVIAR
+        # que siguen abiertos, sin el resto de lo que se fue agregando
+        for message_id in ids:
+            self.envios_abiertos.pop(message_id, None)
+        lineas = [self.linea(ACCION, [",".join(ids), "", NO_ENVIAR])]
+        for abiertas in self.envios_abiertos.values():
+            lineas.extend(abiertas)
+        archivo = self.log(self.archivo_acciones)
+        archivo.reemplazar_con(lineas)
+        self.despachar(archivo)
+
+    def commit_accion(self, valores):
+        message_id = str(valores[0])
+        if valores[-1] == NO_ENVIAR:
+            if self.confirmaciones_retenidas == 0:
+                self.cerrar_envios(message_id.split(","))
+                return
+            # Con salidas sin publicar el NO_ENVIAR espera en memoria
+            if message_id not in self.ids_retenidos:
+                self.ids_retenidos.append(message_id)
+            if len(self.ids_retenidos) > MAX_IDS_RETENIDOS:
+                # Con retenciones solapadas el contador puede tardar en llegar a cero:
+                # el mas viejo se cierra en vez de quedar abierto para siempre
+                self.cerrar_envios([self.ids_retenidos.pop(0)])
+            return
+        commit = self.linea(ACCION, valores)
+        archivo = self.log(self.archivo_acciones)
+        if self.ids_retenidos or any(id_abierto != message_id for id_abierto in self.envios_abiertos):
+            # Hay un ENVIAR anterior sin publicar todavia: no se pisa
+            archivo.agregar(commit)
+        else:
+            self.envios_abiertos.clear()
+            archivo.reemplazar_con([commit])
+        self.envios_abiertos.setdefault(message_id, []).append(commit)
+        if len(self.envios_abiertos) > MAX_IDS_RETENIDOS:
+            self.cerrar_envios([next(iter(self.envios_abiertos))])
+        self.despachar(archivo)
 
 
 
@@ -94,30 +372,102 @@ class Transaction:
         if sufijo is None:
             raise ValueError(f"Clave '{clave}' no encontrada en COMMITS")
         try:
-            if isinstance(valores, dict):
-                contenido = str(valores)
-            else:
-                partes = [str(v) if not isinstance(v, (dict, list)) else repr(v) for v in valores]
-                contenido = "|".join(partes)
-
-            commit = f"{contenido}{sufijo}\n"
             if clave == ACCION:
-                ruta = self.archivo_acciones
-                modo = "w"
-            elif clave == LAST_BATCH_ID:
-                ruta = self.archivo_last_batch    
-                modo = "w"
+                self.commit_accion(valores)
+                return
+            commit = self.linea(clave, valores)
+            if clave == LAST_BATCH_ID:
+                archivo = self.log(self.archivo_last_batch)
+                archivo.reemplazar_con([commit])
             else:
-                ruta = self.archivo
-                modo = "a"
-            with open(ruta, modo) as f:
-                f.write(commit)
-                f.flush()
+                archivo = self.log(self.archivo)
+                archivo.agregar(commit)
+                self.entradas_log += 1
+                self.bytes_log += len(commit)
+            self.despachar(archivo)
         except Exception as e:
             raise Exception(f"Error serializando {clave}: {e}")
 
 
+    def linea(self, clave, valores):
+        if isinstance(valores, dict):
+            contenido = str(valores)
+        else:
+            partes = [str(v) if not isinstance(v, (dict, list)) else repr(v) for v in valores]
+            contenido = "|".join(partes)
+        return f"{contenido}{COMMITS[clave]}\n"
+
+
+    def compactar_si_corresponde(self):
+        # Se llama entre mensajes. La cola tiene que crecer al menos lo que
+        # ocupa el ultimo snapshot, asi reescribir el estado no domina el costo
+        if self.nodo is None or not hasattr(self.nodo, "entradas_snapshot"):
+            return
+        if SNAPSHOT_ENTRADAS > 0 and self.entradas_log >= max(SNAPSHOT_ENTRADAS, self.entradas_snapshot):
+            self.compactar()
+        elif SNAPSHOT_BYTES > 0 and self.bytes_log >= max(SNAPSHOT_BYTES, self.bytes_snapshot):
+            self.compactar()
+
+
+    def compactar(self):
+        """
+        Escribe el estado actual del nodo como entradas del log en un
+        snapshot nuevo y recien despues vacia el log. Si se cae en el medio,
+        el log viejo queda con la epoca anterior y no se vuelve a aplicar.
+        """
+        epoca = self.epoca + 1
+        lineas = [self.linea(clave, valores) for clave, valores in self.nodo.entradas_snapshot()]
+        # Lo pendiente de los otros archivos tiene que llegar a disco antes que el snapshot
+        self.sincronizar()
+        temporal = f"{self.archivo_snapshot}.tmp"
+        with open(temporal, "w") as f:
+            f.write(self.linea(EPOCA, [epoca]))
+            f.writelines(lineas)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.archivo_snapshot)
+        archivo = self.log(self.archivo)
+        archivo.reemplazar_con([self.linea(EPOCA, [epoca])])
+        archivo.sincronizar()
+        self.epoca = epoca
+        self.entradas_snapshot = len(lineas)
+        self.bytes_snapshot = sum(len(linea) for linea in lineas)
+        self.entradas_log = 0
+        self.bytes_log = 0
+
+
+    def reproducir(self, ruta, nodo, epoca):
+        # Devuelve la epoca del archivo. Un log de otra epoca ya esta en el snapshot.
+        # Un log sin cabecera es anterior a la primera compactacion: epoca 0
+        with open(ruta, "r") as f:
+            for i, linea in enumerate(f):
+                clave, contenido = parse_linea(linea)
+                if i == 0 and clave != EPOCA and epoca is not None and epoca != 0:
+                    return 0
+                if clave == EPOCA:
+                    if i == 0 and epoca is not None and int(contenido) != epoca:
+                        return int(contenido)
+                    epoca = int(contenido)
+                    continue
+                if ruta == self.archivo:
+                    self.entradas_log += 1
+                    self.bytes_log += len(linea)
+                else:
+                    self.entradas_snapshot += 1
+                    self.bytes_snapshot += len(linea)
+                nodo.reconstruir_estado(clave, contenido)
+        return epoca if epoca is not None else 0
+
+
     def cargar_estado(self, nodo):
+        self.nodo = nodo
+        try:
+            with open(self.archivo_procesados, "r") as f:
+                for linea in f:
+                    _, contenido = parse_linea(linea)
+                    self.procesados[contenido] = True
+        except FileNotFoundError:
+            pass
         try:
             try:
                 with open(self.archivo_last_batch, "r") as f:
@@ -128,14 +478,18 @@ class Transaction:
             except FileNotFoundError:
                 pass
 
-            with open(self.archivo, "r") as f:
-                for linea in f:
-                    clave, contenido = parse_linea(linea)
-                    nodo.reconstruir_estado(clave, contenido)
+            if os.path.exists(self.archivo_snapshot):
+                self.epoca = self.reproducir(self.archivo_snapshot, nodo, None)
+            # Un nodo sin estado propio solo tiene el archivo de acciones
+            if os.path.exists(self.archivo) and self.reproducir(self.archivo, nodo, self.epoca) != self.epoca:
+                # Caida entre el snapshot y el vaciado: el log viejo ya esta incluido
+                with open(self.archivo, "w") as f:
+                    f.write(self.linea(EPOCA, [self.epoca]))
+                    f.flush()
             with open(self.archivo_acciones, "r") as f:
                 for linea in f:
                     _, contenido = parse_linea(linea)
-                    self.cargar_ultima_accion(contenido)
+                    self.cargar_accion(contenido)
                 return True
         except FileNotFoundError:
             return False
\ No newline at end of file
@@ -1,5 +1,6 @@
 import ast
 from datetime import datetime
+from functools import lru_cache
 import io
 import logging
 import signal
@@ -7,9 +8,11 @@ import sys
 import pika # type: ignore
 from io import StringIO
 import os
+import re
 import configparser
 from pathlib import Path
 import csv
+import zlib
 
 def get_batch_limits(worker):
     config = configparser.ConfigParser()
@@ -24,6 +27,73 @@ def get_batch_limits(worker):
     if worker == "joiner":
         return v1, v2
 
+def get_coalescer_limits():
+    config = configparser.ConfigParser()
+    config_path = os.path.join(os.path.dirname(__file__), 'batch_limits.ini')
+    config.read(config_path)
+
+    filas = int(config['DEFAULT']['COALESCE_FILAS'])
+    max_bytes = int(config['DEFAULT']['COALESCE_BYTES'])
+    mensajes = int(config['DEFAULT']['COALESCE_MENSAJES'])
+    linger_ms = int(config['DEFAULT']['COALESCE_LINGER_MS'])
+    if filas <= 0:
+        return None
+    return filas, max_bytes, mensajes, linger_ms
+
+def get_consumo_limits():
+    config = configparser.ConfigParser()
+    config_path = os.path.join(os.path.dirname(__file__), 'batch_limits.ini')
+    config.read(config_path)
+
+    prefetch = os.getenv("PREFETCH", config['DEFAULT']['PREFETCH']).strip().lower()
+    prefetch_maximo = int(config['DEFAULT']['PREFETCH_MAXIMO'])
+    ack_lote = int(config['DEFAULT']['ACK_LOTE'])
+    ack_intervalo_ms = int(config['DEFAULT']['ACK_INTERVALO_MS'])
+    if prefetch == "auto":
+        return 1, True, prefetch_maximo, ack_lote, ack_intervalo_ms
+    return int(prefetch), False, int(prefetch), ack_lote, ack_intervalo_ms
+
+def get_confirms_ventana():
+    config = configparser.ConfigParser()
+    config_path = os.path.join(os.path.dirname(__file__), 'batch_limits.ini')
+    config.read(config_path)
+    return int(os.getenv("CONFIRMS_VENTANA", config['DEFAULT']['CONFIRMS_VENTANA']))
+
+def get_compresion_limits():
+    config = configparser.ConfigParser()
+    config_path = os.path.join(os.path.dirname(__file__), 'batch_limits.ini')
+    config.read(config_path)
+
+    umbral = int(os.getenv("COMPRESION_UMBRAL", config['DEFAULT']['COMPRESION_UMBRAL']))
+    nivel = int(config['DEFAULT']['COMPRESION_NIVEL'])
+    reporte = int(config['DEFAULT']['COMPRESION_REPORTE'])
+    return umbral, nivel, reporte
+
+def get_bloom_falsos_positivos():
+    config = configparser.ConfigParser()
+    config_path = os.path.join(os.path.dirname(__file__), 'batch_limits.ini')
+    config.read(config_path)
+    return float(os.getenv("BLOOM_FALSOS_POSITIVOS", config['DEFAULT']['BLOOM_FALSOS_POSITIVOS']))
+
+def get_snapshot_limits():
+    config = configparser.ConfigParser()
+    config_path = os.path.join(os.path.dirname(__file__), 'batch_limits.ini')
+    config.read(config_path)
+
+    entradas = int(config['DEFAULT']['SNAPSHOT_ENTRADAS'])
+    max_bytes = int(config['DEFAULT']['SNAPSHOT_BYTES'])
+    return entradas, max_bytes
+
+def get_durabilidad_limits():
+    config = configparser.ConfigParser()
+    config_path = os.path.join(os.path.dirname(__file__), 'batch_limits.ini')
+    config.read(config_path)
+
+    durabilidad = os.getenv("DURABILIDAD", config['DEFAULT']['DURABILIDAD']).strip().lower()
+    intervalo_ms = int(config['DEFAULT']['GRUPO_INTERVALO_MS'])
+    max_commits = int(config['DEFAULT']['GRUPO_MAX_COMMITS'])
+    return durabilidad, intervalo_ms, max_commits
+
 def initialize_log(logging_level):
     """
     Python custom logging initialization
@@ -89,8 +159,16 @@ def lista_dicts_a_csv(lista):
 
 
 def create_dataframe(data_str):
+    if isinstance(data_str, list):
+        return data_str
     return list(csv.DictReader(StringIO(data_str)))
 
+def proyectar_columnas(filas, columnas):
+    # Deja solo las columnas del esquema de salida; lo que no es lista pasa igual
+    if not isinstance(filas, list):
+        return filas
+    return [{columna: fila.get(columna) for columna in columnas} for fila in filas]
+
 def concat_data(batches):
     all_data = []
     for batch in batches:
@@ -104,49 +182,130 @@ def concat_data(batches):
     return all_data
 
 def dictionary_to_list(dictionary_str):
+    return extraer_claves(dictionary_str, "name")
+
+
+def _extraer_claves_literal_eval(texto, clave):
     try:
-        dictionary_list = ast.literal_eval(dictionary_str)  
-        if isinstance(dictionary_list, list):
-            return [data['name'] for data in dictionary_list if isinstance(data, dict) and 'name' in data]
+        lista = ast.literal_eval(texto)
+        if isinstance(lista, list):
+            return [data[clave] for data in lista if isinstance(data, dict) and clave in data]
         else:
             return []
-    except (ValueError, SyntaxError):
-        return [] 
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return []
 
 
-def prepare_data_consult_1_3_4(data):
-    rows = create_dataframe(data)
-    for row in rows:
-        # Parsear fecha
-        try:
-            row["release_date"] = datetime.strptime(row.get("release_date", ""), "%Y-%m-%d")
-        except (ValueError, TypeError):
-            row["release_date"] = None
-        
-        # Parsear géneros y países
-        row["genres"] = dictionary_to_list(row.get("genres", "[]"))
-        row["production_countries"] = dictionary_to_list(row.get("production_countries", "[]"))
-
-        # Guardar como string para búsqueda rápida
-        row["genres_str"] = ", ".join(row["genres"]).lower()
-        row["production_countries_str"] = ", ".join(row["production_countries"]).lower()
-    return rows
+_STRING = r"""'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*\""""
+_ESCALAR = r"-?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][-+]?\d+)?|None|True|False"
+_PAR = rf"\s*(?:{_STRING})\s*:\s*(?:{_STRING}|{_ESCALAR})\s*"
+_DICT = rf"\{{(?:{_PAR}(?:,{_PAR})*,?)?\s*\}}"
+# Lista plana de dicts con claves string y valores string/escalares, como el repr de TMDB
+_FORMA_LISTA_DICTS = re.compile(rf"\s*\[\s*(?:{_DICT}\s*(?:,\s*{_DICT}\s*)*,?)?\s*\]\s*")
+# Recorre la lista ya validada: cada match es un inicio de dict o un par completo,
+# asi nunca se mira el contenido de un string por separado
+_PARES = re.compile(rf"(\{{)|({_STRING})\s*:\s*({_STRING}|{_ESCALAR})")
 
 
-def prepare_data_consult_2(data):
-    data = create_dataframe(data)
-    resultado = []
-    for i, row in enumerate(data):
-        pc_str = row.get('production_countries', '[]')
-        row['production_countries'] = dictionary_to_list(pc_str)
+def _valor_literal(token):
+    # Sin barras el contenido es literal; escapes y escalares los resuelve el parser de Python
+    if token[0] in "'\"" and "\\" not in token:
+        return token[1:-1]
+    return ast.literal_eval(token)
+
 
+def _escanear_claves(texto, clave):
+    """
+    Recorre una vez un string con forma [{'k': v, ...}, ...] y devuelve los
+    valores de `clave`. Devuelve None si el string no tiene esa forma.
+    """
+    if _FORMA_LISTA_DICTS.fullmatch(texto) is None:
+        return None
+    literales = (f"'{clave}'", f'"{clave}"')
+    valores = []
+    actual = None
+    for inicio, llave, valor in _PARES.findall(texto):
+        if inicio:
+            if actual is not None:
+                valores.append(actual[0])
+            actual = None
+        elif llave in literales or ("\\" in llave and _valor_literal(llave) == clave):
+            # Con claves repetidas gana la ultima, igual que en un dict
+            actual = (_valor_literal(valor),)
+        elif "\\" in valor:
+            # Un escape invalido en cualquier valor hace fallar a literal_eval entero
+            _valor_literal(valor)
+    if actual is not None:
+        valores.append(actual[0])
+    return valores
+
+
+def extraer_claves(texto, clave="name"):
+    """
+    Devuelve los valores de `clave` de cada dict de una columna tipo
+    "[{'iso_3166_1': 'AR', 'name': 'Argentina'}]" sin armar el AST.
+    Mismo resultado que literal_eval + comprension: lo que el escaner no
+    reconoce (anidados, listas, basura) cae a literal_eval.
+    """
+    if isinstance(texto, str):
         try:
-            row['budget'] = float(row.get('budget', 0))
-        except (ValueError, TypeError):
-            row['budget'] = 0
-        
-        resultado.append(row)
-    return resultado
+            valores = _escanear_claves(texto, clave)
+        except (ValueError, SyntaxError):
+            valores = None
+        if valores is not None:
+            return valores
+    return _extraer_claves_literal_eval(texto, clave)
+
+
+@lru_cache(maxsize=32768)
+def parsear_fecha(valor):
+    # Camino rapido para "YYYY-MM-DD"; el resto lo resuelve strptime como siempre
+    if len(valor) == 10 and valor[4] == "-" and valor[7] == "-":
+        anio, mes, dia = valor[:4], valor[5:7], valor[8:]
+        if anio.isdigit() and mes.isdigit() and dia.isdigit():
+            try:
+                return datetime(int(anio), int(mes), int(dia))
+            except ValueError:
+                return None
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def _decodificar_fecha(row, campo):
+    valor = row.get(campo, "")
+    row[campo] = parsear_fecha(valor) if isinstance(valor, str) else None
+
+
+def _decodificar_nombres(row, campo):
+    row[campo] = dictionary_to_list(row.get(campo, "[]"))
+
+
+def _decodificar_float(row, campo):
+    try:
+        row[campo] = float(row.get(campo, 0))
+    except (ValueError, TypeError):
+        row[campo] = 0
+
+
+DECODIFICADORES = {
+    "release_date": _decodificar_fecha,
+    "genres": _decodificar_nombres,
+    "production_countries": _decodificar_nombres,
+    "budget": _decodificar_float,
+}
+
+
+def decodificar_columna(rows, campo):
+    """
+    Decodifica una sola columna en las filas recibidas. Pensado para
+    llamarse despues de cada filtro, sobre las filas que siguen vivas.
+    """
+    decodificar = DECODIFICADORES[campo]
+    for row in rows:
+        decodificar(row, campo)
+    return rows
 
 
 def prepare_data_consult_4(data):
@@ -156,11 +315,8 @@ def prepare_data_consult_4(data):
     for entry in data:
         cast_raw = entry.get('cast', '[]')
         if isinstance(cast_raw, str):
-            try:
-                cast_list = ast.literal_eval(cast_raw)
-                entry['cast'] = cast_list if isinstance(cast_list, list) else []
-            except Exception:
-                entry['cast'] = []
+            # Solo se usan los nombres de los actores
+            entry['cast'] = extraer_claves(cast_raw, 'name')
         elif isinstance(cast_raw, list):
             entry['cast'] = cast_raw
         else:
@@ -215,10 +371,65 @@ def cargar_datos_broker():
             if valor not in diccionario_invertido:
                 diccionario_invertido[valor] = []
             diccionario_invertido[valor].append(clave)
-    
+
+    # Ordenados: el particionado por hash necesita el mismo orden en cada reinicio
+    for consulta in diccionario_invertido:
+        diccionario_invertido[consulta].sort()
+
     return diccionario_invertido | {5: a_enviar[5]}
 
 
+# -------------------
+# PARTICIONADO
+# -------------------
+PARTICION_ROUND_ROBIN = "round_robin"
+PARTICION_HASH = "hash"
+
+def cargar_particion_joiners():
+    modo = os.getenv("PARTICION_JOINERS", PARTICION_ROUND_ROBIN).strip().lower()
+    return modo if modo == PARTICION_HASH else PARTICION_ROUND_ROBIN
+
+
+def clave_particion(movie_id):
+    # "862", 862 y "862.0" tienen que caer en la misma particion
+    valor = str(movie_id).strip()
+    try:
+        return str(int(float(valor)))
+    except ValueError:
+        return valor
+
+
+def indice_particion(movie_id, cantidad):
+    # crc32 y no hash(): el hash de str cambia entre procesos
+    return zlib.crc32(clave_particion(movie_id).encode("utf-8")) % cantidad
+
+
+# Aggregators: cada ClientID cae siempre en el mismo shard de la consulta
+def cargar_pares_env(nombre):
+    raw = os.getenv(nombre, "")
+    pares = {}
+    if raw:
+        for par in raw.split(","):
+            if ":" in par:
+                k, v = par.split(":")
+                pares[int(k)] = int(v)
+    return pares
+
+
+def cargar_shards_aggregator():
+    # consulta -> cantidad de aggregators que la atienden
+    return cargar_pares_env("AGGREGATOR_SHARDS")
+
+
+def cargar_shard_aggregator():
+    # consulta -> shard que atiende este aggregator
+    return cargar_pares_env("AGGREGATOR_SHARD")
+
+
+def indice_shard(client_id, cantidad):
+    return zlib.crc32(str(client_id).encode("utf-8")) % cantidad
+
+
 def cargar_broker():
     raw = os.getenv("JOINERS", "")
     eofs = {}
@@ -294,18 +505,6 @@ def obtener_message_id(mensaje):
 # NORMALIZATION
 # -------------------
 
-def write_dicts_to_csv(file_path, data, append=False):
-    if not data:
-        return
-    fieldnames = data[0].keys()
-    mode = 'a' if append else 'w'
-    with open(file_path, mode, newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not append:
-            writer.writeheader()
-        writer.writerows(data)
-
-
 def parse_datos(s, convertir_numeros=False):
     s = str(s).strip()
     if not s.startswith("[") or not s.endswith("]"):
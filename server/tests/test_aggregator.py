@@ -0,0 +1,69 @@
+from workers import aggregator
+from workers.aggregator import AggregatorNode
+from common.topk import SpaceSaving
+from common.utils import lista_dicts_a_csv
+
+
+def test_snapshot_conserva_el_error_de_spacesaving(tmp_path, monkeypatch):
+    monkeypatch.setattr(aggregator, "TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(aggregator, "TOPK_ACTORES", aggregator.TOPK_SPACESAVING)
+    monkeypatch.setattr(aggregator, "TOPK_CAPACIDAD", 2)
+    nodo = AggregatorNode()
+    nodo.eof_esperados["c"] = {4: 1}
+    nodo.acumular("c", 4, [{"name": n, "count": 1} for n in ["a", "b", "c", "c", "d"]])
+    original = sorted(nodo.estado_consulta("c", 4).entradas())
+    nodo.transaction.compactar()
+    nodo.transaction.cerrar_logs()
+
+    recuperado = AggregatorNode()
+    estado = recuperado.estado_consulta("c", 4)
+    assert isinstance(estado, SpaceSaving)
+    assert sorted(estado.entradas()) == original
+    assert any(error > 0 for _, _, error in original)
+
+
+def test_parciales_de_shards_se_combinan(tmp_path, monkeypatch):
+    monkeypatch.setattr(aggregator, "TMP_DIR", str(tmp_path))
+    nodo = AggregatorNode()
+    nodo.acumular("c", 2, [{"country": "AR", "budget": 10}, {"country": "US", "budget": 5}])
+    nodo.acumular("c", 2, [{"country": "US", "budget": 7}, {"country": "FR", "budget": 1}])
+    assert nodo.estado_consulta("c", 2).mayores(2) == [("US", 12.0), ("AR", 10.0)]
+    nodo.acumular("c", 4, [{"name": "a", "count": 2}, {"name": "b", "count": 1}])
+    nodo.acumular("c", 4, [{"name": "b", "count": 3}])
+    assert nodo.estado_consulta("c", 4).mayores(1) == [("b", 4)]
+
+
+def mensaje_aggregator(tipo, consulta, filas=None, message_id=None):
+    headers = {"type": tipo, "Query": consulta, "ClientID": "c", "MessageID": message_id}
+    body = lista_dicts_a_csv(filas).encode("utf-8") if filas else b""
+    return {"body": body, "headers": headers, "ack": lambda: None}
+
+
+def test_agregado_incremental_sobrevive_un_reinicio(tmp_path, monkeypatch):
+    monkeypatch.setattr(aggregator, "TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(aggregator, "cargar_eofs", lambda: {3: 1})
+    consulta = "TOP-ARGENTINIAN-MOVIES-BY-RATING"
+    lotes = [
+        [{"id": 1, "title": "Uno", "rating": 4.0}, {"id": 2, "title": "Dos", "rating": 1.0}],
+        [{"id": 1, "title": "Uno", "rating": 2.0, "count": 1}, {"id": 3, "title": "Tres", "rating": 6.0, "count": 3}],
+        [{"id": 2, "title": "Dos", "rating": 2.0}],
+    ]
+    enviados = []
+    enviar = lambda canal, destino, datos, mensaje, tipo: enviados.append((tipo, datos))
+
+    nodo = AggregatorNode()
+    for i, filas in enumerate(lotes[:2]):
+        nodo.procesar_mensajes(None, "gateway_output", mensaje_aggregator("RESULT", consulta, filas, str(i)), enviar)
+    # El log guarda un parcial por pelicula, no las filas recibidas
+    assert nodo.resultados_parciales["c"][3] == {("1", "Uno"): (6.0, 2), ("2", "Dos"): (1.0, 1), ("3", "Tres"): (6.0, 3)}
+    nodo.transaction.cerrar_logs()
+
+    nodo = AggregatorNode()
+    nodo.procesar_mensajes(None, "gateway_output", mensaje_aggregator("RESULT", consulta, lotes[2], "2"), enviar)
+    nodo.procesar_mensajes(None, "gateway_output", mensaje_aggregator("EOF", consulta, message_id="3"), enviar)
+
+    [(tipo, resultado), (tipo_eof, _)] = enviados
+    assert (tipo, tipo_eof) == ("RESULT", "EOF")
+    assert {fila["tipo"]: (fila["id"], fila["rating"]) for fila in resultado} == {"max": ("1", 3.0), "min": ("2", 1.5)}
+    assert "c" not in nodo.resultados_parciales
+    nodo.transaction.cerrar_logs()
@@ -0,0 +1,33 @@
+from common import bloom
+from common.bloom import FiltroBloom
+
+
+class DigestFijo:
+    def __init__(self, datos):
+        self.datos = datos
+
+    def digest(self):
+        return self.datos
+
+
+def test_h2_en_cero_no_repite_la_misma_posicion(monkeypatch):
+    monkeypatch.setattr(bloom.hashlib, "blake2b", lambda *args, **kwargs: DigestFijo(bytes([5, 0, 0, 0, 0, 0, 0, 0])))
+    filtro = FiltroBloom(1024, 7)
+    assert len(set(filtro._posiciones("862"))) == 7
+
+
+def test_sin_falsos_negativos_y_falsos_positivos_acotados():
+    filtro = FiltroBloom.para(2000, 0.01)
+    for i in range(2000):
+        filtro.agregar(i)
+    assert all(filtro.contiene(str(i)) for i in range(2000))
+    falsos = sum(filtro.contiene(i) for i in range(100000, 120000))
+    assert falsos / 20000 < 0.03
+
+
+def test_serializar_y_deserializar_conservan_el_filtro():
+    filtro = FiltroBloom.para(100, 0.05)
+    for i in range(100):
+        filtro.agregar(f"{i}.0")
+    copia = FiltroBloom.deserializar(filtro.serializar())
+    assert all(copia.contiene(i) for i in range(100))
@@ -0,0 +1,115 @@
+import zlib
+
+from common import communication
+from common.bloom import FiltroBloom
+from common.columnar import codificar_columnar
+from workers import broker
+from workers.broker import Broker
+
+
+def mensaje(tipo, headers=None, body=b""):
+    return {"body": body, "headers": {"type": tipo, "Query": "TOP-ARGENTINIAN-ACTORS", "ClientID": "c1", **(headers or {})},
+            "ack": lambda: None}
+
+
+def test_eof_de_datos_descarta_el_filtro_del_cliente(tmp_path, monkeypatch):
+    monkeypatch.setattr(broker, "TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(broker, "cargar_datos_broker", lambda: {3: [1], 4: [1], 5: 1})
+    monkeypatch.setattr(broker, "cargar_eofs", lambda: {3: 1, 4: 1, 5: 1})
+    monkeypatch.setattr(Broker, "distribuir_informacion", lambda self, *args: None)
+    nodo = Broker()
+    filtro = FiltroBloom.para(10, 0.01)
+    filtro.agregar(1)
+    nodo.procesar_mensajes(None, None, mensaje("BLOOM", {"JoinerID": 1}, filtro.serializar()), None)
+    assert nodo.filtro_para("c1", 4) is not None
+
+    nodo.procesar_mensajes(None, None, mensaje("EOF_CREDITS"), None)
+    assert nodo.filtro_para("c1", 4) is None
+    # Un filtro que llega tarde no vuelve a ocupar memoria
+    nodo.procesar_mensajes(None, None, mensaje("BLOOM", {"JoinerID": 1}, filtro.serializar()), None)
+    assert 4 not in nodo.filtros.get("c1", {})
+
+
+class CanalPublicacion:
+    def __init__(self):
+        self.publicados = []
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.publicados.append((exchange, routing_key, body, properties.headers))
+
+
+def broker_de_prueba(tmp_path, monkeypatch, joiners=(1,)):
+    monkeypatch.setattr(broker, "TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(broker, "cargar_datos_broker", lambda: {3: list(joiners), 4: list(joiners), 5: 1})
+    monkeypatch.setattr(broker, "cargar_eofs", lambda: {3: 1, 4: 1, 5: 1})
+    monkeypatch.setattr(communication, "confirmaciones", None)
+    return Broker()
+
+
+def test_ratings_se_reenvian_con_los_bytes_recibidos(tmp_path, monkeypatch):
+    nodo = broker_de_prueba(tmp_path, monkeypatch)
+    canal = CanalPublicacion()
+    body = zlib.compress(codificar_columnar([{"id": 862, "rating": 4.5}] * 50))
+    headers = {"MessageID": "9", "Formato": "columnar/1", "Compresion": "zlib"}
+    nodo.procesar_mensajes(canal, None, mensaje("CREDITS", headers, body), None)
+
+    [(exchange, routing_key, publicado, cabeceras)] = canal.publicados
+    assert (exchange, routing_key) == ("", "joiner_request_4_1")
+    assert publicado is body
+    assert cabeceras["Formato"] == "columnar/1"
+    assert cabeceras["Compresion"] == "zlib"
+    assert cabeceras["MessageID"] == "9"
+
+
+def test_movies_y_eof_salen_una_vez_por_el_fanout(tmp_path, monkeypatch):
+    nodo = broker_de_prueba(tmp_path, monkeypatch, joiners=(1, 2, 3))
+    canal = CanalPublicacion()
+    nodo.procesar_mensajes(canal, None, mensaje("MOVIES", {"MessageID": "1"}, b"id,title\n1,Uno\n"), None)
+    nodo.procesar_mensajes(canal, None, mensaje("EOF", {"MessageID": "2"}), None)
+
+    assert [(exchange, routing_key) for exchange, routing_key, _, _ in canal.publicados] == [
+        ("joiner_4_fanout", ""),
+        ("joiner_4_fanout", ""),
+    ]
+    assert [headers["type"] for _, _, _, headers in canal.publicados] == ["MOVIES", "EOF"]
+
+
+def test_la_difusion_declara_exchange_cola_y_binding():
+    llamadas = []
+
+    class CanalDeclaraciones:
+        def exchange_declare(self, exchange, exchange_type, durable):
+            llamadas.append(("exchange", exchange, exchange_type, durable))
+
+        def queue_declare(self, queue, durable):
+            llamadas.append(("cola", queue, durable))
+
+        def queue_bind(self, queue, exchange):
+            llamadas.append(("bind", queue, exchange))
+
+    communication.declarar_difusion(CanalDeclaraciones(), "joiner_3_fanout", "joiner_request_3_2")
+    assert llamadas == [
+        ("exchange", "joiner_3_fanout", "fanout", True),
+        ("cola", "joiner_request_3_2", True),
+        ("bind", "joiner_request_3_2", "joiner_3_fanout"),
+    ]
+
+
+def test_particion_por_hash_junta_las_filas_del_mismo_id(tmp_path, monkeypatch):
+    nodo = broker_de_prueba(tmp_path, monkeypatch, joiners=(1, 2, 3, 4))
+    nodo.particion = broker.PARTICION_HASH
+    canal = CanalPublicacion()
+    movies = [{"id": i, "title": f"Pelicula {i}"} for i in (862, 27205, 11)]
+    credits = [{"id": i, "cast": "[]"} for i in (11, 862, 862, 27205)]
+    nodo.procesar_mensajes(canal, None, mensaje("MOVIES", {"MessageID": "1", "Formato": "columnar/1"}, codificar_columnar(movies)), None)
+    nodo.procesar_mensajes(canal, None, mensaje("CREDITS", {"MessageID": "2", "Formato": "columnar/1"}, codificar_columnar(credits)), None)
+
+    destinos = {}
+    for _, routing_key, body, headers in canal.publicados:
+        for fila in communication.obtener_filas({"body": body, "headers": headers}):
+            destinos.setdefault(fila["id"], set()).add(routing_key)
+    assert destinos == {
+        862: {"joiner_request_4_4"},
+        27205: {"joiner_request_4_2"},
+        11: {"joiner_request_4_4"},
+    }
@@ -0,0 +1,18 @@
+from common.columnar import codificar_columnar, decodificar_columnar
+
+
+def test_enteros_fuera_de_rango_viajan_como_texto():
+    filas = [{"id": str(2 ** 63), "title": "a"}, {"id": "1", "title": "b"}]
+    assert decodificar_columnar(codificar_columnar(filas)) == filas
+    filas = [{"id": -2 ** 63 - 1}, {"id": 2}]
+    assert [fila["id"] for fila in decodificar_columnar(codificar_columnar(filas))] == [str(-2 ** 63 - 1), "2"]
+
+
+def test_ids_no_canonicos_conservan_el_texto():
+    filas = [{"id": " 7 "}, {"id": "08"}]
+    assert decodificar_columnar(codificar_columnar(filas)) == filas
+
+
+def test_ids_canonicos_se_empaquetan():
+    filas = [{"id": "862"}, {"id": "-3"}]
+    assert [fila["id"] for fila in decodificar_columnar(codificar_columnar(filas))] == [862, -3]
@@ -0,0 +1,31 @@
+from common.combiners import CANTIDAD, combinar
+
+CRUDAS = {
+    2: [{"country": p, "budget": b} for p, b in (("AR", 10), ("ES", 5), ("AR", "7.5"), ("US", ""), ("ES", 1))],
+    3: [{"id": i, "title": f"P{i}", "rating": r} for i, r in ((1, 4.0), (2, 3.0), (1, "5.0"), (2, ""), (3, 1.0), (1, 2.0))],
+    4: [{"id": 1, "name": n} for n in ("Ricardo Darin", "Norma Aleandro", "Ricardo Darin", "", "Cecilia Roth")],
+    5: [{"sentiment": s, "budget": b, "revenue": r} for s, b, r in (("POSITIVE", 10, 30), ("NEGATIVE", 5, 5), ("POSITIVE", 0, 9), ("POSITIVE", 4, 2))],
+}
+
+
+def normalizar(filas):
+    return sorted((tuple(sorted((k, round(v, 9) if isinstance(v, float) else v) for k, v in f.items())) for f in filas))
+
+
+def test_combinar_parciales_da_lo_mismo_que_combinar_todo():
+    for request_id, filas in CRUDAS.items():
+        parciales = combinar(request_id, filas[:2]) + combinar(request_id, filas[2:])
+        assert normalizar(combinar(request_id, parciales)) == normalizar(combinar(request_id, filas)), request_id
+
+
+def test_los_parciales_llevan_la_cantidad_de_observaciones():
+    ratings = {f["id"]: (f["rating"], f[CANTIDAD]) for f in combinar(3, CRUDAS[3])}
+    assert ratings == {"1": (11.0, 3), "2": (3.0, 1), "3": (1.0, 1)}
+    actores = {f["name"]: f[CANTIDAD] for f in combinar(4, CRUDAS[4])}
+    assert actores == {"Ricardo Darin": 2, "Norma Aleandro": 1, "Cecilia Roth": 1}
+
+
+def test_lo_que_no_son_filas_pasa_sin_cambios():
+    assert combinar(3, False) is False
+    assert combinar(3, "EOF") == "EOF"
+    assert combinar(1, CRUDAS[2]) is CRUDAS[2]
@@ -0,0 +1,164 @@
+from common import communication
+from common.communication import BufferSalida, ControlConsumo
+from common.transaction import Transaction
+
+
+class ConexionFalsa:
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, demora, callback):
+        self.timers.append(callback)
+        return callback
+
+    def remove_timeout(self, timer):
+        if timer in self.timers:
+            self.timers.remove(timer)
+
+
+class CanalFalso:
+    def __init__(self):
+        self.acks = []
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+    def basic_qos(self, prefetch_count=0):
+        pass
+
+
+def control(tmp_path, deduplica, ack_lote=4):
+    canal = CanalFalso()
+    consumo = ControlConsumo(ConexionFalsa(), canal, 8, False, 8, ack_lote, 200, Transaction(str(tmp_path)), deduplica)
+    return consumo, canal
+
+
+def test_sin_deduplicacion_cada_mensaje_se_ackea_al_terminar(tmp_path):
+    consumo, canal = control(tmp_path, deduplica=False)
+    for tag in (1, 2, 3):
+        consumo.confirmar(tag, {"ClientID": "c", "MessageID": str(tag)})
+    assert canal.acks == [(1, False), (2, False), (3, False)]
+
+
+def test_los_acks_se_acumulan_hasta_el_lote(tmp_path):
+    consumo, canal = control(tmp_path, deduplica=True)
+    for tag in (1, 2, 3):
+        consumo.confirmar(tag, {"ClientID": "c", "MessageID": str(tag)})
+    assert canal.acks == []
+    consumo.confirmar(4, {"ClientID": "c", "MessageID": "4"})
+    assert canal.acks == [(4, True)]
+
+
+def test_un_eof_sin_message_id_no_espera_el_lote(tmp_path):
+    consumo, canal = control(tmp_path, deduplica=True)
+    consumo.confirmar(1, {"ClientID": "c", "MessageID": "1"})
+    consumo.confirmar(2, {"ClientID": "c", "type": "EOF"})
+    assert canal.acks == [(2, False)]
+    consumo.confirmar(3, {"ClientID": "c", "MessageID": "3"})
+    consumo.confirmar(4, {"ClientID": "c", "MessageID": "4"})
+    assert canal.acks[-1] == (4, True)
+
+
+def test_el_coalescer_no_repite_message_ids_no_str(monkeypatch):
+    publicados = []
+    monkeypatch.setattr(communication, "publicar", lambda canal, routing_key, filas, mensaje, tipo, retenciones: publicados.append(mensaje["headers"]))
+    buffer = BufferSalida(ConexionFalsa(), (1000, 1 << 20, 16, 50))
+    for message_id in (7, 7, 8):
+        buffer.agregar(None, "destino", [{"a": 1}], {"headers": {"ClientID": "c", "MessageID": message_id}}, "RESULT")
+    buffer.vaciar_pendientes()
+    assert publicados[0]["MessageID"] == "7-8"
+    assert publicados[0]["MessageIDs"] == "7,8"
+
+
+def test_publicacion_nackeada_se_reintenta(monkeypatch):
+    monkeypatch.setattr(communication, "confirmaciones", None)
+    publicados = []
+
+    class CanalConConfirms:
+        def basic_publish(self, exchange, routing_key, body, properties):
+            publicados.append(body)
+            if len(publicados) == 1:
+                raise communication.pika.exceptions.NackError([])
+
+    communication.basic_publish(CanalConConfirms(), "cola", b"datos", None, [])
+    assert publicados == [b"datos", b"datos"]
+
+
+def test_prefetch_adaptativo_crece_con_espera_y_baja_sin_ella(tmp_path):
+    canal = CanalFalso()
+    consumo = ControlConsumo(ConexionFalsa(), canal, 4, True, 32, 4, 200, Transaction(str(tmp_path)), True)
+    consumo.espera, consumo.proceso = 1.0, 1.0
+    consumo.ajustar_prefetch()
+    consumo.espera, consumo.proceso = 1.0, 1.0
+    consumo.ajustar_prefetch()
+    assert consumo.prefetch == 16
+    for _ in range(10):
+        consumo.espera, consumo.proceso = 0.0, 1.0
+        consumo.ajustar_prefetch()
+    assert consumo.prefetch == 4
+    for _ in range(5):
+        consumo.espera, consumo.proceso = 10.0, 1.0
+        consumo.ajustar_prefetch()
+    assert consumo.prefetch == 32
+
+
+def test_el_timer_libera_un_lote_incompleto(tmp_path):
+    consumo, canal = control(tmp_path, deduplica=True)
+    consumo.confirmar(1, {"ClientID": "c", "MessageID": "1"})
+    consumo.confirmar(2, {"ClientID": "c", "MessageID": "2"})
+    assert canal.acks == []
+    assert len(consumo.conexion.timers) == 1
+    consumo.conexion.timers.pop()()
+    assert canal.acks == [(2, True)]
+    # Lo ya ackeado deja de figurar como procesado
+    assert not consumo.transaction.procesados
+
+
+class CanalPublicacion:
+    def __init__(self):
+        self.publicados = []
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.publicados.append({"body": body, "headers": properties.headers, "routing_key": routing_key})
+
+
+def test_zlib_solo_por_encima_del_umbral_y_nunca_hacia_afuera(monkeypatch):
+    monkeypatch.setattr(communication, "confirmaciones", None)
+    monkeypatch.setattr(communication, "COMPRESION_UMBRAL", 256)
+    canal = CanalPublicacion()
+    original = {"headers": {"ClientID": "c", "Query": "q", "MessageID": "1"}}
+    filas = [{"id": i, "title": "Pelicula repetida"} for i in range(200)]
+    communication.publicar(canal, "aggregator_q1", filas, original, "RESULT")
+    communication.publicar(canal, "aggregator_q1", filas[:1], original, "RESULT")
+    communication.publicar(canal, "gateway_output", filas, original, "RESULT")
+    grande, chico, externo = canal.publicados
+
+    assert grande["headers"]["Compresion"] == communication.COMPRESION_ZLIB
+    assert communication.obtener_filas(grande) == filas
+    assert "Compresion" not in chico["headers"]
+    assert "Compresion" not in externo["headers"]
+    assert externo["body"].decode("utf-8").startswith("id,title")
+
+
+def test_cada_cliente_cae_siempre_en_el_mismo_shard_del_aggregator(monkeypatch):
+    monkeypatch.setattr(communication, "AGGREGATOR_SHARDS", {3: 3})
+    monkeypatch.setattr(communication, "confirmaciones", None)
+    monkeypatch.setattr(communication, "buffer_salida", None)
+    canal = CanalPublicacion()
+    for client_id in ("c1", "c2", "cliente-7"):
+        original = {"headers": {"ClientID": client_id, "Query": "q", "MessageID": "1"}}
+        communication.enviar_mensaje(canal, "aggregator_request_3", [{"id": 1, "rating": 4.0}], original, "RESULT")
+        communication.enviar_mensaje(canal, "aggregator_request_3", "EOF", original, "EOF")
+        communication.enviar_mensaje(canal, "aggregator_request_4", [{"name": "a"}], original, "RESULT")
+
+    colas = {}
+    for publicado in canal.publicados:
+        colas.setdefault(publicado["headers"]["ClientID"], []).append(publicado["routing_key"])
+    # Valores fijos de crc32 sobre el ClientID
+    assert colas == {
+        "c1": ["aggregator_request_3_2", "aggregator_request_3_2", "aggregator_request_4"],
+        "c2": ["aggregator_request_3_1", "aggregator_request_3_1", "aggregator_request_4"],
+        "cliente-7": ["aggregator_request_3_2", "aggregator_request_3_2", "aggregator_request_4"],
+    }
+    assert communication.colas_shards("aggregator_request_3") == [f"aggregator_request_3_{i}" for i in range(3)]
+    assert communication.colas_shards("aggregator_request_4") == ["aggregator_request_4"]
@@ -0,0 +1,213 @@
+import ast
+import itertools
+from concurrent.futures import Future
+from datetime import datetime
+
+from common import utils
+from common.combiners import combinar_presupuestos
+from common.predicados import cantidad_igual, columna_anios, columna_cantidad, columna_nombres, contiene_todos, rango_anios
+from common.utils import decodificar_columna, lista_dicts_a_csv, parsear_fecha
+from workers.filter import ESQUEMA_SALIDA, FiltroNode, aplicar_plan
+
+
+class ConexionInmediata:
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+
+class CanalFalso:
+    connection = ConexionInmediata()
+
+
+class PoolFalso:
+    def __init__(self):
+        self.futuros = []
+
+    def submit(self, funcion, *args):
+        futuro = Future()
+        self.futuros.append(futuro)
+        return futuro
+
+
+def mensaje(tipo, message_id, ackeados):
+    return {
+        "body": b"",
+        "headers": {"type": tipo, "Query": "TOP-ARGENTINIAN-MOVIES-BY-RATING", "ClientID": "c", "MessageID": message_id},
+        "ack": lambda: ackeados.append(message_id),
+    }
+
+
+def test_el_pool_publica_y_ackea_en_orden_de_entrega():
+    nodo = FiltroNode(procesos=1)
+    nodo.pool = PoolFalso()
+    enviados, ackeados = [], []
+    enviar = lambda canal, destino, datos, mensaje, tipo: enviados.append((mensaje["headers"]["MessageID"], datos))
+    for message_id, tipo in ((1, "MOVIES"), (2, "MOVIES"), (3, "EOF")):
+        nodo.procesar_mensajes(CanalFalso(), "joiner", mensaje(tipo, message_id, ackeados), enviar)
+
+    # El segundo termina antes, pero nada sale hasta que termine el primero
+    nodo.pool.futuros[1].set_result([{"id": 2}])
+    assert enviados == [] and ackeados == []
+    nodo.pool.futuros[0].set_result([{"id": 1}])
+    assert enviados == [(1, [{"id": 1}]), (2, [{"id": 2}]), (3, "EOF")]
+    assert ackeados == [1, 2, 3]
+
+
+def test_con_pool_el_prefetch_no_se_adapta():
+    nodo = FiltroNode(procesos=2)
+    try:
+        assert nodo.prefetch_fijo
+        assert nodo.prefetch_minimo == 4
+    finally:
+        nodo.eliminar(None)
+
+
+FECHAS = ["2005-03-01", "1999-12-31", "2000-01-01", "2010-01-01", "2012-07-15", "", "no es fecha"]
+PAISES = [
+    "[{'iso_3166_1': 'AR', 'name': 'Argentina'}]",
+    "[{'iso_3166_1': 'AR', 'name': 'Argentina'}, {'iso_3166_1': 'ES', 'name': 'Spain'}]",
+    "[{'iso_3166_1': 'ES', 'name': 'Spain'}]",
+    "[{'iso_3166_1': 'US', 'name': 'United States of America'}, {'iso_3166_1': 'AR', 'name': 'Argentina'}]",
+    "[]",
+    "[{'name': 'Spain'",
+]
+IDS = ["862", "abc"]
+
+
+def peliculas():
+    filas = []
+    for i, (fecha, paises, movie_id) in enumerate(itertools.product(FECHAS, PAISES, IDS)):
+        filas.append({
+            "id": movie_id if movie_id == "abc" else str(int(movie_id) + i),
+            "title": f"Pelicula {i}",
+            "genres": "[{'id': 18, 'name': 'Drama'}, {'id': 35, 'name': 'Comedy'}]",
+            "production_countries": paises,
+            "release_date": fecha,
+            "budget": str(i * 1000) if i % 5 else "",
+        })
+    return filas
+
+
+# Filtro fila por fila tal como estaba antes de los predicados por lote
+def nombres(texto):
+    try:
+        lista = ast.literal_eval(texto)
+    except (ValueError, SyntaxError):
+        return []
+    return [d["name"] for d in lista if isinstance(d, dict) and "name" in d] if isinstance(lista, list) else []
+
+
+def fecha(texto):
+    try:
+        return datetime.strptime(texto, "%Y-%m-%d")
+    except (ValueError, TypeError):
+        return None
+
+
+def referencia(request_id, filas):
+    resultado = []
+    for fila in filas:
+        paises = nombres(fila["production_countries"])
+        texto_paises = ", ".join(paises).lower()
+        anio = fecha(fila["release_date"])
+        if request_id == 1 and anio and 2000 <= anio.year < 2010 and "argentina" in texto_paises and "spain" in texto_paises:
+            resultado.append({"title": fila["title"], "genres": nombres(fila["genres"])})
+        elif request_id == 2 and len(paises) == 1:
+            try:
+                budget = float(fila["budget"])
+            except ValueError:
+                budget = 0
+            resultado.append({"country": paises[0], "budget": budget})
+        elif request_id in (3, 4) and anio and anio.year >= 2000 and "argentina" in texto_paises:
+            try:
+                resultado.append({"id": int(fila["id"]), "title": fila["title"]})
+            except ValueError:
+                continue
+    return resultado
+
+
+def test_mascaras_coinciden_con_el_filtro_por_fila():
+    filas = peliculas()
+    decodificar_columna(filas, "release_date")
+    decodificar_columna(filas, "production_countries")
+    anios = columna_anios(filas)
+    paises = columna_nombres(filas, "production_countries")
+    cantidades = columna_cantidad(filas, "production_countries")
+
+    esperado = [f["release_date"] is not None and 2000 <= f["release_date"].year < 2010 for f in filas]
+    assert list(rango_anios(anios, 2000, 2010)) == esperado
+    esperado = [f["release_date"] is not None and f["release_date"].year >= 2000 for f in filas]
+    assert list(rango_anios(anios, 2000)) == esperado
+    texto = [", ".join(f["production_countries"]).lower() for f in filas]
+    assert list(contiene_todos(paises, ("argentina", "spain"))) == ["argentina" in t and "spain" in t for t in texto]
+    assert list(cantidad_igual(cantidades, 1)) == [len(f["production_countries"]) == 1 for f in filas]
+
+
+def test_consultas_1_a_4_coinciden_con_el_filtro_original():
+    nodo = FiltroNode(procesos=1)
+    datos = lista_dicts_a_csv(peliculas())
+    for request_id in (1, 3, 4):
+        esperado = referencia(request_id, peliculas())
+        assert esperado
+        assert nodo.ejecutar_consulta(request_id, datos) == esperado
+    # La 2 sale combinada por pais: se compara contra la suma del filtro original
+    esperado = sorted(combinar_presupuestos(referencia(2, peliculas())), key=lambda f: f["country"])
+    obtenido = sorted(nodo.ejecutar_consulta(2, datos), key=lambda f: f["country"])
+    assert obtenido == esperado
+    assert all(list(fila) == ESQUEMA_SALIDA[2] for fila in obtenido)
+
+
+def test_cada_columna_se_decodifica_solo_en_las_filas_que_siguen_vivas(monkeypatch):
+    decodificadas = []
+    original = utils.DECODIFICADORES["production_countries"]
+    def contar(row, campo):
+        decodificadas.append(row["title"])
+        original(row, campo)
+    monkeypatch.setitem(utils.DECODIFICADORES, "production_countries", contar)
+
+    filas = peliculas()
+    resultado = aplicar_plan(3, filas)
+    en_rango = [f["title"] for f in peliculas() if fecha(f["release_date"]) and fecha(f["release_date"]).year >= 2000]
+    assert decodificadas == en_rango
+    # Nada despues del filtro lee genres en la 3 y la 4: queda sin decodificar
+    assert all(isinstance(fila["genres"], str) for fila in resultado)
+
+
+def test_fecha_rapida_coincide_con_strptime():
+    for valor in FECHAS + ["2001-02-30", "2001-2-3", "20011-01-01", "2001-02-03 "]:
+        assert parsear_fecha(valor) == fecha(valor)
+
+
+def test_scan_compartido_da_lo_mismo_que_cada_consulta_por_separado():
+    nodo = FiltroNode(procesos=1)
+    enviados = {}
+    def enviar(canal, destino, datos, mensaje, tipo):
+        enviados[mensaje["headers"]["Query"]] = (destino, datos, mensaje["headers"].get("Queries"))
+
+    consultas = "ARGENTINIAN-SPANISH-PRODUCTIONS|TOP-INVESTING-COUNTRIES|TOP-ARGENTINIAN-MOVIES-BY-RATING|TOP-ARGENTINIAN-ACTORS"
+    ackeados = []
+    scan = {
+        "body": lista_dicts_a_csv(peliculas()).encode("utf-8"),
+        "headers": {"type": "MOVIES", "Queries": consultas, "ClientID": "c", "MessageID": "1"},
+        "ack": lambda: ackeados.append(True),
+    }
+    nodo.procesar_mensajes(None, None, scan, enviar)
+
+    assert ackeados == [True]
+    assert enviados["ARGENTINIAN-SPANISH-PRODUCTIONS"] == ("gateway_output", referencia(1, peliculas()), None)
+    assert enviados["TOP-ARGENTINIAN-MOVIES-BY-RATING"] == ("broker", referencia(3, peliculas()), None)
+    assert enviados["TOP-ARGENTINIAN-ACTORS"] == ("broker", referencia(4, peliculas()), None)
+    # El gateway descartaba las filas con alguna columna vacia antes de mandarlas a la 2
+    con_budget = [fila for fila in peliculas() if fila["budget"]]
+    destino, datos, _ = enviados["TOP-INVESTING-COUNTRIES"]
+    assert destino == "aggregator_request_2"
+    assert sorted(datos, key=lambda f: f["country"]) == sorted(combinar_presupuestos(referencia(2, con_budget)), key=lambda f: f["country"])
+
+
+def test_cada_consulta_publica_solo_su_esquema_de_salida():
+    nodo = FiltroNode(procesos=1)
+    datos = lista_dicts_a_csv(peliculas())
+    for request_id in (1, 3, 4):
+        assert all(list(fila) == ESQUEMA_SALIDA[request_id] for fila in nodo.ejecutar_consulta(request_id, datos))
+    pnl = [{"id": "1", "title": "Uno", "overview": "Buena", "budget": "10", "revenue": "30", "genres": "[]"}]
+    assert nodo.ejecutar_consulta(5, lista_dicts_a_csv(pnl)) == [{"overview": "Buena", "budget": "10", "revenue": "30"}]
@@ -0,0 +1,238 @@
+import os
+
+from common import communication
+from common.columnar import decodificar_columnar
+from common.communication import BufferSalida
+from workers import joiner
+from workers.joiner import JoinerNode
+
+
+def mensaje(tipo, consulta, body="", message_id=None, batch_id=None):
+    headers = {"type": tipo, "Query": consulta, "ClientID": "c1"}
+    if message_id is not None:
+        headers["MessageID"] = message_id
+    if batch_id is not None:
+        headers["BatchID"] = batch_id
+    return {"body": body.encode("utf-8"), "headers": headers, "ack": lambda: None}
+
+
+def test_eof_de_ratings_libera_el_estado_del_cliente(tmp_path, monkeypatch):
+    monkeypatch.setattr(joiner, "TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(joiner, "CONSULTAS_JOINER", [3])
+    monkeypatch.setattr(joiner, "BLOOM_FALSOS_POSITIVOS", 0)
+    enviados = []
+    def enviar(canal, destino, datos, mensaje, tipo):
+        enviados.append((tipo, datos))
+
+    consulta = "TOP-ARGENTINIAN-MOVIES-BY-RATING"
+    nodo = JoinerNode()
+    nodo.procesar_mensajes(None, "joiner_request_3", mensaje("MOVIES", consulta, "id,title\n1,Uno\n", 1, 1), enviar)
+    paths = list(nodo.archivos_path["c1"].values())
+    nodo.procesar_mensajes(None, "joiner_request_3", mensaje("EOF", consulta, message_id=2), enviar)
+    # Con las movies completas el batch se joinea al llegar: LINEAS queda en 0
+    nodo.procesar_mensajes(None, "joiner_request_3", mensaje("RATINGS", consulta, "id,rating\n1,4.0\n", 3, 1), enviar)
+    assert nodo.informacion_csvs["c1"]["ratings"][joiner.LINEAS] == 0
+    nodo.procesar_mensajes(None, "joiner_request_3", mensaje("EOF_RATINGS", consulta, message_id=4), enviar)
+
+    assert [tipo for tipo, _ in enviados] == ["RESULT", "EOF"]
+    for estado in (nodo.informacion_movies, nodo.termino_movies, nodo.informacion_csvs, nodo.indice_movies,
+                   nodo.locks, nodo.archivos_en_disco, nodo.spill_enviado, nodo.archivos_path, nodo.ultimo_batch_id):
+        assert "c1" not in estado
+    assert not any(os.path.exists(path) for path in paths)
+
+    nodo.transaction.cerrar_logs()
+    recuperado = JoinerNode()
+    assert "c1" not in recuperado.informacion_movies
+
+    # El EOF redelivereado despues de liberar al cliente se confirma y se descarta
+    confirmados = []
+    redelivereado = mensaje("EOF_RATINGS", consulta)
+    redelivereado["ack"] = lambda: confirmados.append(True)
+    recuperado.procesar_mensajes(None, "joiner_request_3", redelivereado, enviar)
+    assert confirmados == [True]
+    assert [tipo for tipo, _ in enviados] == ["RESULT", "EOF"]
+    assert "c1" not in recuperado.informacion_csvs
+
+    # El snapshot conserva a los clientes terminados
+    recuperado.transaction.compactar()
+    recuperado.transaction.cerrar_logs()
+    assert "c1" in JoinerNode().clientes_terminados
+
+
+def test_las_movies_se_guardan_proyectadas_a_id_y_title(tmp_path, monkeypatch):
+    monkeypatch.setattr(joiner, "TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(joiner, "BLOOM_FALSOS_POSITIVOS", 0)
+    consulta = "TOP-ARGENTINIAN-MOVIES-BY-RATING"
+    nodo = JoinerNode()
+    body = "id,title,genres,release_date\n1,Uno,\"[{'name': 'Drama'}]\",2005-01-01\n"
+    nodo.procesar_mensajes(None, "joiner_request_3", mensaje("MOVIES", consulta, body, 1, 1), lambda *args: None)
+
+    assert nodo.informacion_movies["c1"][3] == [[{"id": "1", "title": "Uno"}]]
+    nodo.transaction.sincronizar()
+    with open(nodo.transaction.archivo) as f:
+        assert "Drama" not in f.read()
+    nodo.transaction.cerrar_logs()
+
+
+class ConexionFalsa:
+    def call_later(self, demora, callback):
+        return object()
+
+    def remove_timeout(self, timer):
+        pass
+
+
+class CanalFalso:
+    def __init__(self):
+        self.publicados = []
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.publicados.append((routing_key, body, properties.headers))
+
+
+def filas_publicadas(canal):
+    filas = []
+    for routing_key, body, headers in canal.publicados:
+        if headers.get("type") == "RESULT" and routing_key.startswith("aggregator"):
+            filas.extend(decodificar_columnar(body))
+    return filas
+
+
+def test_spill_sin_publicar_no_se_pierde_al_reiniciar(tmp_path, monkeypatch):
+    monkeypatch.setattr(joiner, "TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(joiner, "CONSULTAS_JOINER", [3])
+    monkeypatch.setattr(joiner, "BLOOM_FALSOS_POSITIVOS", 0)
+    monkeypatch.setattr(joiner, "BATCH_RATINGS", 2)
+    consulta = "TOP-ARGENTINIAN-MOVIES-BY-RATING"
+    canal = CanalFalso()
+
+    def arrancar():
+        nodo = JoinerNode()
+        monkeypatch.setattr(communication, "buffer_salida", BufferSalida(ConexionFalsa(), (1000, 1 << 20, 16, 50), nodo.transaction))
+        return nodo
+
+    nodo = arrancar()
+    nodo.procesar_mensajes(canal, "aggregator_request_3", mensaje("MOVIES", consulta, "id,title\n1,Uno\n2,Dos\n", 1, 1), communication.enviar_mensaje)
+    nodo.procesar_mensajes(canal, "aggregator_request_3", mensaje("RATINGS", consulta, "id,rating\n1,4.0\n2,3.0\n1,5.0\n", 2, 1), communication.enviar_mensaje)
+    nodo.procesar_mensajes(canal, "aggregator_request_3", mensaje("RATINGS", consulta, "id,rating\n2,1.0\n3,2.0\n", 3, 2), communication.enviar_mensaje)
+    nodo.procesar_mensajes(canal, "aggregator_request_3", mensaje("EOF", consulta), communication.enviar_mensaje)
+
+    # Caida antes del linger: lo que quedo en el coalescer se pierde y el EOF se vuelve a entregar
+    nodo.transaction.cerrar_logs()
+    nodo = arrancar()
+    nodo.procesar_mensajes(canal, "aggregator_request_3", mensaje("EOF", consulta), communication.enviar_mensaje)
+    nodo.procesar_mensajes(canal, "aggregator_request_3", mensaje("EOF_RATINGS", consulta), communication.enviar_mensaje)
+    communication.buffer_salida.vaciar_pendientes()
+
+    filas = filas_publicadas(canal)
+    assert sum(int(fila["count"]) for fila in filas) == 4
+
+
+def test_cada_batch_del_spill_sale_con_su_message_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(joiner, "TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(joiner, "CONSULTAS_JOINER", [3])
+    monkeypatch.setattr(joiner, "BLOOM_FALSOS_POSITIVOS", 0)
+    monkeypatch.setattr(joiner, "BATCH_RATINGS", 2)
+    consulta = "TOP-ARGENTINIAN-MOVIES-BY-RATING"
+    enviados = []
+    def enviar(canal, destino, datos, mensaje, tipo):
+        enviados.append((tipo, mensaje["headers"]["MessageID"]))
+
+    nodo = JoinerNode()
+    nodo.procesar_mensajes(None, "aggregator_request_3", mensaje("MOVIES", consulta, "id,title\n1,Uno\n2,Dos\n", 1, 1), enviar)
+    nodo.procesar_mensajes(None, "aggregator_request_3", mensaje("RATINGS", consulta, "id,rating\n1,4.0\n2,3.0\n", 2, 1), enviar)
+    nodo.procesar_mensajes(None, "aggregator_request_3", mensaje("RATINGS", consulta, "id,rating\n2,1.0\n1,2.0\n", 3, 2), enviar)
+    nodo.procesar_mensajes(None, "aggregator_request_3", mensaje("EOF", consulta, message_id=4), enviar)
+
+    resultados = [message_id for tipo, message_id in enviados if tipo == "RESULT"]
+    assert len(resultados) >= 2
+    assert len(set(resultados)) == len(resultados)
+    nodo.transaction.cerrar_logs()
+
+
+def secuencia_consulta_3():
+    consulta = "TOP-ARGENTINIAN-MOVIES-BY-RATING"
+    return [
+        mensaje("MOVIES", consulta, "id,title\n1,Uno\n2,Dos\n", 1, 1),
+        mensaje("RATINGS", consulta, "id,rating\n1,4.0\n2,3.0\n9,1.0\n", 2, 1),
+        mensaje("MOVIES", consulta, "id,title\n3,Tres\n", 3, 2),
+        mensaje("RATINGS", consulta, "id,rating\n3,2.0\n1,5.0\n", 4, 2),
+        mensaje("RATINGS", consulta, "id,rating\n2,1.0\n", 5, 3),
+        mensaje("EOF", consulta, message_id=6),
+        mensaje("RATINGS", consulta, "id,rating\n3,4.0\n9,2.0\n", 7, 4),
+        mensaje("RATINGS", consulta, "id,rating\n1,1.0\n", 8, 5),
+        mensaje("EOF_RATINGS", consulta, message_id=9),
+    ]
+
+
+class Aggregator:
+    """Lo que ve el aggregator: descarta lo que repite un MessageID ya recibido."""
+    def __init__(self):
+        self.vistos = set()
+        self.ratings = {}
+        self.eofs = 0
+
+    def recibir(self, canal, destino, datos, mensaje, tipo):
+        if tipo == "EOF":
+            self.eofs += 1
+            return
+        clave = mensaje["headers"]["MessageID"]
+        if clave in self.vistos:
+            return
+        self.vistos.add(clave)
+        for fila in datos:
+            suma, cantidad = self.ratings.get(fila["id"], (0.0, 0))
+            self.ratings[fila["id"]] = (suma + float(fila["rating"]), cantidad + int(fila["count"]))
+
+
+def procesar(nodo, aggregator, entrada, ackear=True):
+    headers = dict(entrada["headers"])
+    copia = {**entrada, "headers": dict(entrada["headers"])}
+    # Como ControlConsumo: el ack deja registrado el mensaje como procesado
+    copia["ack"] = (lambda: nodo.transaction.registrar_procesado(headers)) if ackear else (lambda: None)
+    nodo.procesar_mensajes(None, "aggregator_request_3", copia, aggregator.recibir)
+
+
+def test_reinicio_en_cada_mensaje_da_el_mismo_resultado(tmp_path, monkeypatch):
+    monkeypatch.setattr(joiner, "CONSULTAS_JOINER", [3])
+    monkeypatch.setattr(joiner, "BLOOM_FALSOS_POSITIVOS", 0)
+    monkeypatch.setattr(joiner, "BATCH_RATINGS", 2)
+    mensajes = secuencia_consulta_3()
+
+    monkeypatch.setattr(joiner, "TMP_DIR", str(tmp_path / "referencia"))
+    referencia = Aggregator()
+    nodo = JoinerNode()
+    for entrada in mensajes:
+        procesar(nodo, referencia, entrada)
+    nodo.transaction.cerrar_logs()
+    assert referencia.ratings == {"1": (10.0, 3), "2": (4.0, 2), "3": (6.0, 2)}
+    assert referencia.eofs == 1
+
+    for corte in range(1, len(mensajes) + 1):
+        monkeypatch.setattr(joiner, "TMP_DIR", str(tmp_path / f"corte_{corte}"))
+        aggregator = Aggregator()
+        nodo = JoinerNode()
+        for indice, entrada in enumerate(mensajes[:corte]):
+            # Se cae despues de procesar el ultimo pero antes de su ack
+            procesar(nodo, aggregator, entrada, ackear=indice < corte - 1)
+        nodo.transaction.cerrar_logs()
+        nodo = JoinerNode()
+        for entrada in mensajes[corte - 1:]:
+            procesar(nodo, aggregator, entrada)
+        nodo.transaction.cerrar_logs()
+        assert aggregator.ratings == referencia.ratings, corte
+        assert aggregator.eofs >= 1, corte
+
+
+def test_el_indice_de_movies_crece_por_batch_y_se_recupera(tmp_path, monkeypatch):
+    monkeypatch.setattr(joiner, "TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(joiner, "BLOOM_FALSOS_POSITIVOS", 0)
+    nodo = JoinerNode()
+    mensajes = secuencia_consulta_3()
+    procesar(nodo, Aggregator(), mensajes[0])
+    assert nodo.indice_movies["c1"][3] == {"1": "Uno", "2": "Dos"}
+    procesar(nodo, Aggregator(), mensajes[2])
+    assert nodo.indice_movies["c1"][3] == {"1": "Uno", "2": "Dos", "3": "Tres"}
+    nodo.transaction.cerrar_logs()
+
+    assert JoinerNode().indice_movies["c1"][3] == {"1": "Uno", "2": "Dos", "3": "Tres"}
@@ -0,0 +1,11 @@
+from common.utils import clave_particion, indice_particion
+
+
+def test_la_particion_no_depende_del_formato_del_id():
+    assert clave_particion(" 862 ") == clave_particion(862) == clave_particion("862.0") == "862"
+    assert indice_particion("862", 4) == indice_particion(862, 4) == indice_particion("862.0", 4)
+
+
+def test_la_particion_es_estable_entre_procesos():
+    # Valores fijos de crc32: hash() cambiaria con PYTHONHASHSEED
+    assert [indice_particion(movie_id, 4) for movie_id in ("862", "27205", "11", "abc")] == [3, 1, 3, 2]
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pika
+
+from common.communication import Retencion
+from common.runtime_asyncio import CanalAsyncio, ConexionAsyncio, ConfirmacionesPublicacion
+
+
+class CanalPika:
+    def __init__(self):
+        self.llamadas = []
+        self.consumidor = None
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.llamadas.append(("ack", delivery_tag, multiple, threading.get_ident()))
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        self.consumidor = on_message_callback
+
+
+def test_el_nodo_corre_en_el_executor_y_el_canal_en_el_loop():
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+    conexion = ConexionAsyncio(None, loop, executor)
+    pika_canal = CanalPika()
+    canal = CanalAsyncio(pika_canal, conexion)
+    hilos = []
+
+    def callback(ch, method, properties, body):
+        hilos.append(threading.get_ident())
+        ch.basic_ack(delivery_tag=method)
+
+    canal.basic_consume("cola", callback)
+    loop.run_until_complete(asyncio.sleep(0))
+    pika_canal.consumidor(None, 1, None, b"")
+    executor.submit(lambda: None).result()
+    loop.run_until_complete(asyncio.sleep(0))
+
+    hilo_loop = threading.get_ident()
+    assert hilos and hilos[0] != hilo_loop
+    assert pika_canal.llamadas == [("ack", 1, False, hilo_loop)]
+    executor.shutdown()
+    loop.close()
+
+
+def test_un_timer_cancelado_no_dispara():
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+    conexion = ConexionAsyncio(None, loop, executor)
+    disparados = []
+    cancelado = conexion.call_later(0, lambda: disparados.append("cancelado"))
+    conexion.call_later(0, lambda: disparados.append("vigente"))
+    conexion.remove_timeout(cancelado)
+    loop.run_until_complete(asyncio.sleep(0.01))
+    executor.submit(lambda: None).result()
+    assert disparados == ["vigente"]
+    executor.shutdown()
+    loop.close()
+
+
+class ConexionInmediata:
+    def en_executor(self, funcion, *args):
+        funcion(*args)
+
+
+class Confirm:
+    def __init__(self, metodo):
+        self.method = metodo
+
+
+def test_el_ack_de_entrada_espera_los_confirms_de_sus_salidas():
+    confirmaciones = ConfirmacionesPublicacion(ConexionInmediata(), 8)
+    ackeados = []
+    reintentos = []
+    retencion = Retencion(lambda: ackeados.append(1))
+    confirmaciones.registrar([retencion], lambda: reintentos.append(1))
+    confirmaciones.registrar([retencion], lambda: reintentos.append(2))
+    retencion.ack()
+    assert ackeados == []
+
+    confirmaciones.on_confirm(Confirm(pika.spec.Basic.Nack(delivery_tag=1)))
+    assert reintentos == [1]
+    assert ackeados == []
+    # Un confirm multiple libera todo lo anterior de una vez
+    confirmaciones.on_confirm(Confirm(pika.spec.Basic.Ack(delivery_tag=2, multiple=True)))
+    assert ackeados == [1]
+    assert not confirmaciones.en_vuelo
@@ -0,0 +1,35 @@
+import os
+
+from common.segmentos import agregar_batches, borrar_segmento, leer_batches, ruta_indice
+
+
+def filas(desde, cantidad):
+    return [{"id": i, "rating": i / 2} for i in range(desde, desde + cantidad)]
+
+
+def test_los_batches_se_leen_en_orden_y_de_a_batch_size(tmp_path):
+    path = str(tmp_path / "ratings")
+    agregar_batches(path, [(1, filas(0, 3)), (2, []), (3, filas(3, 2))])
+    agregar_batches(path, [(4, filas(5, 1))])
+    leidos = list(leer_batches(path, 2))
+    assert [(batch_id, [f["id"] for f in batch]) for batch, batch_id in leidos] == [
+        ("1", [0, 1]), ("1", [2]), ("3", [3, 4]), ("4", [5]),
+    ]
+    # Despues de un reinicio se retoma en el registro siguiente al ya enviado
+    assert [batch_id for _, batch_id in leer_batches(path, 10, despues_de=3)] == ["4"]
+
+
+def test_registros_sin_indice_se_recuperan_y_uno_truncado_se_descarta(tmp_path):
+    path = str(tmp_path / "credits")
+    agregar_batches(path, [(1, filas(0, 2))])
+    tam_indice = os.path.getsize(ruta_indice(path))
+    agregar_batches(path, [(2, filas(2, 2)), (3, filas(4, 2))])
+    # Caida despues de escribir los registros y antes del indice, con el ultimo a medias
+    with open(ruta_indice(path), "r+b") as f:
+        f.truncate(tam_indice)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+
+    assert [(batch_id, batch) for batch, batch_id in leer_batches(path, 10)] == [("1", filas(0, 2)), ("2", filas(2, 2))]
+    borrar_segmento(path)
+    assert not os.path.exists(path) and not os.path.exists(ruta_indice(path))
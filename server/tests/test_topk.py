@@ -0,0 +1,58 @@
+import random
+from collections import Counter
+
+from common.topk import SpaceSaving, TopKExacto
+
+
+def flujo(semilla, largo=2000):
+    azar = random.Random(semilla)
+    # Pocas claves frecuentes y una cola larga
+    return [f"k{min(int(azar.paretovariate(1.2)), 300)}" for _ in range(largo)]
+
+
+def test_topk_exacto_combinado_da_lo_mismo_que_un_solo_nodo():
+    partes = [flujo(s) for s in (1, 2, 3)]
+    total = TopKExacto()
+    for clave in sum(partes, []):
+        total.agregar(clave)
+    combinado = TopKExacto()
+    for parte in partes:
+        parcial = TopKExacto()
+        for clave in parte:
+            parcial.agregar(clave)
+        combinado.combinar(parcial)
+    assert combinado.mayores(10) == total.mayores(10)
+
+
+def test_spacesaving_combinado_respeta_las_cotas():
+    partes = [flujo(s) for s in (4, 5)]
+    reales = Counter(sum(partes, []))
+    resumen = SpaceSaving(20)
+    for parte in partes:
+        parcial = SpaceSaving(20)
+        for clave in parte:
+            parcial.agregar(clave)
+        resumen.combinar(parcial)
+
+    assert len(resumen) <= 20
+    for clave, cuenta, error in resumen.entradas():
+        assert cuenta - error <= reales[clave] <= cuenta
+    for clave, real in reales.items():
+        if clave not in resumen.contadores:
+            assert real <= resumen.minimo()
+    # Lo que cotas() garantiza esta de verdad en el top real
+    _, garantizados = resumen.cotas(5)
+    ordenados = sorted(resumen.entradas(), key=lambda e: e[1], reverse=True)
+    siguiente = ordenados[5][1]
+    seguros = [clave for clave, cuenta, error in ordenados[:5] if cuenta - error >= siguiente]
+    assert len(seguros) == garantizados
+    top_real = {clave for clave, _ in reales.most_common(5)}
+    assert set(seguros) <= top_real
+
+
+def test_spacesaving_con_capacidad_suficiente_es_exacto():
+    claves = flujo(6, 500)
+    resumen = SpaceSaving(1000)
+    for clave in claves:
+        resumen.agregar(clave)
+    assert dict(resumen.mayores(1000)) == dict(Counter(claves))
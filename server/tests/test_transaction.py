@@ -0,0 +1,162 @@
+import pytest
+
+from common import transaction
+from common.transaction import ACCION, DATA, ENVIAR, NO_ENVIAR, ArchivoLog, Transaction
+
+
+class Nodo:
+    def __init__(self):
+        self.datos = []
+
+    def reconstruir_estado(self, clave, contenido):
+        if clave == DATA:
+            self.datos.append(contenido)
+
+    def entradas_snapshot(self):
+        return [(DATA, [dato]) for dato in self.datos]
+
+
+def test_caida_entre_snapshot_y_vaciado_no_reaplica_el_log(tmp_path, monkeypatch):
+    nodo = Nodo()
+    t = Transaction(str(tmp_path))
+    t.cargar_estado(nodo)
+    for i in range(3):
+        nodo.datos.append(str(i))
+        t.commit(DATA, [i])
+    t.sincronizar()
+
+    reemplazar_con = ArchivoLog.reemplazar_con
+    def caida(self, lineas):
+        if self.ruta == t.archivo:
+            raise RuntimeError("caida")
+        reemplazar_con(self, lineas)
+    monkeypatch.setattr(ArchivoLog, "reemplazar_con", caida)
+    with pytest.raises(RuntimeError):
+        t.compactar()
+    monkeypatch.undo()
+
+    recuperado = Nodo()
+    Transaction(str(tmp_path)).cargar_estado(recuperado)
+    assert recuperado.datos == ["0", "1", "2"]
+
+
+def test_compactar_y_recuperar(tmp_path):
+    nodo = Nodo()
+    t = Transaction(str(tmp_path))
+    t.cargar_estado(nodo)
+    for i in range(3):
+        nodo.datos.append(str(i))
+        t.commit(DATA, [i])
+    t.compactar()
+    nodo.datos.append("3")
+    t.commit(DATA, [3])
+    t.sincronizar()
+
+    recuperado = Nodo()
+    Transaction(str(tmp_path)).cargar_estado(recuperado)
+    assert recuperado.datos == ["0", "1", "2", "3"]
+
+
+def test_enviar_retenido_no_se_pisa(tmp_path):
+    t = Transaction(str(tmp_path))
+    t.cargar_estado(Nodo())
+    # RESULT retenido en el coalescer y despues el EOF del mismo mensaje
+    t.retener_confirmaciones()
+    filas = [{"id": "1", "title": "Toy Story | 1995"}, {"id": "2", "title": "Heat"}]
+    t.commit(ACCION, ["7", filas, ENVIAR])
+    t.commit(ACCION, ["7", "", NO_ENVIAR])
+    t.commit(ACCION, ["7", "EOF", ENVIAR])
+    t.sincronizar()
+    t.cerrar_logs()
+
+    recuperado = Transaction(str(tmp_path))
+    recuperado.cargar_estado(Nodo())
+    enviados = []
+    mensaje = {"headers": {"MessageID": "7"}, "ack": lambda: None}
+    enviar = lambda canal, destino, datos, mensaje, tipo: enviados.append((tipo, datos))
+    assert recuperado.mensaje_duplicado("c", "7", enviar, mensaje, None, "destino")
+    assert enviados == [("RESULT", filas), ("EOF", "EOF")]
+
+
+def test_acciones_se_compactan_al_liberar_retenidos(tmp_path):
+    t = Transaction(str(tmp_path))
+    t.cargar_estado(Nodo())
+    # Retencion sostenida: el contador nunca vuelve a cero
+    t.retener_confirmaciones()
+    for i in range(200):
+        t.commit(ACCION, [str(i), [{"id": str(i)}], ENVIAR])
+        t.commit(ACCION, [str(i), "", NO_ENVIAR])
+        if i >= 2:
+            t.liberar_envio(str(i - 2))
+    t.sincronizar()
+    with open(t.archivo_acciones) as f:
+        lineas = f.readlines()
+    # El NO_ENVIAR del ultimo liberado y los dos que siguen retenidos
+    assert len(lineas) == 3
+    t.cerrar_logs()
+
+    recuperado = Transaction(str(tmp_path))
+    recuperado.cargar_estado(Nodo())
+    enviados = []
+    enviar = lambda canal, destino, datos, mensaje, tipo: enviados.append(datos)
+    mensaje = {"headers": {"MessageID": "197"}, "ack": lambda: None}
+    assert recuperado.mensaje_duplicado("c", "197", enviar, mensaje, None, "destino")
+    assert enviados == []
+    mensaje = {"headers": {"MessageID": "199"}, "ack": lambda: None}
+    assert recuperado.mensaje_duplicado("c", "199", enviar, mensaje, None, "destino")
+    assert enviados == [[{"id": "199"}]]
+
+
+def test_tope_de_retenidos_escribe_el_no_enviar(tmp_path, monkeypatch):
+    monkeypatch.setattr(transaction, "MAX_IDS_RETENIDOS", 2)
+    t = Transaction(str(tmp_path))
+    t.cargar_estado(Nodo())
+    t.retener_confirmaciones()
+    for i in range(3):
+        t.commit(ACCION, [str(i), ["fila"], ENVIAR])
+        t.commit(ACCION, [str(i), "", NO_ENVIAR])
+    t.sincronizar()
+    t.cerrar_logs()
+
+    recuperado = Transaction(str(tmp_path))
+    recuperado.cargar_estado(Nodo())
+    enviados = []
+    enviar = lambda canal, destino, datos, mensaje, tipo: enviados.append(datos)
+    # El desalojado queda como ya enviado, no como desconocido
+    mensaje = {"headers": {"MessageID": "0"}, "ack": lambda: None}
+    assert recuperado.mensaje_duplicado("c", "0", enviar, mensaje, None, "destino")
+    assert enviados == []
+
+
+def test_lote_reagrupado_se_reconoce_por_los_ids_de_origen(tmp_path):
+    t = Transaction(str(tmp_path))
+    t.cargar_estado(Nodo())
+    t.registrar_procesado({"ClientID": "c", "MessageID": "1-2", "MessageIDs": "1,2"})
+    t.registrar_procesado({"ClientID": "c", "MessageID": "3"})
+    reagrupado = {"headers": {"ClientID": "c", "MessageID": "2-3", "MessageIDs": "2,3"}, "ack": lambda: None}
+    assert t.mensaje_duplicado("c", "2-3", None, reagrupado, None, "destino")
+    nuevo = {"headers": {"ClientID": "c", "MessageID": "3-4", "MessageIDs": "3,4"}, "ack": lambda: None}
+    assert not t.mensaje_duplicado("c", "3-4", None, nuevo, None, "destino")
+
+
+def test_cada_commit_llega_al_archivo_y_el_fsync_tiene_plazo(tmp_path, monkeypatch):
+    monkeypatch.setattr(transaction, "DURABILIDAD", transaction.DURABILIDAD_GRUPO)
+    monkeypatch.setattr(transaction, "GRUPO_MAX_COMMITS", 1000)
+    monkeypatch.setattr(transaction, "GRUPO_INTERVALO_MS", 60000)
+    sincronizados = []
+    monkeypatch.setattr(transaction.os, "fsync", lambda fd: sincronizados.append(fd))
+    programados = []
+    t = Transaction(str(tmp_path))
+    t.cargar_estado(Nodo())
+    t.usar_temporizador(lambda demora, callback: programados.append(callback) or callback)
+
+    t.commit(DATA, [1])
+    t.commit(DATA, [2])
+    with open(t.archivo) as f:
+        assert f.read() == "1/D\n2/D\n"
+    assert not sincronizados
+    assert len(programados) == 1
+
+    programados[0]()
+    assert sincronizados
+    assert t.commits_pendientes == 0
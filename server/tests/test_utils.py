@@ -0,0 +1,29 @@
+from common.utils import _extraer_claves_literal_eval, extraer_claves
+
+COLUMNAS = [
+    "[{'iso_3166_1': 'AR', 'name': 'Argentina'}, {'iso_3166_1': 'ES', 'name': 'Spain'}]",
+    "[{'cast_id': 14, 'character': 'Woody (voice)', 'credit_id': '52fe4284c3a36847f8024f95', 'gender': 2, 'id': 31, 'name': 'Tom Hanks', 'order': 0, 'profile_path': '/pQFoyx7rp09CJTAb932F2g8Nlho.jpg'}]",
+    """[{'name': "Carlo D'Angelo", 'id': 1}, {"name": 'Ren\\u00e9e', 'id': 2}]""",
+    "[{'name': 'O\\'Brien'}, {'name': 'Tab\\there'}]",
+    "[{'name': None}, {'id': 3}, {'name': 1.5e3}, {'name': True}]",
+    "[{'name': 'a', 'name': 'b'}]",
+    "[{'name': 'Uno'}, ]",
+    "  [ ]  ",
+    "[]",
+    "",
+    "None",
+    "[{'name': 'x'}",
+    "[{'name': ['anidado']}]",
+    "[{'name': {'otro': 1}}]",
+    "[{'name': 'x'}, 'suelto']",
+    "[{'name': 'mal \\N escape'}]",
+    "[{'id': 'mal \\N escape', 'name': 'ok'}]",
+    "{'name': 'no es lista'}",
+    "[{'na\\x6de': 'escapado'}]",
+]
+
+
+def test_el_escaner_coincide_con_literal_eval():
+    for texto in COLUMNAS:
+        assert extraer_claves(texto, "name") == _extraer_claves_literal_eval(texto, "name"), texto
+        assert extraer_claves(texto, "id") == _extraer_claves_literal_eval(texto, "id"), texto
@@ -1,10 +1,12 @@
 from ast import literal_eval
 import logging
-from collections import Counter, defaultdict
+import os
 
-from common.utils import EOF, cargar_eofs, concat_data, create_dataframe, obtener_message_id, obtener_nombre_contenedor, parse_datos, prepare_data_aggregator_consult_3
-from common.communication import obtener_body, obtener_client_id, obtener_query, obtener_tipo_mensaje, run
+from common.utils import EOF, cargar_eofs, create_dataframe, obtener_message_id, obtener_nombre_contenedor, prepare_data_aggregator_consult_3
+from common.combiners import CANTIDAD, COMBINADORES, a_float, cantidad_parcial
+from common.communication import obtener_client_id, obtener_filas, obtener_query, obtener_tipo_mensaje, run
 from common.exceptions import ConsultaInexistente, ErrorCargaDelEstado
+from common.topk import SpaceSaving, TopKExacto
 from common.transaction import Transaction
 
 AGGREGATOR = "aggregator"
@@ -16,6 +18,14 @@ ACCION = "accion"
 NO_ENVIAR = "no_enviar"
 ENVIAR = "enviar"
 
+# Top de actores: exacto, o SpaceSaving con memoria acotada a TOPK_CAPACIDAD contadores
+TOPK_EXACTO = "exacto"
+TOPK_SPACESAVING = "spacesaving"
+TOPK_ACTORES = os.getenv("TOPK_ACTORES", TOPK_EXACTO).strip().lower()
+TOPK_CAPACIDAD = int(os.getenv("TOPK_CAPACIDAD", "1000"))
+# Error de cada contador de SpaceSaving en el snapshot
+ERROR = "error"
+
 # -----------------------
 # Nodo Aggregator
 # -----------------------
@@ -23,6 +33,8 @@ class AggregatorNode:
     def __init__(self):
         self.resultados_parciales = {}
         self.eof_esperados = {}
+        # mensaje_duplicado descarta lo ya procesado: los acks pueden ir acumulados
+        self.deduplica = True
         self.transaction = Transaction(TMP_DIR)
         self.transaction.cargar_estado(self)
     
@@ -30,16 +42,11 @@ class AggregatorNode:
         client_id, request_id, valor = contenido.split("|", 2)
         match clave:
             case "resultados_parciales":
-                if client_id not in self.resultados_parciales:
-                    self.resultados_parciales[client_id] = {}
-                request_id = int(request_id)
-                if request_id not in self.resultados_parciales[client_id]:
-                    self.resultados_parciales[client_id][request_id] = []
-                self.resultados_parciales[client_id][request_id].append(parse_datos(valor))
+                self.acumular(client_id, int(request_id), literal_eval(valor))
             case "eof_esperados":
                 if client_id not in self.eof_esperados:
                     self.eof_esperados[client_id] = {}
-                self.eof_esperados[client_id][request_id] = int(valor)
+                self.eof_esperados[client_id][int(request_id)] = int(valor)
             case _:
                 raise ErrorCargaDelEstado(f"Error en la carga del estado")
 
@@ -55,20 +62,101 @@ class AggregatorNode:
 
 
 
+    def entradas_snapshot(self):
+        # El estado de cada consulta se guarda como un unico delta
+        entradas = []
+        for client_id, consultas in self.eof_esperados.items():
+            for request_id, cantidad in consultas.items():
+                entradas.append((EOF_ESPERADOS, [client_id, request_id, cantidad]))
+        for client_id, estados in self.resultados_parciales.items():
+            for request_id, estado in estados.items():
+                entradas.append((RESULT, [client_id, request_id, self.filas_estado(request_id, estado)]))
+        return entradas
+
+
+    def filas_estado(self, request_id, estado):
+        match request_id:
+            case 2:
+                return [{"country": pais, "budget": suma} for pais, suma, _ in estado.entradas()]
+            case 3:
+                return [{"id": movie_id, "title": title, "rating": suma, CANTIDAD: cantidad} for (movie_id, title), (suma, cantidad) in estado.items()]
+            case 4:
+                if isinstance(estado, SpaceSaving):
+                    return [{"name": nombre, CANTIDAD: cantidad, ERROR: error} for nombre, cantidad, error in estado.entradas()]
+                return [{"name": nombre, CANTIDAD: cantidad} for nombre, cantidad, _ in estado.entradas()]
+            case 5:
+                return [{"sentiment": sentimiento, "rate_revenue_budget": suma, CANTIDAD: cantidad} for sentimiento, (suma, cantidad) in estado.items()]
+        return []
+
+
     def guardar_datos(self, request_id, datos, client_id):
         if client_id not in self.resultados_parciales:
             self.resultados_parciales[client_id] = {}
             self.eof_esperados[client_id] = {}
             
-        if request_id not in self.resultados_parciales[client_id]:
-            self.resultados_parciales[client_id][request_id] = []
-            
         if request_id not in self.eof_esperados[client_id]:
             self.eof_esperados[client_id][request_id] = cargar_eofs()[request_id]
             self.transaction.commit(EOF_ESPERADOS, [client_id, request_id, self.eof_esperados[client_id][request_id]])
-        datos = create_dataframe(datos)
-        self.resultados_parciales[client_id][request_id].append(datos)
-        self.transaction.commit(RESULT, [client_id, request_id, datos])
+
+        combinador = COMBINADORES.get(request_id)
+        if combinador is None:
+            raise ConsultaInexistente(f"Consulta {request_id} no encontrada")
+        # Al log va el delta del mensaje (un parcial por grupo), no las filas
+        delta = combinador(create_dataframe(datos))
+        self.acumular(client_id, request_id, delta)
+        self.transaction.commit(RESULT, [client_id, request_id, delta])
+
+
+    def estado_consulta(self, client_id, request_id):
+        estados = self.resultados_parciales.setdefault(client_id, {})
+        if request_id not in estados:
+            estados[request_id] = self.nuevo_topk(request_id) if request_id in (2, 4) else {}
+        return estados[request_id]
+
+
+    def nuevo_topk(self, request_id):
+        if request_id == 4 and TOPK_ACTORES == TOPK_SPACESAVING:
+            return SpaceSaving(TOPK_CAPACIDAD)
+        return TopKExacto()
+
+
+    def topk_parcial(self, request_id, delta):
+        # Cada delta (el parcial de un combiner o shard, o el estado del
+        # snapshot) se arma como un top-k parcial y se combina con el acumulado
+        parcial = self.nuevo_topk(request_id)
+        for fila in delta:
+            if request_id == 2:
+                parcial.agregar(fila.get("country"), a_float(fila.get("budget", 0), 0))
+            elif ERROR in fila and isinstance(parcial, SpaceSaving):
+                # Fila del snapshot: el contador se restaura con su error
+                parcial.restaurar(fila["name"], cantidad_parcial(fila), int(fila[ERROR]))
+            else:
+                parcial.agregar(fila["name"], cantidad_parcial(fila))
+        return parcial
+
+
+    def acumular(self, client_id, request_id, delta):
+        # Estado por consulta, O(grupos):
+        #   2: top-k de suma de budget por pais
+        #   3: (id, title) -> (suma de ratings, cantidad)
+        #   4: top-k de apariciones por actor
+        #   5: sentimiento -> (suma de revenue/budget, cantidad)
+        estado = self.estado_consulta(client_id, request_id)
+        if request_id in (2, 4):
+            estado.combinar(self.topk_parcial(request_id, delta))
+            return
+        for fila in delta:
+            match request_id:
+                case 3:
+                    clave = (str(fila["id"]), fila["title"])
+                    suma, cantidad = estado.get(clave, (0.0, 0))
+                    estado[clave] = (suma + float(fila["rating"]), cantidad + cantidad_parcial(fila))
+                case 5:
+                    sentimiento = fila.get("sentiment", "UNKNOWN")
+                    suma, cantidad = estado.get(sentimiento, (0.0, 0))
+                    estado[sentimiento] = (suma + a_float(fila.get("rate_revenue_budget"), 0.0), cantidad + cantidad_parcial(fila))
+                case _:
+                    raise ConsultaInexistente(f"Consulta {request_id} no encontrada")
 
 
 
@@ -80,62 +168,40 @@ class AggregatorNode:
         if not datos_cliente:
             return False 
         
-        datos = concat_data(datos_cliente[request_id])
+        estado = self.estado_consulta(client_id, request_id)
         
         match request_id:
             case 2:
-                return self.ejecutar_consulta_2(datos)
+                return self.ejecutar_consulta_2(estado)
             case 3:
-                return self.ejecutar_consulta_3(datos)
+                return self.ejecutar_consulta_3(estado)
             case 4:
-                return self.ejecutar_consulta_4(datos)
+                return self.ejecutar_consulta_4(estado)
             case 5:
-                return self.ejecutar_consulta_5(datos)
+                return self.ejecutar_consulta_5(estado)
             case _:
                 logging.warning(f"Consulta desconocida {request_id}")
                 raise ConsultaInexistente(f"Consulta {request_id} no encontrada")
     
 
-    def ejecutar_consulta_2(self, datos):
+    def ejecutar_consulta_2(self, suma_por_pais):
         logging.info("Procesando datos para consulta 2")
-        suma_por_pais = {}
-        for row in datos:
-            country = row.get('country')
-            try:
-                budget = float(row.get('budget', 0))
-            except (ValueError, TypeError):
-                budget = 0
-
-            if country not in suma_por_pais:
-                suma_por_pais[country] = 0
-            suma_por_pais[country] += budget
-        top_5 = sorted(suma_por_pais.items(), key=lambda x: x[1], reverse=True)[:5]
+        top_5 = suma_por_pais.mayores(5)
         resultado = [{'country': pais, 'budget': suma} for pais, suma in top_5]
 
         return resultado
 
-    def ejecutar_consulta_3(self, datos):
+    def ejecutar_consulta_3(self, agrupados):
         logging.info("Procesando datos para consulta 3")
-        if not datos:
+        if not agrupados:
             return None
-        agrupados = {}
-        for d in datos:
-            key = (d["id"], d["title"])
-            try:
-                rating = float(d["rating"])
-            except (ValueError, TypeError):
-                continue
-            if key not in agrupados:
-                agrupados[key] = []
-            agrupados[key].append(rating)
         promedios = []
-        for (movie_id, title), ratings in agrupados.items():
-            if ratings:
-                avg_rating = sum(ratings) / len(ratings)
+        for (movie_id, title), (suma, cantidad) in agrupados.items():
+            if cantidad:
                 promedios.append({
                     "id": movie_id,
                     "title": title,
-                    "rating": avg_rating
+                    "rating": suma / cantidad
                 })
         if not promedios:
             return None
@@ -147,41 +213,22 @@ class AggregatorNode:
 
 
 
-    def ejecutar_consulta_4(self, datos):
+    def ejecutar_consulta_4(self, contador):
         logging.info("Procesando datos para consulta 4")
-        contador = Counter()
-        for fila in datos:
-            nombre = fila.get("name")
-            if nombre:
-                contador[nombre] += 1
-        top_10 = contador.most_common(10)
+        top_10 = contador.mayores(10)
+        if isinstance(contador, SpaceSaving):
+            error_maximo, garantizados = contador.cotas(10)
+            logging.info(f"Top de actores con SpaceSaving({contador.capacidad}): error maximo {error_maximo}, {garantizados}/{len(top_10)} garantizados")
         resultado = [{"name": nombre, "count": cantidad} for nombre, cantidad in top_10]
         return resultado
 
 
 
-    def ejecutar_consulta_5(self, datos):
+    def ejecutar_consulta_5(self, parciales):
         logging.info("Procesando datos para consulta 5")
-        for fila in datos:
-            try:
-                budget = float(fila['budget'])
-                revenue = float(fila['revenue'])
-                if budget == 0:
-                    fila['rate_revenue_budget'] = 0.0
-                else:
-                    fila['rate_revenue_budget'] = revenue / budget
-            except (ValueError, ZeroDivisionError, KeyError):
-                fila['rate_revenue_budget'] = 0.0
-        sumas = defaultdict(float)
-        cantidades = defaultdict(int)
-        for fila in datos:
-            sentimiento = fila.get('sentiment', 'UNKNOWN')
-            rate = fila.get('rate_revenue_budget', 0.0)
-            sumas[sentimiento] += rate
-            cantidades[sentimiento] += 1
         resultado = []
-        for sentimiento in sumas:
-            promedio = sumas[sentimiento] / cantidades[sentimiento]
+        for sentimiento, (suma, cantidad) in parciales.items():
+            promedio = suma / cantidad
             resultado.append({
                 "sentiment": sentimiento,
                 "rate_revenue_budget": promedio
@@ -220,7 +267,7 @@ class AggregatorNode:
                     if not self.eof_esperados[client_id]:
                         del self.eof_esperados[client_id]
             else:
-                self.guardar_datos(request_id, obtener_body(mensaje), client_id)
+                self.guardar_datos(request_id, obtener_filas(mensaje), client_id)
             mensaje['ack']()
         except ConsultaInexistente as e:
             logging.warning(f"Consulta inexistente: {e}")
@@ -2,8 +2,9 @@ from multiprocessing import Process
 import os
 import sys
 import logging
-from common.utils import EOF,  cargar_datos_broker, cargar_eofs, obtener_nombre_contenedor
-from common.communication import  obtener_body, obtener_client_id, obtener_query, obtener_tipo_mensaje, run
+from common.utils import EOF, PARTICION_HASH, cargar_datos_broker, cargar_eofs, cargar_particion_joiners, indice_particion, obtener_nombre_contenedor
+from common.communication import  BLOOM, EXCHANGE_PNL, exchange_joiners, obtener_client_id, obtener_datos, obtener_filas, obtener_joiner_id, obtener_query, obtener_tipo_mensaje, publicar, reenviar_mensaje, run
+from common.bloom import FiltroBloom
 from common.exceptions import ConsultaInexistente, ErrorCargaDelEstado
 
 from common.transaction import ACCION, Transaction
@@ -28,6 +29,9 @@ class Broker:
         self.eof_esperar = {}
         self.ultimo_nodo_consulta = {}
         self.clients = []
+        # client_id -> consulta -> joiner_id -> FiltroBloom de los ids que pueden joinear
+        self.filtros = {}
+        self.particion = cargar_particion_joiners()
         self.transaction = Transaction(TMP_DIR)
         self.transaction.cargar_estado(self)
 
@@ -49,10 +53,20 @@ class Broker:
             case _:
                 raise ErrorCargaDelEstado(f"Error en la carga del estado")
 
+    def entradas_snapshot(self):
+        entradas = []
+        for client_id in self.clients:
+            for consulta, nodo in enumerate(self.ultimo_nodo_consulta[client_id]):
+                entradas.append((ULTIMO_NODO, [client_id, consulta, nodo]))
+            for request_id, cantidad in self.eof_esperar[client_id].items():
+                entradas.append((EOF_ESPERA, [client_id, request_id, cantidad]))
+        return entradas
+
     def create_client(self, client):
         self.nodos_enviar[client] = cargar_datos_broker()
         self.eof_esperar[client] = cargar_eofs()
         self.ultimo_nodo_consulta[client] = [self.nodos_enviar[client][3][0], self.nodos_enviar[client][4][0], 1]
+        self.filtros[client] = {3: {}, 4: {}}
         self.clients.append(client)
 
 
@@ -60,6 +74,7 @@ class Broker:
         self.nodos_enviar.clear()
         self.eof_esperar.clear()
         self.ultimo_nodo_consulta.clear()
+        self.filtros.clear()
         self.clients.clear()
         if es_global:
             try:
@@ -91,15 +106,58 @@ class Broker:
 
 
     def distribuir_informacion(self, client_id, request_id, mensaje, canal, enviar_func, tipo=None):
+        # Una publicacion al fanout llega a todos los nodos bindeados a la consulta
         if request_id == 5:
-            for pnl_id in range(1, self.nodos_enviar[client_id][request_id] + 1):
-                destino = f'pnl_request_5_{pnl_id}'
-                enviar_func(canal, destino, obtener_body(mensaje), mensaje, tipo)
+            publicar(canal, "", EOF, mensaje, tipo, exchange=EXCHANGE_PNL)
+        elif tipo == "MOVIES":
+            reenviar_mensaje(canal, "", mensaje, tipo, exchange=exchange_joiners(request_id))
         else:
-            for joiner_id in self.nodos_enviar[client_id][request_id]:
-                destino = f'joiner_request_{request_id}_{joiner_id}'
-                body = EOF if tipo != "MOVIES" else obtener_body(mensaje)
-                enviar_func(canal, destino, body, mensaje, tipo)
+            publicar(canal, "", EOF, mensaje, tipo, exchange=exchange_joiners(request_id))
+
+
+    def registrar_filtro(self, client_id, request_id, mensaje):
+        # No se persiste: sin filtro el broker solo deja pasar todo, como antes
+        filtros = self.filtros.get(client_id, {}).get(request_id)
+        if filtros is None:
+            # Llego despues del EOF de los datos: ya no hay filas que filtrar
+            return
+        joiner_id = obtener_joiner_id(mensaje)
+        filtros[joiner_id] = FiltroBloom.deserializar(obtener_datos(mensaje))
+        logging.info(f"Filtro de Bloom del joiner {joiner_id} para consulta {request_id} del cliente {client_id}")
+
+
+    def descartar_filtros(self, client_id, request_id):
+        # Con el EOF de ratings/credits no vienen mas filas de la consulta
+        filtros = self.filtros.get(client_id)
+        if filtros is None:
+            return
+        filtros.pop(request_id, None)
+        if not filtros:
+            del self.filtros[client_id]
+
+
+    def filtro_para(self, client_id, request_id, joiner_id=None):
+        filtros = self.filtros.get(client_id, {}).get(request_id)
+        if not filtros:
+            return None
+        if joiner_id is not None:
+            return filtros.get(joiner_id)
+        # En round robin cada joiner tiene todas las movies: cualquier filtro sirve
+        return next(iter(filtros.values()), None)
+
+
+    def distribuir_particionado(self, client_id, request_id, mensaje, canal, tipo):
+        # Movies, ratings y credits van al mismo joiner segun el id de la pelicula
+        joiners = self.nodos_enviar[client_id][request_id]
+        particiones = {}
+        for fila in obtener_filas(mensaje):
+            joiner_id = joiners[indice_particion(fila.get("id"), len(joiners))]
+            filtro = self.filtro_para(client_id, request_id, joiner_id) if tipo != "MOVIES" else None
+            if filtro is not None and not filtro.contiene(fila.get("id")):
+                continue
+            particiones.setdefault(joiner_id, []).append(fila)
+        for joiner_id, filas in particiones.items():
+            publicar(canal, f'joiner_request_{request_id}_{joiner_id}', filas, mensaje, tipo)
 
 
     def distribuir_informacion_round_robin(self, client_id, request_id, mensaje, canal, enviar_func, tipo=None):
@@ -110,7 +168,13 @@ class Broker:
         elif request_id == 4:
             destino = f'joiner_request_4_{self.ultimo_nodo_consulta[client_id][CONSULTA_4]}'
         self.siguiente_nodo(request_id, client_id)
-        enviar_func(canal, destino, obtener_body(mensaje), mensaje, tipo)
+        filtro = self.filtro_para(client_id, request_id) if request_id != 5 else None
+        if filtro is None:
+            reenviar_mensaje(canal, destino, mensaje, tipo)
+            return
+        filas = [fila for fila in obtener_filas(mensaje) if filtro.contiene(fila.get("id"))]
+        if filas:
+            publicar(canal, destino, filas, mensaje, tipo)
 
 
     def procesar_mensajes(self, canal, _, mensaje, enviar_func):
@@ -131,8 +195,16 @@ class Broker:
             else:
                 if tipo_mensaje in {"EOF_CREDITS", "EOF_RATINGS"}:
                     logging.info(f"Recibi EOF: {tipo_mensaje}")
-                if tipo_mensaje in {"MOVIES", "EOF_CREDITS", "EOF_RATINGS"}:
+                if tipo_mensaje == BLOOM:
+                    self.registrar_filtro(client_id, request_id, mensaje)
+
+                elif tipo_mensaje in {"MOVIES", "CREDITS", "RATINGS"} and self.particion == PARTICION_HASH:
+                    self.distribuir_particionado(client_id, request_id, mensaje, canal, tipo_mensaje)
+
+                elif tipo_mensaje in {"MOVIES", "EOF_CREDITS", "EOF_RATINGS"}:
                     self.distribuir_informacion(client_id, request_id, mensaje, canal, enviar_func, tipo_mensaje)
+                    if tipo_mensaje != "MOVIES":
+                        self.descartar_filtros(client_id, request_id)
 
                 elif tipo_mensaje in {"CREDITS", "RATINGS"}:
                     self.distribuir_informacion_round_robin(client_id, request_id, mensaje, canal, enviar_func, tipo_mensaje)
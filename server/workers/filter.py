@@ -1,81 +1,192 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import logging
 import os
 from multiprocessing import Process
-from common.utils import prepare_data_consult_1_3_4, prepare_data_consult_2, EOF, prepare_data_consult_5
-from common.communication import  obtener_body, obtener_query, obtener_tipo_mensaje, run
+from common.utils import EOF, create_dataframe, decodificar_columna, prepare_data_consult_5, proyectar_columnas
+from common.communication import  destino_filtro, mensaje_de_consulta, obtener_consultas, obtener_filas, obtener_query, obtener_tipo_mensaje, run
+from common.combiners import combinar
+from common.predicados import cantidad_igual, columna_anios, columna_cantidad, columna_nombres, contiene_todos, rango_anios, seleccionar
 from common.exceptions import ConsultaInexistente
 
 FILTER = "filter"
+FILTER_PROCESOS = int(os.getenv("FILTER_PROCESOS", "1"))
+
+# -----------------------
+# Planes por consulta
+# -----------------------
+# (columna, predicado) en orden de costo: cada columna se decodifica solo
+# para las filas que pasaron los predicados anteriores. Las columnas de
+# salida se decodifican al final, sobre las filas seleccionadas.
+PLANES = {
+    1: (
+        [
+            ("release_date", lambda filas: rango_anios(columna_anios(filas), 2000, 2010)),
+            ("production_countries", lambda filas: contiene_todos(columna_nombres(filas, "production_countries"), ("argentina", "spain"))),
+        ],
+        ["genres"],
+    ),
+    2: (
+        [
+            ("production_countries", lambda filas: cantidad_igual(columna_cantidad(filas, "production_countries"), 1)),
+        ],
+        ["budget"],
+    ),
+    3: (
+        [
+            ("release_date", lambda filas: rango_anios(columna_anios(filas), 2000)),
+            ("production_countries", lambda filas: contiene_todos(columna_nombres(filas, "production_countries"), ("argentina",))),
+        ],
+        [],
+    ),
+}
+PLANES[4] = PLANES[3]
+
+# Esquema de salida por consulta: solo lo que usa la etapa siguiente
+ESQUEMA_SALIDA = {
+    1: ["title", "genres"],
+    2: ["country", "budget"],
+    3: ["id", "title"],
+    4: ["id", "title"],
+    5: ["overview", "budget", "revenue"],
+}
+
+# Scan compartido: columnas que el gateway mandaba a cada consulta y cuales
+# no pueden venir vacias (las filas con alguna vacia el gateway las descartaba)
+COLUMNAS_PELICULAS = ["id", "title", "genres", "production_countries", "release_date"]
+PROYECCIONES = {
+    1: COLUMNAS_PELICULAS,
+    2: ["production_countries", "budget"],
+    3: COLUMNAS_PELICULAS,
+    4: COLUMNAS_PELICULAS,
+    5: ["overview", "budget", "revenue"],
+}
+
+
+def proyectar(filas, request_id):
+    columnas = PROYECCIONES[request_id]
+    proyectadas = []
+    for fila in filas:
+        valores = [fila.get(columna) or "" for columna in columnas]
+        if all(valores) and (request_id not in (1, 3, 4) or fila["title"].strip()):
+            proyectadas.append(dict(zip(columnas, valores)))
+    return proyectadas
+
+
+def aplicar_plan(request_id, datos):
+    predicados, salida = PLANES[request_id]
+    filas = create_dataframe(datos)
+    for columna, predicado in predicados:
+        if not filas:
+            break
+        decodificar_columna(filas, columna)
+        filas = seleccionar(filas, predicado(filas))
+    for columna in salida:
+        decodificar_columna(filas, columna)
+    return filas
+
+# -----------------------
+# Pool de procesos
+# -----------------------
+_filtro_pool = None
+
+def _inicializar_pool():
+    global _filtro_pool
+    _filtro_pool = FiltroNode(procesos=1)
+
+def _ejecutar_en_pool(request_id, mensaje):
+    return _filtro_pool.ejecutar_consulta(request_id, obtener_filas(mensaje))
+
+def _ejecutar_scan_en_pool(consultas, mensaje):
+    return _filtro_pool.ejecutar_consultas(consultas, obtener_filas(mensaje))
 
 # -----------------------
 # Nodo Filtro
 # -----------------------
 class FiltroNode:
-    def __init__(self):
-        pass
+    def __init__(self, procesos=FILTER_PROCESOS):
+        self.pool = None
+        self.en_curso = deque()
+        if procesos > 1:
+            self.pool = ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_pool)
+            # Hace falta tener mensajes en vuelo para mantener ocupado al pool
+            self.prefetch_minimo = procesos * 2
+            # El callback solo encola: su duracion no dice cuanto tarda el pool,
+            # asi que el prefetch adaptativo subiria siempre hasta el maximo
+            self.prefetch_fijo = True
+            logging.info(f"Filtro con pool de {procesos} procesos")
 
     def eliminar(self, _):
-        pass
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        self.en_curso.clear()
 
     def ejecutar_consulta(self, request_id, datos):
+        # Todos los resultados que se publican pasan por aca: se proyectan al esquema de salida
         match request_id:
             case 1:
-                return self.ejecutar_consulta_1(datos)
+                resultado = self.ejecutar_consulta_1(datos)
             case 2:
-                return self.ejecutar_consulta_2(datos)
+                resultado = self.ejecutar_consulta_2(datos)
             case 3:
                 logging.info("Procesando datos para consulta 3")
-                return self.ejecutar_consulta_3_y_4(datos)
+                resultado = self.ejecutar_consulta_3_y_4(datos, request_id)
             case 4:
                 logging.info("Procesando datos para consulta 4")
-                return self.ejecutar_consulta_3_y_4(datos)
+                resultado = self.ejecutar_consulta_3_y_4(datos, request_id)
             case 5:
-                return self.ejecutar_consulta_5(datos)
+                resultado = self.ejecutar_consulta_5(datos)
             case _:
                 logging.warning(f"Consulta desconocida: {request_id}")
                 raise ConsultaInexistente(f"Consulta {request_id} no encontrada")
+        resultado = proyectar_columnas(resultado, ESQUEMA_SALIDA[request_id])
+        # Solo la 2 va directo al aggregator: el resto sigue a joiner, pnl o gateway
+        return combinar(request_id, resultado) if request_id == 2 else resultado
+
+
+    def ejecutar_consultas(self, consultas, filas):
+        # Un solo parseo del batch para todas las consultas. La 3 y la 4 tienen
+        # el mismo plan y la misma proyeccion: se resuelven una vez
+        resultados = {}
+        for request_id in consultas:
+            if request_id == 4 and 3 in resultados:
+                resultados[4] = resultados[3]
+                continue
+            resultados[request_id] = self.ejecutar_consulta(request_id, proyectar(filas, request_id))
+        return resultados
+
+
+    def publicar_resultados(self, canal, mensaje, enviar_func, resultados):
+        tipo_mensaje = obtener_tipo_mensaje(mensaje)
+        for request_id, resultado in resultados.items():
+            enviar_func(canal, destino_filtro(request_id), resultado, mensaje_de_consulta(mensaje, request_id), tipo_mensaje)
 
 
     def ejecutar_consulta_1(self, datos_csv):
         logging.info("Procesando datos para consulta 1") 
-        datos = prepare_data_consult_1_3_4(datos_csv)
-        resultado = []
-        for row in datos:
-            fecha = row.get("release_date")
-            paises = row.get("production_countries_str", "")
-            if fecha and 2000 <= fecha.year < 2010:
-                if "argentina" in paises and "spain" in paises:
-                    resultado.append({
-                        "title": row.get("title", ""),
-                        "genres": row.get("genres", [])
-                    })
-        return resultado
+        return [
+            {"title": row.get("title", ""), "genres": row.get("genres", [])}
+            for row in aplicar_plan(1, datos_csv)
+        ]
 
 
     def ejecutar_consulta_2(self, datos):
         logging.info("Procesando datos para consulta 2")
-        datos = prepare_data_consult_2(datos)
-        resultado = []
-        for row in datos:
-            paises = row.get('production_countries', [])
-            if len(paises) == 1:
-                row['country'] = paises[0]
-                resultado.append(row)
+        resultado = aplicar_plan(2, datos)
+        for row in resultado:
+            row['country'] = row['production_countries'][0]
         return resultado
     
     
-    def ejecutar_consulta_3_y_4(self, datos):
-        datos = prepare_data_consult_1_3_4(datos)
+    def ejecutar_consulta_3_y_4(self, datos, request_id=3):
         peliculas_filtradas = []
-        for fila in datos:
-            paises = fila.get("production_countries_str", "")
-            fecha = fila.get("release_date")
-            if fecha and fecha.year >= 2000 and "argentina" in paises:
-                try:
-                    fila["id"] = int(fila["id"])
-                except (ValueError, TypeError):
-                    continue 
-                peliculas_filtradas.append(fila)
+        for fila in aplicar_plan(request_id, datos):
+            try:
+                fila["id"] = int(fila["id"])
+            except (ValueError, TypeError):
+                continue 
+            peliculas_filtradas.append(fila)
         return peliculas_filtradas
 
 
@@ -87,14 +198,20 @@ class FiltroNode:
 
 
     def procesar_mensajes(self, canal, destino, mensaje, enviar_func):
-        request_id = obtener_query(mensaje)
+        if self.pool is not None:
+            self.encolar_en_pool(canal, destino, mensaje, enviar_func)
+            return
         tipo_mensaje = obtener_tipo_mensaje(mensaje)
+        consultas = obtener_consultas(mensaje)
+        request_id = consultas if consultas else obtener_query(mensaje)
         try:
             if tipo_mensaje == EOF:
                 logging.info(f"Consulta {request_id} recibió EOF")
-                enviar_func(canal, destino, EOF, mensaje, EOF)
+                enviar_func(canal, destino or destino_filtro(request_id), EOF, mensaje, EOF)
+            elif consultas:
+                self.publicar_resultados(canal, mensaje, enviar_func, self.ejecutar_consultas(consultas, obtener_filas(mensaje)))
             else:
-                resultado = self.ejecutar_consulta(request_id, obtener_body(mensaje))
+                resultado = self.ejecutar_consulta(request_id, obtener_filas(mensaje))
                 enviar_func(canal, destino, resultado, mensaje, tipo_mensaje)
             mensaje['ack']()
         except ConsultaInexistente as e:
@@ -103,6 +220,45 @@ class FiltroNode:
             logging.error(f"Error procesando mensaje en consulta {request_id}: {e}")
 
 
+    def encolar_en_pool(self, canal, destino, mensaje, enviar_func):
+        # Los EOF no pasan por el pool pero esperan su turno en la cola, asi
+        # salen despues de los resultados de los mensajes anteriores
+        futuro = None
+        if obtener_tipo_mensaje(mensaje) != EOF:
+            datos = {'body': mensaje['body'], 'headers': mensaje['headers']}
+            consultas = obtener_consultas(mensaje)
+            if consultas:
+                futuro = self.pool.submit(_ejecutar_scan_en_pool, consultas, datos)
+            else:
+                futuro = self.pool.submit(_ejecutar_en_pool, obtener_query(mensaje), datos)
+            futuro.add_done_callback(lambda _: canal.connection.add_callback_threadsafe(self.drenar))
+        self.en_curso.append((futuro, canal, destino, mensaje, enviar_func))
+        self.drenar()
+
+    def drenar(self):
+        # Publica y ackea en orden de entrega: se corta en el primero que no termino
+        while self.en_curso:
+            futuro, canal, destino, mensaje, enviar_func = self.en_curso[0]
+            if futuro is not None and not futuro.done():
+                return
+            self.en_curso.popleft()
+            tipo_mensaje = obtener_tipo_mensaje(mensaje)
+            consultas = obtener_consultas(mensaje)
+            request_id = consultas if consultas else obtener_query(mensaje)
+            try:
+                if futuro is None:
+                    logging.info(f"Consulta {request_id} recibió EOF")
+                    enviar_func(canal, destino or destino_filtro(request_id), EOF, mensaje, EOF)
+                elif consultas:
+                    self.publicar_resultados(canal, mensaje, enviar_func, futuro.result())
+                else:
+                    enviar_func(canal, destino, futuro.result(), mensaje, tipo_mensaje)
+                mensaje['ack']()
+            except ConsultaInexistente as e:
+                logging.warning(f"Consulta inexistente: {e}")
+            except Exception as e:
+                logging.error(f"Error procesando mensaje en consulta {request_id}: {e}")
+
 
 # -----------------------
 # Ejecutando nodo filtro
@@ -1,13 +1,15 @@
 import ast
-import csv
 import logging
 import os
 import tempfile
 import threading
-from common.utils import EOF, concat_data, create_dataframe, get_batch_limits, obtener_message_id, obtener_nombre_contenedor, parse_credits, parse_datos, prepare_data_consult_4, write_dicts_to_csv
-from common.communication import obtener_body, obtener_client_id, obtener_query, obtener_tipo_mensaje, run
+from common.utils import EOF, concat_data, create_dataframe, extraer_claves, get_batch_limits, get_bloom_falsos_positivos, obtener_message_id, obtener_nombre_contenedor, parse_credits, parse_datos, prepare_data_consult_4, proyectar_columnas
+from common.communication import asegurar_publicado, obtener_client_id, obtener_filas, obtener_query, obtener_tipo_mensaje, publicar_filtro, run
+from common.bloom import FiltroBloom
+from common.combiners import combinar
 from common.exceptions import ConsultaInexistente, ErrorCargaDelEstado
-from common.transaction import ACCION, LAST_BATCH_ID, Transaction
+from common.segmentos import agregar_batches, borrar_segmento, leer_batches
+from common.transaction import ACCION, CLIENTE_TERMINADO, LAST_BATCH_ID, Transaction
 
 
 JOINER = "joiner"
@@ -18,6 +20,13 @@ TERMINO = 2
 TMP_DIR = f"/tmp/{obtener_nombre_contenedor(JOINER)}_tmp"
 
 BATCH_CREDITS, BATCH_RATINGS = get_batch_limits(JOINER)
+# Con las movies completas, cada batch de ratings/credits se joinea al llegar
+JOIN_STREAMING = os.getenv("JOIN_STREAMING", "1") == "1"
+# Tasa de falsos positivos del filtro que se manda al broker (0 lo desactiva)
+BLOOM_FALSOS_POSITIVOS = get_bloom_falsos_positivos()
+JOINER_ID = int(os.getenv("WORKER_ID", 0))
+# Consultas que atiende este joiner: un cliente se libera cuando terminan todas
+CONSULTAS_JOINER = [int(c) for c in os.getenv("CONSULTAS", "").split(",") if c] or [3, 4]
 
 DATA = "datos"
 DATA_TERM = "termino_datos"
@@ -25,10 +34,18 @@ TERM = "termino_movies"
 RESULT = "resultados_parciales"
 DISK = "archivos_en_disco"
 PATH = "archivos_path"
+SPILL_ENVIADO = "spill_enviado"
 
 NO_ENVIAR = "no_enviar"
 ENVIAR = "enviar"
 
+# Columnas que se guardan de cada pelicula y que recibe el aggregator por consulta
+ESQUEMA_MOVIES = ["id", "title"]
+ESQUEMA_SALIDA = {
+    3: ["id", "title", "rating"],
+    4: ["id", "name"],
+}
+
 # -----------------------
 # Nodo Joiner
 # -----------------------
@@ -41,11 +58,22 @@ class JoinerNode:
         self.locks = {}
         self.archivos_en_disco = {}
         self.archivos_path = {}
+        # Ultimo batch del segmento en disco ya joineado y enviado
+        self.spill_enviado = {}
         self.ultimo_batch_id = {} 
+        self.indice_movies = {}
+        # Clientes ya liberados: un EOF redelivereado se descarta
+        self.clientes_terminados = set()
+        # mensaje_duplicado descarta lo ya procesado: los acks pueden ir acumulados
+        self.deduplica = True
         self.transaction = Transaction(TMP_DIR)
         if self.transaction.cargar_estado(self):
             for client_id in self.informacion_movies.keys():
                 self.transaction.commit(PATH, [client_id, self.archivos_path[client_id]["ratings"], self.archivos_path[client_id]["credits"]])
+        # Aunque no haya acciones, el log de datos ya se reprodujo
+        for client_id in self.informacion_movies.keys():
+            for request_id in self.informacion_movies[client_id]:
+                self.reconstruir_indice(client_id, request_id)
 
 
     def reconstruir_estado(self, clave, contenido):
@@ -112,6 +140,11 @@ class JoinerNode:
                 csv_almacenado, booleano = contenido
                 valor = booleano == "True"
                 self.archivos_en_disco[client_id][csv_almacenado] = valor
+                if not valor:
+                    self.spill_enviado[client_id][csv_almacenado] = None
+            case "spill_enviado":
+                csv_almacenado, batch_id = contenido
+                self.spill_enviado[client_id][csv_almacenado] = batch_id
             case "archivos_path":
                 ratings, credits = contenido
                 if not client_id in self.archivos_path:
@@ -120,10 +153,37 @@ class JoinerNode:
                 self.archivos_path[client_id]["credits"] = credits
             case "ultimo_batch_id":
                 self.ultimo_batch_id = ast.literal_eval(contenido)
+            case "cliente_terminado":
+                self.olvidar_cliente(client_id)
             case _:
                 raise ErrorCargaDelEstado(f"Error en la carga del estado")
 
 
+    def entradas_snapshot(self):
+        # Mismas entradas que el log, en un orden que reconstruir_estado acepta
+        entradas = [(CLIENTE_TERMINADO, [client_id, True]) for client_id in self.clientes_terminados]
+        for client_id in self.informacion_movies:
+            paths = self.archivos_path.get(client_id)
+            if paths is not None:
+                entradas.append((PATH, [client_id, paths["ratings"], paths["credits"]]))
+            for request_id, termino in self.termino_movies[client_id].items():
+                entradas.append((TERM, [client_id, request_id, termino]))
+            for request_id, batches in self.informacion_movies[client_id].items():
+                for df in batches:
+                    entradas.append((RESULT, [client_id, request_id, df]))
+            for csv in ("ratings", "credits"):
+                info = self.informacion_csvs[client_id][csv]
+                lineas = 0
+                for chunk in info[DATOS]:
+                    lineas += len(chunk["datos"])
+                    entradas.append((DATA, [client_id, csv, chunk, lineas]))
+                entradas.append((DATA_TERM, [client_id, csv, info[TERMINO]]))
+                entradas.append((DISK, [client_id, csv, self.archivos_en_disco[client_id][csv]]))
+                if self.spill_enviado[client_id][csv] is not None:
+                    entradas.append((SPILL_ENVIADO, [client_id, csv, self.spill_enviado[client_id][csv]]))
+        return entradas
+
+
     def eliminar(self, es_global):
         if es_global:
             try:
@@ -131,8 +191,8 @@ class JoinerNode:
                 for client_id, paths in self.archivos_path.items():
                     for tipo, path in paths.items():
                         try:
-                            if os.path.exists(path):
-                                os.remove(path)
+                            if path and os.path.exists(path):
+                                borrar_segmento(path)
                                 print(f"Archivo borrado: {path}")
                         except Exception as e:
                             print(f"Error borrando {path}: {e}")
@@ -141,11 +201,13 @@ class JoinerNode:
                 logging.error(f"Error limpiando volumen en shutdown global: {e}")
         
         self.informacion_movies.clear()
+        self.indice_movies.clear()
         self.termino_movies.clear()
         self.informacion_csvs.clear()
         self.locks.clear()
         self.archivos_en_disco.clear()
         self.archivos_path.clear()
+        self.spill_enviado.clear()
 
 
 
@@ -159,6 +221,11 @@ class JoinerNode:
             3: [],
             4: [],
         }
+        # id -> title por consulta, se mantiene a medida que llegan las movies
+        self.indice_movies[client_id] = {
+            3: {},
+            4: {},
+        }
 
         self.locks[client_id] = {
             "ratings": threading.Lock(),
@@ -170,6 +237,11 @@ class JoinerNode:
             "credits": False,
         }
 
+        self.spill_enviado[client_id] = {
+            "ratings": None,
+            "credits": None,
+        }
+
         self.ultimo_batch_id[client_id] = {
             "ratings": -1,
             "credits": -1,
@@ -190,6 +262,9 @@ class JoinerNode:
     def consulta_habilitada(self, request_id, client_id):
         if not self.termino_movies[client_id][request_id]:
             return False
+        if JOIN_STREAMING and self.hay_pendientes(request_id, client_id):
+            # Lo que llego antes del EOF de movies se vacia de una vez
+            return True
         if request_id == 3:
             return self.informacion_csvs[client_id]["ratings"][TERMINO] or (self.informacion_csvs[client_id]["ratings"][LINEAS] >= BATCH_RATINGS) or self.archivos_en_disco[client_id]["ratings"]
         if request_id == 4:
@@ -197,12 +272,59 @@ class JoinerNode:
 
         return False
 
+    def hay_pendientes(self, request_id, client_id):
+        csv = "ratings" if request_id == 3 else "credits"
+        return self.informacion_csvs[client_id][csv][LINEAS] > 0 or self.archivos_en_disco[client_id][csv]
+
+
+    def probe_directo(self, request_id, client_id):
+        if not JOIN_STREAMING or client_id not in self.informacion_csvs:
+            return False
+        return self.termino_movies[client_id][request_id] and not self.hay_pendientes(request_id, client_id)
+
+
+    def probar_batch(self, request_id, mensaje, canal, destino, enviar_func, client_id):
+        # Sin buffer ni spill: el lado de movies ya esta completo en el indice
+        filas = obtener_filas(mensaje)
+        movies_dict = self.indice_movies[client_id][request_id]
+        message_id = obtener_message_id(mensaje)
+        if request_id == 3:
+            self.procesar_y_enviar_batch_ratings(filas, movies_dict, canal, destino, mensaje, enviar_func, message_id)
+        else:
+            self.procesar_y_enviar_batch_credit(filas, movies_dict, canal, destino, mensaje, enviar_func, message_id)
+
+
+    def publicar_filtro_bloom(self, request_id, canal, mensaje, client_id):
+        # Sin falsos negativos: el broker solo descarta filas que no pueden joinear
+        if BLOOM_FALSOS_POSITIVOS <= 0:
+            return
+        indice = self.indice_movies[client_id][request_id]
+        filtro = FiltroBloom.para(len(indice), BLOOM_FALSOS_POSITIVOS)
+        for movie_id in indice:
+            filtro.agregar(movie_id)
+        logging.info(f"Filtro de Bloom para consulta {request_id} del cliente {client_id}: {len(indice)} ids, {filtro.bits} bits")
+        publicar_filtro(canal, mensaje, filtro.serializar(), JOINER_ID)
+
+
     def handlear_movies_batch(self, request_id, datos, client_id):
-        df = create_dataframe(datos)
+        df = proyectar_columnas(create_dataframe(datos), ESQUEMA_MOVIES)
         self.informacion_movies[client_id][request_id].append(df)
+        self.indexar_movies(client_id, request_id, df)
         self.transaction.commit(RESULT, [client_id, request_id, df])
 
 
+    def indexar_movies(self, client_id, request_id, movies):
+        indice = self.indice_movies[client_id][request_id]
+        for movie in movies:
+            indice[str(movie["id"])] = movie["title"]
+
+
+    def reconstruir_indice(self, client_id, request_id):
+        # Una sola vez al recuperar el estado, despues de reproducir el log
+        self.indice_movies[client_id][request_id] = {}
+        self.indexar_movies(client_id, request_id, concat_data(self.informacion_movies[client_id][request_id]))
+
+
     def almacenar_csv(self, request_id, datos, client_id, mensaje):
         csv = "ratings" if request_id == 3 else "credits"
         batch_id = mensaje['headers'].get('BatchID')
@@ -219,20 +341,10 @@ class JoinerNode:
             bsize = BATCH_RATINGS if csv == "ratings" else BATCH_CREDITS
             if self.informacion_csvs[client_id][csv][LINEAS] >= bsize:
                 with self.locks[client_id][csv]:
-                    df_total = []
-                    ultimo_batch_id = None
-                    for chunk in self.informacion_csvs[client_id][csv][DATOS]:
-                        batch_id = chunk["batch_id"]
-                        for row in chunk["datos"]:
-                            row["_batch_id"] = batch_id
-                            df_total.append(row)
-                        ultimo_batch_id = batch_id
-
-                    write_dicts_to_csv(
-                        self.archivos_path[client_id][csv],
-                        df_total,
-                        append=self.archivos_en_disco[client_id][csv]
-                    )
+                    batches = [(chunk["batch_id"], chunk["datos"]) for chunk in self.informacion_csvs[client_id][csv][DATOS]]
+                    ultimo_batch_id = batches[-1][0] if batches else None
+
+                    agregar_batches(self.archivos_path[client_id][csv], batches)
                     self.archivos_en_disco[client_id][csv] = True
 
                     if ultimo_batch_id is not None:
@@ -253,84 +365,73 @@ class JoinerNode:
                 logging.info(f"Filepath doesn't exist {file_path}")
                 return
 
-            with open(file_path, newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                batch = []
-                ultimo_batch_id = None
-                for row in reader:
-                    batch_id = row.pop('_batch_id', None)
-
-                    if ultimo_batch_id is None:
-                        ultimo_batch_id = batch_id
-                    if batch_id != ultimo_batch_id or len(batch) >= batch_size:
-                        if batch:
-                            yield batch, ultimo_batch_id
-                        batch = []
-                        ultimo_batch_id = batch_id
-                    batch.append(row)
-                if batch:
-                    yield batch, ultimo_batch_id
-
-
-    def enviar_resultados_disco(self, datos, client_id, canal, destino, mensaje, enviar_func, request_id):
+            # Despues de un reinicio se retoma en el primer batch sin enviar
+            yield from leer_batches(file_path, batch_size, self.spill_enviado[client_id][csv_name])
+
+
+    def enviar_resultados_disco(self, movies_dict, client_id, canal, destino, mensaje, enviar_func, request_id):
         csv = "ratings" if request_id == 3 else "credits"
 
+        enviado = None
         for batch, batch_id in self.leer_batches_de_disco(client_id, csv):
-            batch_mensaje = mensaje.copy()
-            batch_mensaje['headers'] = batch_mensaje.get('headers', {}).copy()
-            batch_mensaje['headers']['MessageID'] = str(batch_id)
-
+            if enviado is not None and batch_id != enviado:
+                asegurar_publicado()
+                self.marcar_spill_enviado(client_id, csv, enviado)
+            # Cada batch del segmento sale con su propio MessageID: con el del
+            # mensaje el aggregator descartaba todos menos el primero
+            batch_mensaje = {**mensaje, 'headers': {**mensaje['headers'], 'MessageID': str(batch_id)}}
             if request_id == 3:
-                self.procesar_y_enviar_batch_ratings(batch, datos, canal, destino, mensaje, enviar_func, batch_id)
+                self.procesar_y_enviar_batch_ratings(batch, movies_dict, canal, destino, batch_mensaje, enviar_func, batch_id)
             else:
-                self.procesar_y_enviar_batch_credit(batch, datos, canal, destino, mensaje, enviar_func, batch_id)
+                self.procesar_y_enviar_batch_credit(batch, movies_dict, canal, destino, batch_mensaje, enviar_func, batch_id)
+            enviado = batch_id
             batch = None
+        if enviado is not None:
+            asegurar_publicado()
+            self.marcar_spill_enviado(client_id, csv, enviado)
         try:
-            os.remove(self.archivos_path[client_id][csv])
+            borrar_segmento(self.archivos_path[client_id][csv])
         except Exception as e:
             logging.error(f"No se pudo borrar el archivo temporal {csv}: {e}")
 
         self.archivos_en_disco[client_id][csv] = False
+        self.spill_enviado[client_id][csv] = None
         self.transaction.commit(DISK, [client_id, csv, False])
 
-    def procesar_y_enviar_batch_credit(self, batch, informacion_movies, canal, destino, mensaje, enviar_func, message_id):
+    def marcar_spill_enviado(self, client_id, csv, batch_id):
+        # Solo despues de asegurar_publicado: con el batch todavia en el
+        # coalescer, un reinicio lo salteaba y sus filas se perdian
+        self.spill_enviado[client_id][csv] = batch_id
+        self.transaction.commit(SPILL_ENVIADO, [client_id, csv, batch_id])
+
+    def procesar_y_enviar_batch_credit(self, batch, movies_dict, canal, destino, mensaje, enviar_func, message_id):
         if batch is None or len(batch) == 0:
             return
 
-        movies_dict = {entry['id']: entry['title'] for entry in informacion_movies}
-
         resultado_final = []
 
         for row in batch:
-            movie_id = row.get('id')
-            cast_raw = row.get('cast', '[]')
-
-            try:
-                cast_list = ast.literal_eval(cast_raw)
-            except (ValueError, SyntaxError):
-                cast_list = []
-
-            if movie_id in movies_dict and isinstance(cast_list, list) and len(cast_list) > 0:
-                for miembro in cast_list:
-                    nombre_actor = miembro.get('name')
+            movie_id = str(row.get('id'))
+            if movie_id in movies_dict:
+                for nombre_actor in extraer_claves(row.get('cast', '[]'), 'name'):
                     if nombre_actor:
                         resultado_final.append({'id': movie_id, 'name': nombre_actor})
 
+        resultado_final = combinar(4, proyectar_columnas(resultado_final, ESQUEMA_SALIDA[4]))
         if len(resultado_final) > 0:
             self.transaction.commit(ACCION, [message_id, resultado_final, ENVIAR])
             enviar_func(canal, destino, resultado_final, mensaje, "RESULT")
             self.transaction.commit(ACCION, [message_id, "", NO_ENVIAR])
 
 
-    def procesar_y_enviar_batch_ratings(self, batch, informacion_movies, canal, destino, mensaje, enviar_func, message_id):
+    def procesar_y_enviar_batch_ratings(self, batch, movies_dict, canal, destino, mensaje, enviar_func, message_id):
         if batch is None or len(batch) == 0:
             return
 
-        movies_dict = {entry["id"]: entry["title"] for entry in informacion_movies}
         resultado_final = []
 
         for row in batch:
-            movie_id = row.get("id")
+            movie_id = str(row.get("id"))
             if movie_id in movies_dict:
                 merged = {
                     "id": movie_id,
@@ -339,6 +440,7 @@ class JoinerNode:
                 }
                 resultado_final.append(merged)
 
+        resultado_final = combinar(3, proyectar_columnas(resultado_final, ESQUEMA_SALIDA[3]))
         if len(resultado_final) > 0:
             self.transaction.commit(ACCION, [message_id, resultado_final, ENVIAR])
             enviar_func(canal, destino, resultado_final, mensaje, "RESULT")
@@ -353,15 +455,17 @@ class JoinerNode:
     def limpiar_consulta(self, client_id, request_id):
         csv = "ratings" if request_id == 3 else "credits"
         path = self.archivos_path[client_id][csv]
-        if os.path.exists(path):
+        if path and os.path.exists(path):
             try:
-                os.remove(path)
+                borrar_segmento(path)
             except Exception as ex:
                 logging.error(f"No se pudo borrar ratings temp: {ex}")
         self.archivos_en_disco[client_id][csv] = False
+        self.spill_enviado[client_id][csv] = None
         self.archivos_path[client_id][csv] = ""
         self.borrar_info(csv, client_id)
         self.informacion_movies[client_id][request_id] = []
+        self.indice_movies[client_id][request_id] = {}
         self.transaction.commit(DISK, [client_id, csv, False])
         self.transaction.commit(RESULT, [client_id, request_id, "BORRADO"])
         if client_id in self.ultimo_batch_id:
@@ -370,17 +474,44 @@ class JoinerNode:
                 self.transaction.commit(LAST_BATCH_ID, [str(self.ultimo_batch_id)])  
 
 
-    def ejecutar_consulta(self, informacion_movies, request_id, client_id):
+    def consulta_terminada(self, client_id, request_id):
+        csv = "ratings" if request_id == 3 else "credits"
+        return self.termino_movies[client_id][request_id] and self.informacion_csvs[client_id][csv][TERMINO]
+
+    def liberar_cliente_si_termino(self, client_id):
+        if client_id not in self.informacion_csvs:
+            return
+        if not all(self.consulta_terminada(client_id, request_id) for request_id in CONSULTAS_JOINER):
+            return
+        logging.info(f"Cliente {client_id} terminado, liberando su estado")
+        self.olvidar_cliente(client_id)
+        self.transaction.commit(CLIENTE_TERMINADO, [client_id, True])
+        self.transaction.commit(LAST_BATCH_ID, [str(self.ultimo_batch_id)])
+
+    def olvidar_cliente(self, client_id):
+        for path in self.archivos_path.pop(client_id, {}).values():
+            try:
+                if path and os.path.exists(path):
+                    borrar_segmento(path)
+            except Exception as e:
+                logging.error(f"No se pudo borrar el archivo temporal {path}: {e}")
+        for estado in (self.informacion_movies, self.termino_movies, self.informacion_csvs, self.indice_movies,
+                       self.locks, self.archivos_en_disco, self.spill_enviado, self.ultimo_batch_id):
+            estado.pop(client_id, None)
+        self.clientes_terminados.add(client_id)
+
+
+    def ejecutar_consulta(self, movies_dict, request_id, client_id):
         match request_id:
             case 3:
-                return self.ejecutar_consulta_3(informacion_movies, client_id)
+                return self.ejecutar_consulta_3(movies_dict, client_id)
             case 4:
-                return self.ejecutar_consulta_4(informacion_movies, client_id)
+                return self.ejecutar_consulta_4(movies_dict, client_id)
             case _:
                 logging.warning(f"Consulta desconocida: {request_id}")
                 raise ConsultaInexistente(f"Consulta {request_id} no encontrada")
 
-    def ejecutar_consulta_3(self, informacion_movies, client_id):
+    def ejecutar_consulta_3(self, movies_dict, client_id):
         logging.info(f"[CONSULTA 3 - {client_id}] Ejecutando")    
 
         ratings = concat_data(self.informacion_csvs[client_id]["ratings"][DATOS])
@@ -388,11 +519,10 @@ class JoinerNode:
         if not ratings:
             return False
 
-        movies_dict = {d["id"]: d["title"] for d in informacion_movies}
         resultado = []
 
         for r in ratings:
-            movie_id = r.get("id")
+            movie_id = str(r.get("id"))
             if movie_id in movies_dict:
                 merged = {
                     "id": movie_id,
@@ -404,7 +534,7 @@ class JoinerNode:
         return resultado
 
 
-    def ejecutar_consulta_4(self, informacion_movies, client_id):
+    def ejecutar_consulta_4(self, movies_dict, client_id):
         logging.info(f"[CONSULTA 4 - {client_id}] Ejecutando")    
 
         credits = prepare_data_consult_4(concat_data(self.informacion_csvs[client_id]["credits"][DATOS]))
@@ -413,14 +543,14 @@ class JoinerNode:
         if not credits:
             return False
         
-        lista_movies = [ {"id": d["id"], "title": d["title"]} for d in informacion_movies ]
+        lista_movies = [ {"id": movie_id, "title": title} for movie_id, title in movies_dict.items() ]
 
         merged = []
 
         credits_by_id = {}
 
         for c in credits:
-            credits_by_id.setdefault(c["id"], []).append(c)
+            credits_by_id.setdefault(str(c["id"]), []).append(c)
 
         for movie in lista_movies:
             movie_id = movie["id"]
@@ -448,7 +578,7 @@ class JoinerNode:
 
 
     def handlear_mensaje(self, request_id, tipo_mensaje, mensaje, client_id):
-        contenido = obtener_body(mensaje)
+        contenido = obtener_filas(mensaje)
         if client_id not in self.informacion_csvs:
             self.crear_datos(client_id)
         if tipo_mensaje == "MOVIES":
@@ -462,11 +592,11 @@ class JoinerNode:
             if client_id not in self.informacion_movies:
                 return False
             
-            datos_cliente = self.informacion_movies[client_id]
+            datos_cliente = self.indice_movies[client_id]
             if not datos_cliente or request_id not in datos_cliente:
                 return False
             
-            datos = concat_data(datos_cliente[request_id])
+            movies_dict = datos_cliente[request_id]
 
             if request_id == 3:
                 batch_info = self.informacion_csvs[client_id]["ratings"][DATOS]
@@ -479,16 +609,17 @@ class JoinerNode:
 
             mensaje['headers']['MessageID'] = message_id
 
-            resultado = self.ejecutar_consulta(datos, request_id, client_id)
+            resultado = proyectar_columnas(self.ejecutar_consulta(movies_dict, request_id, client_id), ESQUEMA_SALIDA[request_id])
+            resultado = combinar(request_id, resultado)
 
             self.transaction.commit(ACCION, [message_id, resultado, ENVIAR])
             enviar_func(canal, destino, resultado, mensaje, "RESULT")
             self.transaction.commit(ACCION, [message_id, "", NO_ENVIAR])
 
             if request_id == 3 and self.archivos_en_disco[client_id]["ratings"]:
-                self.enviar_resultados_disco(datos, client_id, canal, destino, mensaje, enviar_func, request_id)
+                self.enviar_resultados_disco(movies_dict, client_id, canal, destino, mensaje, enviar_func, request_id)
             elif request_id == 4 and self.archivos_en_disco[client_id]["credits"]:
-                self.enviar_resultados_disco(datos, client_id, canal, destino, mensaje, enviar_func, request_id)
+                self.enviar_resultados_disco(movies_dict, client_id, canal, destino, mensaje, enviar_func, request_id)
 
         if self.termino_movies[client_id][request_id]:
             if self.informacion_csvs[client_id]["ratings"][TERMINO] or self.informacion_csvs[client_id]["credits"][TERMINO]:
@@ -516,16 +647,26 @@ class JoinerNode:
         if self.transaction.mensaje_duplicado(client_id, message_id, enviar_func, mensaje, canal, destino):
             logging.info(f"Mensaje {message_id} ya procesado, ignorando")
             return
-        
+
+        if client_id in self.clientes_terminados:
+            logging.info(f"Mensaje {message_id} del cliente {client_id} ya terminado, ignorando")
+            mensaje['ack']()
+            return
+
         try:
             if tipo_mensaje == "EOF":
                 logging.info(f"EOF Movies: {request_id} para el cliente {client_id}")
 
                 self.termino_movies[client_id][request_id] = True
                 self.transaction.commit(TERM, [client_id, request_id, True])
+                self.publicar_filtro_bloom(request_id, canal, mensaje, client_id)
                 self.procesar_resultado(request_id, canal, destino, mensaje, enviar_func, client_id)
                 self.enviar_eof(request_id, canal, destino, mensaje, enviar_func, client_id)
+                self.liberar_cliente_si_termino(client_id)
          
+            elif tipo_mensaje in ["RATINGS", "CREDITS"] and self.probe_directo(request_id, client_id):
+                self.probar_batch(request_id, mensaje, canal, destino, enviar_func, client_id)
+
             elif tipo_mensaje in ["MOVIES", "RATINGS", "CREDITS"]:
                 self.handlear_mensaje(request_id, tipo_mensaje, mensaje, client_id)
                 if tipo_mensaje != "MOVIES":
@@ -537,10 +678,14 @@ class JoinerNode:
                 self.informacion_csvs[client_id]["ratings"][TERMINO] = True
                 self.transaction.commit(DATA_TERM, [client_id, "ratings", True])
                 
-                if self.informacion_csvs[client_id]["ratings"][LINEAS] > 0:
+                if self.hay_pendientes(request_id, client_id):
                     self.procesar_resultado(request_id, canal, destino, mensaje, enviar_func, client_id)
+                elif self.termino_movies[client_id][request_id]:
+                    # Con probe directo no queda nada en buffer, pero igual hay que liberar la consulta
+                    self.limpiar_consulta(client_id, request_id)
 
                 self.enviar_eof(request_id, canal, destino, mensaje, enviar_func, client_id)
+                self.liberar_cliente_si_termino(client_id)
 
             elif tipo_mensaje == "EOF_CREDITS":
                 logging.info(f"EOF Credits: {request_id} para el cliente {client_id}")
@@ -548,10 +693,14 @@ class JoinerNode:
                 self.informacion_csvs[client_id]["credits"][TERMINO] = True
                 self.transaction.commit(DATA_TERM, [client_id, "credits", True])
 
-                if self.informacion_csvs[client_id]["credits"][LINEAS] > 0:
+                if self.hay_pendientes(request_id, client_id):
                     self.procesar_resultado(request_id, canal, destino, mensaje, enviar_func, client_id)
+                elif self.termino_movies[client_id][request_id]:
+                    # Con probe directo no queda nada en buffer, pero igual hay que liberar la consulta
+                    self.limpiar_consulta(client_id, request_id)
 
                 self.enviar_eof(request_id, canal, destino, mensaje, enviar_func, client_id)
+                self.liberar_cliente_si_termino(client_id)
 
             mensaje['ack']()
         except ConsultaInexistente as e:
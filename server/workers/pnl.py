@@ -3,7 +3,8 @@ from multiprocessing import Process
 import os
 import sys
 from common.utils import EOF, concat_data, create_dataframe, get_batch_limits, obtener_message_id, obtener_nombre_contenedor, parse_datos
-from common.communication import obtener_body, obtener_client_id, obtener_query, obtener_tipo_mensaje, run
+from common.combiners import combinar
+from common.communication import obtener_client_id, obtener_filas, obtener_query, obtener_tipo_mensaje, run
 from transformers import pipeline # type: ignore
 import torch # type: ignore
 from common.exceptions import ConsultaInexistente, ErrorCargaDelEstado
@@ -35,6 +36,8 @@ class PnlNode:
         )
         self.resultados_parciales = {}
         self.lineas_actuales = {}
+        # mensaje_duplicado descarta lo ya procesado: los acks pueden ir acumulados
+        self.deduplica = True
         self.transaction = Transaction(TMP_DIR)
         self.transaction.cargar_estado(self)
 
@@ -51,6 +54,18 @@ class PnlNode:
             self.lineas_actuales[client_id] = int(lineas)
 
 
+    def entradas_snapshot(self):
+        entradas = []
+        for client_id, batches in self.resultados_parciales.items():
+            if not batches:
+                entradas.append((RESULT, [client_id, 5, "BORRADO", 0]))
+            lineas = 0
+            for batch in batches:
+                lineas += len(batch)
+                entradas.append((RESULT, [client_id, 5, batch, lineas]))
+        return entradas
+
+
     def eliminar(self, es_global):
         self.resultados_parciales.clear()
         self.lineas_actuales.clear()
@@ -106,7 +121,7 @@ class PnlNode:
         for fila, resultado in zip(datos, sentiments):
             fila['sentiment'] = resultado.get('label', 'UNKNOWN')
         self.borrar_info(client_id)
-        return datos
+        return combinar(5, datos)
         
 
     def procesar_mensajes(self, canal, destino, mensaje, enviar_func):
@@ -128,7 +143,7 @@ class PnlNode:
                 enviar_func(canal, destino, EOF, mensaje, EOF)
                 self.transaction.commit(ACCION, [message_id, "", NO_ENVIAR])
             else:
-                self.guardar_datos(obtener_body(mensaje), client_id)
+                self.guardar_datos(obtener_filas(mensaje), client_id)
                 if self.lineas_actuales[client_id] >= BATCH_PNL:
                     resultado = self.ejecutar_consulta(request_id, client_id)
                     self.transaction.commit(ACCION, [message_id, resultado, ENVIAR])